@@ -25,6 +25,9 @@ class TextRepresenter(object):
     def getTextRepresentation(self,text):
         raise NotImplementedError
     
+    def getStemPositions(self,text):
+        raise NotImplementedError
+    
 
 
 class PorterStemmer(TextRepresenter):
@@ -49,6 +52,22 @@ class PorterStemmer(TextRepresenter):
         ret={a:b for (a,b) in ret.items()}
         return ret
     
+    def getStemPositions(self,text):
+        """ Return the positions of the stems of a string, the same stems
+        as getTextRepresentation(), in the same order. The positions count
+        every word, stop words included, so that the stems of a phrase
+        keep their distances.
+        :param text: string, input text
+        :return: dictionary of {stem: list of positions}
+        """
+        tab=re.findall(r"\w+",text,re.UNICODE)
+        positions={}
+        for pos, word in enumerate(tab):
+            word=word.lower()
+            if word not in self.stopWords:
+                positions.setdefault(porter.stem(word),[]).append(pos)
+        return positions
+    
     
         
     def _setStopWords(self):
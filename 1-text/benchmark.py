@@ -0,0 +1,440 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Benchmarks of the index and of the models.
+Usage: python benchmark.py [corpus] [output directory]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+import ParserCACM
+import TextRepresenter
+import boolean
+import indexation
+import modeles
+import positional
+import query
+import retrieval
+import tiers
+from query import QueryParserCACM
+
+
+def benchPostingsFormats(corpus, outDir, parser=None, stemmer=None):
+    """ Compare the text and the binary formats of the inverted index:
+    size on disk, build time and time to decode every posting list.
+    :return: dict {format: {"size", "build", "decode"}}
+    """
+    parser = parser or ParserCACM.ParserCACM()
+    stemmer = stemmer or TextRepresenter.PorterStemmer()
+    results = {}
+    for fmt in ("text", "binary"):
+        idx = indexation.Index("bench_" + fmt, outDir, postingsFormat=fmt)
+        start = time.time()
+        idx.indexation(corpus, parser, stemmer)
+        build = time.time() - start
+        start = time.time()
+        for stem in idx.getStems():
+            idx.getPostings(stem)
+        decode = time.time() - start
+        results[fmt] = {"size": os.path.getsize(idx.invertedPath),
+                        "build": build, "decode": decode}
+    print("format | size (bytes) | build (s) | decode (s)")
+    for fmt, res in results.items():
+        print("%6s | %12d | %9.3f | %10.3f"
+              % (fmt, res["size"], res["build"], res["decode"]))
+    return results
+
+
+def benchWorkers(corpus, outDir, workersList=(1, 2, 4)):
+    """ Time the indexation with different numbers of worker processes.
+    :return: dict {workers: seconds}
+    """
+    results = {}
+    for workers in workersList:
+        idx = indexation.Index("bench_workers", outDir)
+        start = time.time()
+        idx.indexation(corpus, ParserCACM.ParserCACM(),
+                       TextRepresenter.PorterStemmer(), workers=workers)
+        results[workers] = time.time() - start
+    for workers, seconds in results.items():
+        print("%2d worker(s): %.3fs (speedup %.2f)"
+              % (workers, seconds, results[workersList[0]] / seconds))
+    return results
+
+
+def benchPositions(corpus, outDir, phrases, parser=None, stemmer=None):
+    """ Compare the indexation with and without the positions of the 
+    stems, and time some phrase queries on the positions.
+    :param phrases: list of strings
+    :return: dict {"plain", "positions": {"size", "build"}, 
+                   "phrase": mean seconds per phrase}
+    """
+    parser = parser or ParserCACM.ParserCACM()
+    stemmer = stemmer or TextRepresenter.PorterStemmer()
+    results = {}
+    for name, positions in (("plain", False), ("positions", True)):
+        idx = indexation.Index("bench_" + name, outDir)
+        start = time.time()
+        idx.indexation(corpus, parser, stemmer, positions=positions)
+        results[name] = {"build": time.time() - start,
+                         "size": os.path.getsize(idx.invertedPath) + 
+                                 (os.path.getsize(idx.positionsPath) 
+                                  if positions else 0)}
+    engine = positional.PositionalEngine(idx, stemmer)
+    start = time.time()
+    for phrase in phrases:
+        engine.getPhraseDocs(phrase)
+    results["phrase"] = (time.time() - start) / max(1, len(phrases))
+    print("    index | size (bytes) | build (s)")
+    for name in ("plain", "positions"):
+        print("%9s | %12d | %9.3f" 
+              % (name, results[name]["size"], results[name]["build"]))
+    print("phrase queries: %.2fms per query" % (1000 * results["phrase"]))
+    return results
+
+
+def benchMmap(index, nLookups=3):
+    """ Compare the lookups of every document vector and posting list
+    through file reads and through the memory maps.
+    :param index: an indexed Index object
+    :return: dict {"files": seconds, "mmap": seconds}
+    """
+    def lookups():
+        start = time.time()
+        for i in range(nLookups):
+            for docId in index.getDocsID():
+                index.getTfsForDoc(docId)
+            for stem in index.getStems():
+                index.getPostings(stem)
+        return time.time() - start
+    index.closeMmap()
+    results = {"files": lookups()}
+    index.openMmap(warmup=True)
+    results["mmap"] = lookups()
+    index.closeMmap()
+    print("lookups through files: %.3fs, through mmap: %.3fs"
+          % (results["files"], results["mmap"]))
+    return results
+
+
+def benchDocStore(index, pagesNbr=100, pageSize=10):
+    """ Time the reading of pages of results: through the source files 
+    (one open and one read per doc, see Index.docFrom) and through the 
+    doc store (one decompression per block, see Index.getDocs()).
+    :param index: an indexed Index object
+    :return: dict {"files", "store": mean seconds per page, "blocks": 
+                   mean number of decompressed blocks per page}"""
+    rng = np.random.RandomState(0)
+    pages = [rng.choice(index.getDocsID(), pageSize).tolist() 
+             for i in range(pagesNbr)]
+    start = time.time()
+    for page in pages:
+        for docId in page:
+            srcPath, pos, length = index.docFrom[str(docId)].split(';')
+            with open(srcPath, 'r') as f:
+                f.seek(int(pos))
+                f.read(int(length))
+    results = {"files": (time.time() - start) / pagesNbr}
+    index.openMmap()
+    decompressions = index.store.decompressions
+    start = time.time()
+    for page in pages:
+        index.getDocs(page)
+    results["store"] = (time.time() - start) / pagesNbr
+    results["blocks"] = (index.store.decompressions 
+                         - decompressions) / pagesNbr
+    index.closeMmap()
+    print("page of %d docs: %.2fms from the source files, %.2fms from the "
+          "doc store (%.1f blocks)" % (pageSize, 1000 * results["files"], 
+                                       1000 * results["store"], 
+                                       results["blocks"]))
+    return results
+
+
+def benchPostingCache(index, texts, txtRepr=None, stemsNbr=100):
+    """ Time the posting lists of some queries read from the files, then 
+    through the posting cache warmed up with the same queries.
+    :param index: an Index object
+    :param texts: list of query texts, see query.readQueryLog()
+    :return: dict {"files": seconds, "cache": seconds, "stats": counters 
+                   of the cache}"""
+    txtRepr = txtRepr or TextRepresenter.PorterStemmer()
+    queries = [txtRepr.getTextRepresentation(text) for text in texts]
+    def lookups():
+        start = time.time()
+        for query in queries:
+            for stem in query:
+                index.getPostings(stem)
+        return time.time() - start
+    maxBytes = index.postingCache.maxBytes
+    index.postingCache.maxBytes = 0
+    index.postingCache.discard(index.name)
+    results = {"files": lookups()}
+    index.postingCache.maxBytes = maxBytes
+    index.warmPostingCache(texts, txtRepr, stemsNbr)
+    results["cache"] = lookups()
+    results["stats"] = index.getPostingCacheStats()
+    print("posting lists of the queries: %.3fs from the files, %.3fs "
+          "through the cache" % (results["files"], results["cache"]))
+    print(results["stats"])
+    return results
+
+
+def loadQueries(qryFile, relFile):
+    """ Read all the queries of a CACM query file
+    :return: list of Query objects"""
+    parser = QueryParserCACM(qryFile, relFile)
+    queries = []
+    query = parser.nextQuery()
+    while query is not None:
+        queries.append(query)
+        query = parser.nextQuery()
+    return queries
+
+
+def benchQueries(models, queries, stemmer=None):
+    """ Time the scoring of some queries by some models.
+    :param models: dict {name: IRmodel object}
+    :param queries: list of Query objects
+    :return: dict {name: mean seconds per query}
+    """
+    stemmer = stemmer or TextRepresenter.PorterStemmer()
+    queries = [stemmer.getTextRepresentation(q.getText()) for q in queries]
+    results = {}
+    for name, model in models.items():
+        start = time.time()
+        for query in queries:
+            model.getScores(query)
+        results[name] = (time.time() - start) / len(queries)
+    for name, seconds in results.items():
+        print("%20s: %.2fms per query" % (name, 1000 * seconds))
+    return results
+
+
+def benchBatch(models, queries, stemmer=None):
+    """ Compare the scoring of some queries one at a time with 
+    IRmodel.getScoresBatch().
+    :param models: dict {name: IRmodel object}
+    :param queries: list of Query objects
+    :return: dict {name: {"loop": seconds, "batch": seconds}}
+    """
+    stemmer = stemmer or TextRepresenter.PorterStemmer()
+    queries = [stemmer.getTextRepresentation(q.getText()) for q in queries]
+    results = {}
+    for name, model in models.items():
+        start = time.time()
+        for query in queries:
+            model.getScores(query)
+        loop = time.time() - start
+        start = time.time()
+        model.getScoresBatch(queries)
+        results[name] = {"loop": loop, "batch": time.time() - start}
+    print("%d queries:" % len(queries))
+    for name, res in results.items():
+        print("%20s: %.3fs one at a time, %.3fs in batch"
+              % (name, res["loop"], res["batch"]))
+    return results
+
+
+def benchTopK(model, queries, k=10, stemmer=None, budget=None):
+    """ Compare the exhaustive ranking of a model with its top-k retrieval
+    strategies (see retrieval.py and impacts.py).
+    :param model: an IRmodel that implements getScorer(), like Okapi
+    :param queries: list of Query objects
+    :param budget: int, the number of postings of the "saat" strategy
+    :return: dict {"ranking" or strategy: {"seconds": mean seconds, 
+                   "skipped": fraction of the postings that were skipped,
+                   "overlap": fraction of the top k of the "exhaustive"
+                   strategy that was found}}
+    """
+    stemmer = stemmer or TextRepresenter.PorterStemmer()
+    queries = [stemmer.getTextRepresentation(q.getText()) for q in queries]
+    results = {}
+    start = time.time()
+    for query in queries:
+        model.getRanking(query, k)
+    results["ranking"] = {"seconds": (time.time() - start) / len(queries),
+                          "skipped": 0., "overlap": 1.}
+    exact = None
+    strategy, previousBudget = model.strategy, model.budget
+    for name in modeles.STRATEGIES:
+        model.setStrategy(name, budget)
+        postingsNbr, scoredNbr, found = 0, 0, 0
+        start = time.time()
+        tops = []
+        for query in queries:
+            tops.append(model.getTopScores(query, k))
+            postingsNbr += model.postingsNbr
+            scoredNbr += model.scoredNbr
+        seconds = time.time() - start
+        exact = exact or tops
+        for top, exactTop in zip(tops, exact):
+            found += len({d for (d, s) in top} & {d for (d, s) in exactTop})
+        results[name] = {"seconds": seconds / len(queries),
+                         "skipped": (1 - scoredNbr / postingsNbr 
+                                     if postingsNbr else 0.),
+                         "overlap": found / max(1, sum(map(len, exact)))}
+    model.setStrategy(strategy, previousBudget)
+    print("top %d:" % k)
+    for name, res in results.items():
+        print("%10s: %.2fms per query, %.1f%% of the postings skipped, "
+              "%.1f%% of the top %d found" 
+              % (name, 1000 * res["seconds"], 100 * res["skipped"], 
+                 100 * res["overlap"], k))
+    return results
+
+
+def benchBoolean(model, queries, k=10, minDocs=10, stemmer=None):
+    """ Compare the ranking of every doc by a model with the ranking of 
+    the candidates of a Boolean query: the conjunction of the stems of the
+    query, or their disjunction if it finds less than minDocs docs (see 
+    boolean.BooleanEngine.search()).
+    :param model: an IRmodel object
+    :param queries: list of Query objects
+    :return: dict {"ranking", "boolean": mean seconds per query, 
+                   "decoded": fraction of the postings of the query stems
+                   that were decoded, "candidates": mean number of 
+                   candidates}
+    """
+    stemmer = stemmer or TextRepresenter.PorterStemmer()
+    queries = [stemmer.getTextRepresentation(q.getText()) for q in queries]
+    engine = boolean.BooleanEngine(model.index, stemmer)
+    start = time.time()
+    for query in queries:
+        model.getRanking(query, k)
+    results = {"ranking": (time.time() - start) / len(queries)}
+    postingsNbr, decodedNbr, candidatesNbr = 0, 0, 0
+    start = time.time()
+    for query in queries:
+        candidates = engine.search(query, minDocs)
+        model.getCandidatesRanking(query, candidates, k)
+        postingsNbr += engine.postingsNbr
+        decodedNbr += engine.decodedNbr
+        candidatesNbr += len(candidates)
+    results["boolean"] = (time.time() - start) / len(queries)
+    results["decoded"] = decodedNbr / postingsNbr if postingsNbr else 0.
+    results["candidates"] = candidatesNbr / len(queries)
+    print("ranking: %.2fms per query, Boolean candidates: %.2fms per "
+          "query, %.1f candidates, %.1f%% of the postings decoded"
+          % (1000 * results["ranking"], 1000 * results["boolean"],
+             results["candidates"], 100 * results["decoded"]))
+    return results
+
+
+def benchTiers(tiered, queries, k=10, tierWeight=2., depth=None, 
+               stemmer=None):
+    """ Compare the top k of a two-tier index always searched on the full
+    index (the scores of the first tier being one more posting list) with
+    the early exit of modeles.TieredModel, for Okapi.
+    :param tiered: an indexed tiers.TieredIndex object
+    :param queries: list of Query objects
+    :return: dict {"full", "tiered": {"seconds": mean seconds per query,
+                   "postings": mean number of postings of the lists
+                   traversed}, "answered": fraction of the queries
+                   answered by the first tier}
+    """
+    stemmer = stemmer or TextRepresenter.PorterStemmer()
+    queries = [stemmer.getTextRepresentation(q.getText()) for q in queries]
+    tier, full = tiered.getTiers()
+    model = modeles.TieredModel(modeles.Okapi(full), modeles.Okapi(tier),
+                                tierWeight, depth)
+    results = {}
+    postingsNbr = 0
+    start = time.time()
+    for query in queries:
+        model.postingsNbr = 0
+        top, fullPostings, scored = retrieval.topK(
+            full, model.fullModel.getScorer(query), k, model.strategy, 
+            dict(model.getTierScores(query)))
+        postingsNbr += model.postingsNbr + fullPostings
+    results["full"] = {"seconds": (time.time() - start) / len(queries),
+                       "postings": postingsNbr / len(queries)}
+    postingsNbr, answered = 0, 0
+    start = time.time()
+    for query in queries:
+        model.getTopScores(query, k)
+        postingsNbr += model.postingsNbr
+        answered += model.tierAnswered
+    results["tiered"] = {"seconds": (time.time() - start) / len(queries),
+                         "postings": postingsNbr / len(queries)}
+    results["answered"] = answered / len(queries)
+    for name in ("full", "tiered"):
+        print("%6s: %.2fms per query, %.0f postings" 
+              % (name, 1000 * results[name]["seconds"], 
+                 results[name]["postings"]))
+    print("%.1f%% of the queries answered by the first tier" 
+          % (100 * results["answered"]))
+    return results
+
+
+def benchBM25(index, queries, params=((1.2, 0.75), (1, 1), (2, 0.5)),
+              stemmer=None):
+    """ Compare the per-doc BM25 scoring of Okapi with the vectorized one,
+    in float64 and float32, and for a batch of (k, b) values.
+    :param index: an Index object without added or deleted docs
+    :param queries: list of Query objects
+    :return: dict {name: mean seconds per query}
+    """
+    stemmer = stemmer or TextRepresenter.PorterStemmer()
+    queries = [stemmer.getTextRepresentation(q.getText()) for q in queries]
+    model = modeles.Okapi(index, *params[0])
+    runs = {"per doc": lambda q: [model.score(q, docId) 
+                                  for docId in index.getDocsID()],
+            "vectorized": lambda q: model.getScoresArray(q),
+            "float32": lambda q: model.getScoresArray(q, dtype=np.float32),
+            "%d (k, b)" % len(params): 
+                lambda q: model.getScoresArray(q, list(params))}
+    results = {}
+    for name, run in runs.items():
+        start = time.time()
+        for query in queries:
+            run(query)
+        results[name] = (time.time() - start) / len(queries)
+        print("%12s: %.2fms per query" % (name, 1000 * results[name]))
+    return results
+
+
+if __name__ == "__main__":
+    corpus = sys.argv[1] if len(sys.argv) > 1 else "cacm/cacm.txt"
+    outDir = sys.argv[2] if len(sys.argv) > 2 else "gendata"
+    os.makedirs(outDir, exist_ok=True)
+    benchPostingsFormats(corpus, outDir)
+    benchWorkers(corpus, outDir)
+    benchPositions(corpus, outDir, ["Chinese Remainder theorem", 
+                                    "programming language", 
+                                    "theory of computation"])
+    index = indexation.Index("bench", outDir)
+    index.indexation(corpus, ParserCACM.ParserCACM(),
+                     TextRepresenter.PorterStemmer())
+    benchMmap(index)
+    benchDocStore(index)
+    qryFile = os.path.splitext(corpus)[0] + ".qry"
+    relFile = os.path.splitext(corpus)[0] + ".rel"
+    if os.path.exists(qryFile):
+        benchQueries({"Vectoriel tf-idf": 
+                      modeles.Vectoriel(index, modeles.TfidfWeighter(index)),
+                      "Okapi": modeles.Okapi(index),
+                      "Unigram Jelinek-Mercer": 
+                      modeles.UnigramLanguage(index),
+                      "Unigram Dirichlet": 
+                      modeles.UnigramLanguage(index, smoothing="dirichlet")},
+                     loadQueries(qryFile, relFile))
+        benchPostingCache(index, query.readQueryLog(qryFile))
+        benchBatch({"Vectoriel tf-idf": 
+                    modeles.Vectoriel(index, modeles.TfidfWeighter(index)),
+                    "Okapi": modeles.Okapi(index),
+                    "Unigram Dirichlet":
+                    modeles.UnigramLanguage(index, smoothing="dirichlet")},
+                   loadQueries(qryFile, relFile))
+        benchTopK(modeles.Okapi(index), loadQueries(qryFile, relFile))
+        benchBoolean(modeles.Okapi(index), loadQueries(qryFile, relFile))
+        benchBM25(index, loadQueries(qryFile, relFile))
+        tiered = tiers.TieredIndex("benchtiers", outDir)
+        tiered.indexation(corpus, ParserCACM.ParserCACM(),
+                          TextRepresenter.PorterStemmer())
+        tiered.openMmap()
+        benchTiers(tiered, loadQueries(qryFile, relFile))
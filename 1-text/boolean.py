@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+
+""" Boolean queries: the docs that contain all (AND), any (OR) or none
+(NOT) of some stems. A conjunction is evaluated by leapfrogging over the
+posting lists, shortest first: each list jumps to the next candidate doc
+with its skip pointers (the last doc of each block, see
+Index.computeBlocks()), then by galloping search inside the block, so
+only the blocks that may hold a candidate are decoded.
+The docs found can be ranked by any model, see
+IRmodel.getCandidatesRanking().
+
+A query is a tree of tuples: ("term", stem), ("and", [children]),
+("or", [children]) or ("not", child), see BooleanEngine.parse().
+"""
+
+import re
+
+import numpy as np
+
+
+def gallop(values, target, lo=0):
+    """ Return the position of the first value >= target in a sorted
+    array, starting at lo: the step doubles until the target is passed,
+    then the last step is searched by bisection.
+    :param values: sorted array
+    :param target: the wanted value
+    :param lo: int, the first position searched
+    :return: int, len(values) if all the values are < target"""
+    step = 1
+    hi = lo
+    while hi < len(values) and values[hi] < target:
+        lo = hi + 1
+        hi += step
+        step *= 2
+    hi = min(hi, len(values))
+    return lo + int(np.searchsorted(values[lo:hi], target))
+
+
+def makeNode(op, children):
+    """ Return an "and" or "or" node of a query tree, without its empty
+    children, None if it has none, its child if it has only one """
+    children = [child for child in children if child is not None]
+    if len(children) <= 1:
+        return children[0] if children else None
+    return (op, children)
+
+
+def conjunction(query):
+    """ Return the tree of the docs that contain all the stems of a query
+    :param query: dict {stem: frequency}"""
+    return makeNode("and", [("term", stem) for stem in query])
+
+
+def relax(tree):
+    """ Return the disjunctive version of a query tree: in each AND, the
+    docs must contain one of the positive children instead of all of them,
+    the NOT children still exclude docs"""
+    if tree is None or tree[0] in ("term", "not"):
+        return tree
+    children = [relax(child) for child in tree[1]]
+    if tree[0] == "or":
+        return ("or", children)
+    positives = [child for child in children if child[0] != "not"]
+    negatives = [child for child in children if child[0] == "not"]
+    return makeNode("and", [makeNode("or", positives)] + negatives)
+
+
+class ArrayCursor():
+    """ A cursor on a sorted array of doc numbers, already in memory """
+    def __init__(self, docNos):
+        self.docNos = docNos
+        self.pos = 0
+
+    def size(self):
+        """ Return the number of docs of the cursor """
+        return len(self.docNos)
+
+    def nextGeq(self, docNo):
+        """ Move to the first doc number >= docNo
+        :return: int, this doc number, None if there is none"""
+        self.pos = gallop(self.docNos, docNo, self.pos)
+        if self.pos == len(self.docNos):
+            return None
+        return int(self.docNos[self.pos])
+
+
+class SkipCursor():
+    """ A cursor on the posting list of a stem in an index (or a segment):
+    it skips the blocks whose last doc is lower than the wanted doc, and
+    decodes only the blocks it stops in (see Index.getPostingsBlock())."""
+    def __init__(self, index, stem):
+        """
+        :param index: the Index object (one segment)
+        :param stem: string, the stem of the posting list
+        """
+        self.index = index
+        self.stem = stem
+        stemNo = index.vocab.get(stem)
+        self.df = 0 if stemNo is None else int(index.stemDf[stemNo])
+        self.lastDocs = index.getBlocks(stem)["lastDoc"]
+        # Current block, its doc numbers and the position in it
+        self.block = -1
+        self.docNos = np.zeros(0, dtype=np.int64)
+        self.pos = 0
+        # Number of postings decoded
+        self.decodedNbr = 0
+
+    def size(self):
+        """ Return the number of docs of the posting list """
+        return self.df
+
+    def nextGeq(self, docNo):
+        """ Move to the first doc number >= docNo
+        :return: int, this doc number, None if there is none"""
+        if self.pos == len(self.docNos) or self.docNos[-1] < docNo:
+            block = gallop(self.lastDocs, docNo, self.block + 1)
+            if block >= len(self.lastDocs):
+                self.block, self.pos = block, len(self.docNos)
+                return None
+            self.block = block
+            self.docNos = self.index.getPostingsBlock(self.stem, block)[0]
+            self.decodedNbr += len(self.docNos)
+            self.pos = 0
+        self.pos = gallop(self.docNos, docNo, self.pos)
+        return int(self.docNos[self.pos])
+
+
+class BooleanEngine():
+    """ Evaluates Boolean queries on an index and its segments """
+    def __init__(self, index, txtRepr=None):
+        """
+        :param index: the Index object
+        :param txtRepr: The TextRepresenter object that stems the words of
+            the queries, by default the one used for the indexation
+        """
+        self.index = index
+        self.txtRepr = txtRepr or index.textRepresenter
+        # Number of postings of the stems of the last query, and number of
+        # postings that were decoded to evaluate it (of both queries when
+        # it was relaxed, see search())
+        self.postingsNbr = 0
+        self.decodedNbr = 0
+
+    def parse(self, text):
+        """ Parse a query such as "(parallel OR distributed) algorithm
+        NOT sorting": the operators are upper case, NOT binds tighter than
+        AND, that binds tighter than OR, and AND may be left out. The
+        words are stemmed, a stop word is left out of the query.
+        :param text: string
+        :return: the tree of the query, None if it has no stem
+        :raise ValueError: if the parentheses don't match"""
+        tokens = re.findall(r"\(|\)|[^\s()]+", text)
+        pos = 0
+
+        def peek():
+            return tokens[pos] if pos < len(tokens) else None
+
+        def parseOr():
+            nonlocal pos
+            children = [parseAnd()]
+            while peek() == "OR":
+                pos += 1
+                children.append(parseAnd())
+            return makeNode("or", children)
+
+        def parseAnd():
+            nonlocal pos
+            children = [parseNot()]
+            while peek() not in (None, ")", "OR"):
+                if peek() == "AND":
+                    pos += 1
+                children.append(parseNot())
+            return makeNode("and", children)
+
+        def parseNot():
+            nonlocal pos
+            token = peek()
+            pos += 1
+            if token == "NOT":
+                child = parseNot()
+                return None if child is None else ("not", child)
+            if token == "(":
+                child = parseOr()
+                if peek() != ")":
+                    raise ValueError("Missing ) in %r" % text)
+                pos += 1
+                return child
+            if token is None or token == ")":
+                raise ValueError("Unexpected %s in %r"
+                                 % (token or "end", text))
+            stems = self.txtRepr.getTextRepresentation(token)
+            return makeNode("and", [("term", stem) for stem in stems])
+
+        if not tokens:
+            return None
+        tree = parseOr()
+        if pos < len(tokens):
+            raise ValueError("Unexpected %s in %r" % (tokens[pos], text))
+        return tree
+
+    def search(self, query, minDocs=0):
+        """ Return the docs that match a query. If the query finds less
+        than minDocs docs, its disjunctive version is used instead (see
+        relax()).
+        :param query: string (see parse()), tree, or dict
+            {stem: frequency} for the conjunction of its stems
+        :param minDocs: int, the number of docs under which the query is
+            relaxed
+        :return: list of doc ids, by segment and doc number"""
+        if isinstance(query, str):
+            query = self.parse(query)
+        elif isinstance(query, dict):
+            query = conjunction(query)
+        docs = self.match(query)
+        if len(docs) < minDocs:
+            relaxed = relax(query)
+            if relaxed != query:
+                # The counters add up both queries
+                postingsNbr, decodedNbr = self.postingsNbr, self.decodedNbr
+                docs = self.match(relaxed)
+                self.postingsNbr += postingsNbr
+                self.decodedNbr += decodedNbr
+        return docs
+
+    def match(self, tree):
+        """ Return the docs that match the tree of a query, in this index
+        and its segments, without the deleted docs.
+        :return: list of doc ids"""
+        self.postingsNbr = 0
+        self.decodedNbr = 0
+        if tree is None:
+            return []
+        docs = []
+        for segment in self.index.getSegments():
+            docNos = self.evaluate(segment, tree)
+            if self.index.deletedNbr > 0:
+                docNos = docNos[~segment.tombstones[docNos]]
+            docList = segment.docList
+            docs.extend(docList[d] for d in docNos.tolist())
+        return docs
+
+    def evaluate(self, segment, tree):
+        """ Return the doc numbers of a segment that match a tree, deleted
+        docs included
+        :return: sorted array of doc numbers"""
+        op = tree[0]
+        if op == "term":
+            docNos = segment.getPostings(tree[1])[0]
+            self.postingsNbr += len(docNos)
+            self.decodedNbr += len(docNos)
+            return docNos
+        if op == "not":
+            return np.setdiff1d(np.arange(len(segment.docList)),
+                                self.evaluate(segment, tree[1]),
+                                assume_unique=True)
+        if op == "or":
+            docNos = np.zeros(0, dtype=np.int64)
+            for child in tree[1]:
+                docNos = np.union1d(docNos, self.evaluate(segment, child))
+            return docNos
+        return self.intersect(segment, tree[1])
+
+    def cursor(self, segment, tree):
+        """ Return a cursor on the docs of a segment that match a tree: a
+        SkipCursor for a stem, an ArrayCursor otherwise """
+        if tree[0] == "term":
+            return SkipCursor(segment, tree[1])
+        return ArrayCursor(self.evaluate(segment, tree))
+
+    def intersect(self, segment, children):
+        """ Return the doc numbers of a segment that match all the
+        children of an AND: the shortest list gives the candidates, each
+        other list jumps to the candidate, if it doesn't have it the
+        candidate jumps to its next doc. The NOT children are checked on
+        the docs found by all the others.
+        :return: sorted array of doc numbers"""
+        positives = [self.cursor(segment, child) for child in children
+                     if child[0] != "not"]
+        negatives = [self.cursor(segment, child[1]) for child in children
+                     if child[0] == "not"]
+        if not positives:
+            positives = [ArrayCursor(np.arange(len(segment.docList)))]
+        positives.sort(key=lambda cursor: cursor.size())
+        for cursor in positives + negatives:
+            if isinstance(cursor, SkipCursor):
+                self.postingsNbr += cursor.size()
+        lead = positives[0]
+        docNos = []
+        docNo = lead.nextGeq(0)
+        while docNo is not None:
+            for cursor in positives[1:]:
+                found = cursor.nextGeq(docNo)
+                if found is None:
+                    docNo = None
+                    break
+                if found != docNo:
+                    docNo = lead.nextGeq(found)
+                    break
+            else:
+                if all(cursor.nextGeq(docNo) != docNo
+                       for cursor in negatives):
+                    docNos.append(docNo)
+                docNo = lead.nextGeq(docNo + 1)
+        self.decodedNbr += sum(cursor.decodedNbr for cursor
+                               in positives + negatives
+                               if isinstance(cursor, SkipCursor))
+        return np.array(docNos, dtype=np.int64)
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+
+""" Caches of the search engine.
+- ResultCache: different wordings of a query often give the same stems 
+  once stemmed, the results of a model for a {stem: frequency} dict are
+  kept so that they are computed once. An entry is keyed on the 
+  parameters of the model and its index (see IRmodel.getCacheKey()), the
+  method and its arguments, and the stems of the query, sorted.
+- PostingCache: the decoded posting lists of an index, see 
+  Index.getPostings().
+"""
+
+import copy
+import functools
+import inspect
+import threading
+import time
+from collections import OrderedDict
+
+
+# The calls of cached methods in progress in each thread, see cached()
+_calls = threading.local()
+
+
+class ResultCache():
+    """ A least recently used cache, with a time to live. The results of 
+    an index are removed when it changes (see Index.generation)."""
+    def __init__(self, maxSize=1024, ttl=None, clock=time.monotonic):
+        """
+        :param maxSize: int, the number of results kept
+        :param ttl: float, the number of seconds a result is kept, None to
+            keep it until it is evicted
+        :param clock: function returning the current time in seconds
+        """
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.clock = clock
+        # {key: (time of insertion, value, index)}, least recently used 
+        # first
+        self.entries = OrderedDict()
+        # {index: Index.generation of its entries}
+        self.generations = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, generation=None, index=None):
+        """ Return a result of the cache, None if it isn't found.
+        :param key: hashable, see resultKey()
+        :param generation: int, the generation of the index. The results
+            of the index are removed if it changed since the last call.
+        :param index: hashable, the index of the result, see indexKey()
+        """
+        self.checkGeneration(generation, index)
+        entry = self.entries.get(key)
+        if entry is not None and (self.ttl is not None
+                                  and self.clock() - entry[0] > self.ttl):
+            del self.entries[key]
+            self.expirations += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value, generation=None, index=None):
+        """ Add a result to the cache, and evict the least recently used
+        ones if it is full, see get()
+        :return: None"""
+        self.checkGeneration(generation, index)
+        self.entries[key] = (self.clock(), value, index)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def checkGeneration(self, generation, index=None):
+        """ Remove the results of an index if it changed """
+        if self.generations.setdefault(index, generation) == generation:
+            return
+        self.generations[index] = generation
+        stale = [key for (key, entry) in self.entries.items() 
+                 if entry[2] == index]
+        if stale:
+            self.invalidations += 1
+        for key in stale:
+            del self.entries[key]
+
+    def clear(self):
+        """ Remove every result, but keep the counters """
+        self.entries.clear()
+
+    def getStats(self):
+        """ Return the counters of the cache
+        :return: dict {"size", "hits", "misses", "hitRate", "evictions",
+                       "expirations", "invalidations"}"""
+        lookups = self.hits + self.misses
+        return {"size": len(self.entries), "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0.,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations}
+
+
+def queryKey(query):
+    """ Return the canonical form of a query: its stems and frequencies,
+    sorted by stem.
+    :param query: dict {stem: frequency}
+    :return: tuple of (stem, frequency)"""
+    return tuple(sorted(query.items()))
+
+
+def indexKey(index):
+    """ Return the key of the results of an index in a ResultCache """
+    return (index.outDir, index.name)
+
+
+def resultKey(model, name, signature, query, args, kwargs):
+    """ Return the key of the result of a call of a cached method: the 
+    arguments are bound to the signature of the method, so the calls with
+    the default values, or with positional or keyword arguments, have the
+    same key.
+    :param model: the IRmodel object
+    :param name: string, the name of the method
+    :param signature: inspect.Signature of the method
+    :param query: dict {stem: frequency}
+    :raise TypeError: if the arguments don't match the signature
+    :return: hashable tuple"""
+    bound = signature.bind(model, query, *args, **kwargs)
+    bound.apply_defaults()
+    params = tuple(bound.arguments.items())[2:]
+    return (model.getCacheKey(), name, queryKey(query), params)
+
+
+def cached(method):
+    """ Decorator of the IRmodel methods method(self, query, ...), whose
+    results are kept in the cache of the model (see IRmodel.setCache()).
+    The cached results are copied, so the callers may modify them.
+    A cached method called by another one (getScores() by getRanking()) 
+    looks its result up in the cache, but doesn't add it: each call keeps
+    a single result."""
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self, query, *args, **kwargs):
+        resultCache = self.cache
+        if resultCache is None:
+            return method(self, query, *args, **kwargs)
+        key = resultKey(self, method.__name__, signature, query, args, 
+                        kwargs)
+        generation, index = self.index.generation, indexKey(self.index)
+        result = resultCache.get(key, generation, index)
+        if result is None:
+            nested = getattr(_calls, "nested", False)
+            _calls.nested = True
+            try:
+                result = method(self, query, *args, **kwargs)
+            finally:
+                _calls.nested = nested
+            if not nested:
+                resultCache.put(key, result, generation, index)
+        return copy.copy(result)
+    wrapper.signature = signature
+    return wrapper
+
+
+def cachedBatch(method):
+    """ Decorator of the IRmodel.getScoresBatch() methods, 
+    method(self, queries, ...): the scores of each query are looked up in
+    the cache of the model, and kept there, as results of getScores() 
+    with the same arguments. Only the queries that aren't in the cache are
+    scored."""
+    @functools.wraps(method)
+    def wrapper(self, queries, *args, **kwargs):
+        resultCache = self.cache
+        signature = getattr(type(self).getScores, "signature", None)
+        if (resultCache is None or signature is None 
+                or getattr(_calls, "nested", False)):
+            return method(self, queries, *args, **kwargs)
+        try:
+            keys = [resultKey(self, "getScores", signature, query, args,
+                              kwargs) for query in queries]
+        except TypeError:
+            # The arguments aren't the ones of getScores()
+            return method(self, queries, *args, **kwargs)
+        generation, index = self.index.generation, indexKey(self.index)
+        results = [resultCache.get(key, generation, index) for key in keys]
+        missing = [i for (i, result) in enumerate(results) if result is None]
+        if missing:
+            _calls.nested = True
+            try:
+                scored = method(self, [queries[i] for i in missing], *args,
+                                **kwargs)
+            finally:
+                _calls.nested = False
+            for i, scores in zip(missing, scored):
+                results[i] = scores
+                resultCache.put(keys[i], scores, generation, index)
+        return [copy.copy(result) for result in results]
+    return wrapper
+
+
+class PostingCache():
+    """ The decoded posting lists of an index and of its segments, in two
+    parts: a static part with the posting lists of the pinned stems (the
+    most frequent in a query log, see Index.warmPostingCache()), which are
+    never evicted, and a dynamic least recently used part bounded in 
+    bytes. The cached arrays are read-only."""
+    def __init__(self, maxBytes):
+        """
+        :param maxBytes: int, the size of the arrays of the dynamic part
+        """
+        self.maxBytes = maxBytes
+        self.pinned = set()
+        # {(index name, stem): (array of doc numbers, array of freqs)}
+        self.static = {}
+        # Same, least recently used first
+        self.dynamic = OrderedDict()
+        self.dynamicBytes = 0
+        self.lock = threading.Lock()
+        self.staticHits = 0
+        self.dynamicHits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def pin(self, stems):
+        """ Keep the posting lists of some stems in the static part
+        :param stems: iterable of strings
+        :return: None"""
+        with self.lock:
+            self.pinned.update(stems)
+            for key in [key for key in self.dynamic 
+                        if key[1] in self.pinned]:
+                self.static[key] = self._pop(key)
+
+    def get(self, name, stem):
+        """ Return a posting list, None if it isn't in the cache
+        :param name: string, the name of the index or of the segment
+        :return: (array of doc numbers, array of frequencies)"""
+        key = (name, stem)
+        with self.lock:
+            value = self.static.get(key)
+            if value is not None:
+                self.staticHits += 1
+                return value
+            value = self.dynamic.get(key)
+            if value is not None:
+                self.dynamic.move_to_end(key)
+                self.dynamicHits += 1
+                return value
+            self.misses += 1
+            return None
+
+    def peek(self, name, stem):
+        """ Return a posting list if it is in the cache, None otherwise, 
+        without counting a lookup nor changing the order of the lists
+        :return: (array of doc numbers, array of frequencies)"""
+        key = (name, stem)
+        with self.lock:
+            value = self.static.get(key)
+            return value if value is not None else self.dynamic.get(key)
+
+    def put(self, name, stem, value):
+        """ Add a posting list to the cache, in the static part if its stem
+        is pinned, otherwise in the dynamic part, evicting the least 
+        recently used posting lists if it is full.
+        :param value: (array of doc numbers, array of frequencies)
+        :return: value, made read-only"""
+        for array in value:
+            array.flags.writeable = False
+        key = (name, stem)
+        size = sum(array.nbytes for array in value)
+        with self.lock:
+            if stem in self.pinned:
+                self.static[key] = value
+                return value
+            if size > self.maxBytes:
+                return value
+            if key in self.dynamic:
+                self._pop(key)
+            self.dynamic[key] = value
+            self.dynamicBytes += size
+            while self.dynamicBytes > self.maxBytes:
+                self._pop(next(iter(self.dynamic)))
+                self.evictions += 1
+        return value
+
+    def _pop(self, key):
+        """ Remove a posting list of the dynamic part, the lock must be 
+        held """
+        value = self.dynamic.pop(key)
+        self.dynamicBytes -= sum(array.nbytes for array in value)
+        return value
+
+    def discard(self, name):
+        """ Remove the posting lists of an index whose files changed
+        :return: None"""
+        with self.lock:
+            for key in [key for key in self.static if key[0] == name]:
+                del self.static[key]
+            for key in [key for key in self.dynamic if key[0] == name]:
+                self._pop(key)
+
+    def getStats(self):
+        """ Return the counters of the cache
+        :return: dict {"staticLists", "staticBytes", "dynamicLists", 
+                       "dynamicBytes", "staticHits", "dynamicHits", 
+                       "misses", "hitRate", "evictions"}"""
+        with self.lock:
+            lookups = self.staticHits + self.dynamicHits + self.misses
+            return {"staticLists": len(self.static),
+                    "staticBytes": sum(array.nbytes for value 
+                                       in self.static.values() 
+                                       for array in value),
+                    "dynamicLists": len(self.dynamic),
+                    "dynamicBytes": self.dynamicBytes,
+                    "staticHits": self.staticHits,
+                    "dynamicHits": self.dynamicHits,
+                    "misses": self.misses,
+                    "hitRate": ((self.staticHits + self.dynamicHits) 
+                                / lookups if lookups else 0.),
+                    "evictions": self.evictions}
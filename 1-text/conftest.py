@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+""" Fixtures of the tests: a small CACM collection and its index, built
+once in a temporary directory. """
+
+import os
+import re
+
+import pytest
+
+import ParserCACM
+import TextRepresenter
+import query
+from indexation import Index
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "cacm_sample")
+SAMPLE_CORPUS = os.path.join(SAMPLE_DIR, "cacm.txt")
+SAMPLE_QUERIES = os.path.join(SAMPLE_DIR, "cacm.qry")
+# The sample is copied COPIES times with other doc ids, so the posting
+# lists of the frequent stems have several blocks (see Index.getBlocks())
+COPIES = 3
+
+
+def splitDocs(corpus):
+    """ Return the documents of a CACM file
+    :return: list of strings, each starting with its .I line"""
+    with open(corpus, "r") as f:
+        text = f.read()
+    return [".I " + doc for doc in text.split(".I ")[1:]]
+
+
+def renumber(doc, docId):
+    """ Return a CACM document with another id """
+    return re.sub(r"^\.I \d+", ".I %d" % docId, doc)
+
+
+def writeCorpus(path, docs):
+    """ Write CACM documents to a file, return its path """
+    with open(path, "w") as f:
+        f.write("".join(docs))
+    return path
+
+
+@pytest.fixture(scope="session")
+def stemmer():
+    return TextRepresenter.PorterStemmer()
+
+
+@pytest.fixture(scope="session")
+def corpus(tmp_path_factory):
+    """ The path of the test collection: the copies of the sample """
+    docs = splitDocs(SAMPLE_CORPUS)
+    copies = [renumber(doc, 10000 * copy + int(doc.split()[1]))
+              for copy in range(COPIES) for doc in docs]
+    return writeCorpus(str(tmp_path_factory.mktemp("corpus") / "cacm.txt"),
+                       copies)
+
+
+@pytest.fixture(scope="session")
+def index(tmp_path_factory, corpus, stemmer):
+    """ The index of the test collection, with positions. The tests must
+    not modify it. """
+    index = Index("cacm", str(tmp_path_factory.mktemp("index")))
+    index.indexation(corpus, ParserCACM.ParserCACM(), stemmer,
+                     positions=True)
+    return index
+
+
+@pytest.fixture(scope="session")
+def queries(stemmer):
+    """ The queries of the sample and the titles of some docs, dicts 
+    {stem: frequency} """
+    texts = query.readQueryLog(SAMPLE_QUERIES)
+    parser = ParserCACM.ParserCACM()
+    parser.initFile(SAMPLE_CORPUS)
+    doc = parser.nextDocument()
+    while doc is not None:
+        if int(doc.getId()) % 4 == 0:
+            texts.append(doc.get("title"))
+        doc = parser.nextDocument()
+    return [stemmer.getTextRepresentation(text) for text in texts]
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+""" Compressed store of the documents of an index, and query-biased
+snippets.
+The documents are written at indexation time, as they are in the corpus,
+in blocks of about BLOCK_BYTES bytes compressed with zlib or lzma: a
+document is never cut between two blocks. The position of each block in
+the file and the offset of each document in the uncompressed blocks are
+kept in arrays, so reading some docs decompresses each of their blocks
+once (see DocStore.getDocs()), and the last decompressed blocks are kept.
+"""
+
+import lzma
+import re
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+# Uncompressed size of a block of docs
+BLOCK_BYTES = 8 * 2**10
+
+# Number of decompressed blocks kept by a DocStore
+CACHED_BLOCKS = 16
+
+# {name: (compress function, decompress function)}
+COMPRESSIONS = {"zlib": (zlib.compress, zlib.decompress),
+                "lzma": (lzma.compress, lzma.decompress)}
+
+
+class DocStoreWriter():
+    """ Writes the docs of an index, in the order of the doc numbers """
+    def __init__(self, path, compression="zlib", blockBytes=BLOCK_BYTES):
+        """
+        :param path: the path of the store file
+        :param compression: string, one of COMPRESSIONS
+        :param blockBytes: int, the uncompressed size of the blocks
+        """
+        self.compression = compression
+        self.compress = COMPRESSIONS[compression][0]
+        self.blockBytes = blockBytes
+        self.file = open(path, "wb")
+        # The encoded docs of the current block
+        self.block = []
+        self.blockSize = 0
+        self.blockPos = [0]
+        self.blockFirstDoc = [0]
+        self.docStarts = [0]
+
+    def add(self, text):
+        """ Append a doc to the store
+        :param text: string, the doc
+        :return: None"""
+        data = text.encode()
+        if self.block and self.blockSize + len(data) > self.blockBytes:
+            self.flush()
+        self.block.append(data)
+        self.blockSize += len(data)
+        self.docStarts.append(self.docStarts[-1] + len(data))
+
+    def flush(self):
+        """ Compress and write the current block """
+        self.file.write(self.compress(b"".join(self.block)))
+        self.blockPos.append(self.file.tell())
+        self.blockFirstDoc.append(len(self.docStarts) - 1)
+        self.block = []
+        self.blockSize = 0
+
+    def close(self):
+        """ Write the last block and close the file
+        :return: the DocStore of the written docs"""
+        if self.block:
+            self.flush()
+        self.file.close()
+        return DocStore(self.compression,
+                        np.array(self.blockPos, dtype=np.int64),
+                        np.array(self.blockFirstDoc, dtype=np.int64),
+                        np.array(self.docStarts, dtype=np.int64))
+
+
+class DocStore():
+    """ Reads the docs written by a DocStoreWriter """
+    def __init__(self, compression, blockPos, blockFirstDoc, docStarts):
+        """
+        :param compression: string, one of COMPRESSIONS
+        :param blockPos: array of the position of each block in the file,
+            followed by the size of the file
+        :param blockFirstDoc: array of the first doc number of each block,
+            followed by the number of docs
+        :param docStarts: array of the offset of each doc in the
+            uncompressed docs, followed by their size
+        """
+        self.compression = compression
+        self.decompress = COMPRESSIONS[compression][1]
+        self.blockPos = blockPos
+        self.blockFirstDoc = blockFirstDoc
+        self.docStarts = docStarts
+        # The last decompressed blocks {block number: bytes}, least
+        # recently used first
+        self.blocks = OrderedDict()
+        self.blocksLock = threading.Lock()
+        # Number of blocks decompressed
+        self.decompressions = 0
+
+    def getDocs(self, docNos, source):
+        """ Return some docs, each block is decompressed once
+        :param docNos: list of doc numbers
+        :param source: the path of the store file, or its MmapFile
+        :return: list of strings, in the order of docNos"""
+        docNos = np.asarray(docNos, dtype=np.int64)
+        blocks = np.searchsorted(self.blockFirstDoc, docNos, side="right") - 1
+        texts = [None] * len(docNos)
+        storeFile = None if hasattr(source, "slice") else open(source, "rb")
+        try:
+            for block in np.unique(blocks).tolist():
+                docs = self.getBlock(block, source, storeFile)
+                base = self.docStarts[self.blockFirstDoc[block]]
+                for i in np.flatnonzero(blocks == block).tolist():
+                    docNo = docNos[i]
+                    texts[i] = docs[self.docStarts[docNo] - base:
+                                    self.docStarts[docNo+1] - base].decode()
+        finally:
+            if storeFile is not None:
+                storeFile.close()
+        return texts
+
+    def getBlock(self, block, source, storeFile):
+        """ Return the uncompressed docs of a block, from the cache of the
+        last blocks or from the store file
+        :param block: int, the number of the block
+        :param source: see getDocs()
+        :param storeFile: the open store file, None to read the memory map
+            source
+        :return: bytes"""
+        with self.blocksLock:
+            docs = self.blocks.get(block)
+            if docs is not None:
+                self.blocks.move_to_end(block)
+                return docs
+        start, end = self.blockPos[block:block+2]
+        if storeFile is None:
+            data = source.slice(start, end - start)
+        else:
+            storeFile.seek(start)
+            data = storeFile.read(end - start)
+        docs = self.decompress(data)
+        with self.blocksLock:
+            self.decompressions += 1
+            self.blocks[block] = docs
+            while len(self.blocks) > CACHED_BLOCKS:
+                self.blocks.popitem(last=False)
+        return docs
+
+
+def makeSnippet(text, query, txtRepr, length=200, highlight=None):
+    """ Return the sentences of a doc that best match a query (Tombros and
+    Sanderson 1998): the sentences with the most different stems of the
+    query first, then the ones with the most occurrences, then the first
+    ones, until length characters. They are given in the order of the doc,
+    separated by " ... ". Without a matching sentence, the doc starts the
+    snippet.
+    :param text: string, the doc
+    :param query: dict {stem: frequency}
+    :param txtRepr: The TextRepresenter object that stemmed the query
+    :param length: int, the maximum number of characters of the snippet
+    :param highlight: (before, after) strings that surround the words of
+        the query, None to leave them as they are
+    :return: string"""
+    sentences = [" ".join(sentence.split()) for sentence
+                 in re.split(r"(?<=[.!?])\s+|\s*\n\s*", text)]
+    sentences = [sentence for sentence in sentences if sentence]
+    ranks = []
+    for pos, sentence in enumerate(sentences):
+        stems = txtRepr.getTextRepresentation(sentence)
+        matched = [stem for stem in stems if stem in query]
+        ranks.append((-len(matched), -sum(stems[s] for s in matched), pos))
+    chosen = []
+    size = 0
+    for matched, occurrences, pos in sorted(ranks):
+        if size >= length or (matched == 0 and chosen):
+            break
+        sentence = sentences[pos]
+        if size + len(sentence) > length:
+            # The last sentence is cut on a word
+            sentence = sentence[:length - size].rsplit(" ", 1)[0]
+            if sentence:
+                chosen.append((pos, sentence + " ..."))
+            break
+        chosen.append((pos, sentence))
+        size += len(sentence) + len(" ... ")
+    snippet = " ... ".join(sentence for (pos, sentence) in sorted(chosen))
+    if highlight is not None:
+        before, after = highlight
+        snippet = re.sub(r"\w+", lambda word: (
+            before + word.group() + after
+            if any(stem in query for stem
+                   in txtRepr.getTextRepresentation(word.group()))
+            else word.group()), snippet)
+    return snippet
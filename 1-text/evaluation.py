@@ -41,6 +41,14 @@ class EvalMeasure:
     def eval(self):
         raise NotImplementedError("Abstract method")
 
+    def getTrueRelevants(self):
+        """ Return the docs that are truly relevant for the query, with the 
+        same string IDs as the ranking.
+        :return: dict {string (doc id): {"subtheme":int, "score":float}}
+        """
+        return {str(docId): rel for (docId, rel) 
+                in self.irlist.getQuery().getRelevants().items()}
+
 
 class PrecisionRecallMeasure(EvalMeasure):
 
@@ -55,7 +63,7 @@ class PrecisionRecallMeasure(EvalMeasure):
         :return: A sorted list of (recall, precision)"""
         rec_prec = {}
         # Truely relevant results for the query:
-        trueRels = list(self.irlist.getQuery().getRelevants().keys())
+        trueRels = set(self.getTrueRelevants())
         # Results we found for the query:
         results = self.irlist.getRanking()
         trueRelsLen = len(trueRels)        
@@ -69,13 +77,14 @@ class PrecisionRecallMeasure(EvalMeasure):
         relevantFound = 0.
         while i<len(results) and relevantFound<trueRelsLen:
             # Number of results we found that are really relevant:
-            if int(results[i-1]) in trueRels:
+            isRelevant = results[i-1] in trueRels
+            if isRelevant:
                 relevantFound += 1
 
             prec = relevantFound/i
             rec = relevantFound/trueRelsLen
             
-            if verbose and int(results[i-1]) in trueRels:
+            if verbose and isRelevant:
                 print("%5d|%4d | %5f  |%5f" % (i, relevantFound, prec, rec))
             
             
@@ -108,7 +117,7 @@ class AveragePrecision(EvalMeasure):
         :return: The average precision at different ranks"""
         s = 0 # The sum of precisions. 
         # Truely relevant results for the query:
-        trueRels = list(self.irlist.getQuery().getRelevants().keys())
+        trueRels = set(self.getTrueRelevants())
         # Results we found for the query:
         results = self.irlist.getRanking()
 
@@ -122,9 +131,9 @@ class AveragePrecision(EvalMeasure):
         relevantFound = 0
         while i<len(results) and relevantFound<len(trueRels):
             prec = 0
-            if int(results[i-1]) in trueRels:
+            if results[i-1] in trueRels:
                 # Number of results we found that are really relevant:
-                relevantFound = len(np.intersect1d(results[:i], trueRels))
+                relevantFound += 1
                 prec = relevantFound/i
                 s += prec
                 if verbose:
@@ -142,7 +151,7 @@ class PrecisionNDocuments(EvalMeasure):
         """ Compute the performance of a model.
                 :return: The precision at the n'th rank"""
         # Truely relevant results for the query:
-        trueRels = list(self.irlist.getQuery().getRelevants().keys())
+        trueRels = set(self.getTrueRelevants())
         # Results we found for the query:
         results = self.irlist.getRanking()
         precision = 0
@@ -150,7 +159,7 @@ class PrecisionNDocuments(EvalMeasure):
         for result in results[:N]:
             if verbose:
                 print("Result: ", result)
-            if int(result) in trueRels:
+            if result in trueRels:
                 precision += 1
                 if verbose:
                     print("Relevant, found docs =", precision)
@@ -164,8 +173,8 @@ class ClusterRecallNDocuments(EvalMeasure):
         """ Compute the performance of a model.
                 :return: The cluster recall at the n'th rank"""
         # Truely relevant results for the query:
-        trueRels = self.irlist.getQuery().getRelevants()
-        # trueRels is dict {docId(int) : {'subtheme': int, 'score': float},}}
+        trueRels = self.getTrueRelevants()
+        # trueRels is dict {docId(str) : {'subtheme': int, 'score': float},}}
         # Results we found for the query (sorted list of docs ID)
         results = self.irlist.getRanking()
         # Unique subthemes in the real relevant results
@@ -180,8 +189,8 @@ class ClusterRecallNDocuments(EvalMeasure):
         found_clusters = set()
         for result in results[:N]:
             # result is a string: doc ID
-            if int(result) in trueRels.keys():
-                cluster = trueRels[int(result)]['subtheme']
+            if result in trueRels:
+                cluster = trueRels[result]['subtheme']
                 if verbose:
                     print("Result: %s, cluster: %d" % (result, cluster))
                 found_clusters.add(cluster)
@@ -192,15 +201,19 @@ class ClusterRecallNDocuments(EvalMeasure):
         
 class EvalIRModel():
     def __init__(self, queries, irmodels, measures, 
-                 stemmer=TextRepresenter.PorterStemmer()):
+                 stemmer=TextRepresenter.PorterStemmer(), depth=None):
         """
         :param queries: List of Query objects
         :param irmodels: dictionary of {name:IRmodel object}
-        :param evals: dictionary of {name:EvalMeasure class}"""
+        :param evals: dictionary of {name:EvalMeasure class}
+        :param depth: int, the number of ranked docs the measures need 
+            (for instance n for PrecisionNDocuments), None for the whole
+            ranking"""
         self.queries = queries
         self.irmodels = irmodels
         self.measures = measures
         self.stemmer = stemmer
+        self.depth = depth
 
     def eval(self, verbose=0):
         """ Compares different types of IR models and evaluation methods.
@@ -214,13 +227,15 @@ class EvalIRModel():
         results = {}
         N_models = len(self.irmodels)
         N_measures = len(self.measures)
+        # The queries are stemmed once for all the models
+        stemmed = [self.stemmer.getTextRepresentation(q.getText()) 
+                   for q in self.queries]
         for i, (irmodel_name, irmodel) in enumerate(self.irmodels.items()):
             if verbose:
                 print("[%3d/%3d] IRModel '%s'" % (i, N_models, irmodel_name))
-            for q in self.queries:
-                q_scores = irmodel.getScores(self.stemmer.
-                            getTextRepresentation(q.getText()))
-                all_query_scores[q] = (list(q_scores.items()))
+            # The rankings are computed at once, for all the measures
+            rankings = irmodel.getRankingBatch(stemmed, self.depth)
+            all_query_scores = dict(zip(self.queries, rankings))
                 
             for measure_name, measure_class in self.measures.items():
                 if verbose:
@@ -231,7 +246,8 @@ class EvalIRModel():
                         print(20 * '-')
                         print(query)
                         print(scores_list[:10])
-                    measure = measure_class(IRList(query, scores_list))
+                    measure = measure_class(IRList(query, scores_list, 
+                        [docId for (docId, score) in scores_list]))
                     tmp_score = measure.eval(verbose=(verbose==2))
                     eval_scores.append(tmp_score)
                 if verbose:
@@ -251,12 +267,15 @@ def dict_combinations(dic):
     combinations = [dict(zip(keys, combination)) for combination in itertools.product(*values)]
     return combinations
 
-def gridsearch(model_class, param_grid, queries, measure_object, verbose=False):
+def gridsearch(model_class, param_grid, queries, measure_object, verbose=False,
+               depth=None):
     """
     :param model_class: modeles.Vectoriel for instance (the class, not an instance)
     :param param_grid: dict of {string:iterable}
     :param queries: list of Query objects
     :param measure_class: evaluation.AveragePrecision() for instance
+    :param depth: int, the number of ranked docs the measure needs, see 
+        EvalIRModel
     """
     params = []
     irmodels = {}
@@ -265,7 +284,8 @@ def gridsearch(model_class, param_grid, queries, measure_object, verbose=False):
     for i, comb in enumerate(all_combinations):
         params.append(comb)
         irmodels[i] = model_class(**comb)
-    eval_models = EvalIRModel(queries, irmodels, {'measure':measure_object})
+    eval_models = EvalIRModel(queries, irmodels, {'measure':measure_object},
+                              depth=depth)
     if verbose:
         print("Calling eval()")
         scores = eval_models.eval(verbose=verbose)
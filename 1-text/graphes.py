@@ -4,7 +4,7 @@
 - PageRank
 - HITS """
 
-from scipy.sparse import dok_matrix
+from scipy.sparse import csr_matrix
 import numpy as np
 
 class RandomWalker():
@@ -38,14 +38,16 @@ class RandomWalker():
             self.nodeList.append(node)
             i += 1
         print("%d nodes in the sub-graph" % i)
-        # Construct the adjacency matrix:
-        self.graph = dok_matrix((i,i))
+        # Construct the adjacency matrix from the list of its edges:
+        rows, cols = [], []
         for node in self.nodes:
             nodeIdx = self.idxMap[node]
             # Get children, keep only the ones in self.nodes
             children = set(self.index.getSuccNodes(node)) & self.nodes
-            childrenIdx = [self.idxMap[c] for c in children]
-            self.graph[nodeIdx, childrenIdx] = 1
+            rows += [nodeIdx] * len(children)
+            cols += [self.idxMap[c] for c in children]
+        self.graph = csr_matrix((np.ones(len(rows)), (rows, cols)), 
+                                shape=(i,i))
 
 
 class PageRank(RandomWalker):
@@ -61,7 +63,7 @@ class PageRank(RandomWalker):
         graph = self.graph.toarray()
         N = len(self.nodes)
         for i in range(N):
-            if np.alltrue(graph[i] == 0):
+            if np.all(graph[i] == 0):
                 graph[i] = np.ones(N)
             s = (graph[i].sum())
             graph[i] /= s
@@ -86,13 +88,9 @@ class HITS(RandomWalker):
 #            print("iter", i)
             authorities /= np.linalg.norm(authorities)
             hubs /= np.linalg.norm(hubs)
-            new_auth = np.zeros_like(authorities)
-            new_hubs = np.zeros_like(hubs)
-            for node in range(N_nodes):
-                parents = self.graph[:,node].nonzero()[0]
-                children = self.graph[node,:].nonzero()[1] 
-                new_auth[node] = sum([authorities[pred] for pred in parents])
-                new_hubs[node] = sum([hubs[succ] for succ in children])
+            # Sum over the parents (resp. children) of each node:
+            new_auth = self.graph.T.dot(authorities)
+            new_hubs = self.graph.dot(hubs)
             authorities = new_auth
             hubs = new_hubs
         return {self.nodeList[i] : authorities[i] for i in range(N_nodes)}
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+""" Impact-ordered posting lists, for score at a time retrieval.
+The score of a doc is the sum of the impacts of the query stems in the
+doc, precomputed for every posting by a model (the BM25 weight of Okapi,
+the normalized weight of Vectoriel...) and quantized to a few bits. The
+postings of a stem are sorted by decreasing impact, in segments of equal
+impact. A query reads the segments of all its stems by decreasing impact
+(Anh and Moffat 2006, Lin and Trotman 2015), and may stop after a budget
+of postings: the best docs are found first, the scores are then only
+approximate.
+"""
+
+import os
+
+import numpy as np
+
+
+class ImpactIndex():
+    """ The impact-ordered posting lists of an index. They are computed
+    once for a model, and saved next to the index files as
+    [directory]/[index name]_impacts_[name].npz
+    Like the forward index, they ignore the added and the deleted
+    documents until Index.compact() is called."""
+    def __init__(self, index, name, getWeights, bits=8):
+        """
+        :param index: the Index object
+        :param name: string, the name of the model and of its parameters
+        :param getWeights: function() -> scipy sparse matrix of the impact
+            of each posting, one line per doc number and one column per
+            stem number. It is only called if the saved impacts are
+            missing or stale.
+        :param bits: int, the number of bits of the quantized impacts
+        """
+        self.index = index
+        self.bits = bits
+        self.path = os.path.join(index.outDir, "%s_impacts_%s.npz"
+                                 % (index.name, name))
+        files = index._filesSignature()
+        if not self.load(files):
+            self.build(getWeights(), files)
+
+    def load(self, files):
+        """ Read the saved impacts, if they were computed from the current
+        index files
+        :return: bool, True if they were loaded"""
+        if not os.path.exists(self.path):
+            return False
+        with np.load(self.path, allow_pickle=False) as saved:
+            if (not np.array_equal(saved["files"], files)
+                    or int(saved["bits"]) != self.bits
+                    or len(saved["stemSegs"]) != len(self.index.stemList)+1):
+                return False
+            for attr in ("stemSegs", "segImpacts", "segStarts", "docNos"):
+                setattr(self, attr, saved[attr])
+            self.scale = float(saved["scale"])
+        return True
+
+    def build(self, weights, files):
+        """ Quantize and sort the impacts of every posting, and save them.
+        :param weights: see getWeights in __init__()
+        :return: None"""
+        weights = weights.tocoo()
+        positive = weights.data > 0
+        stemNos = weights.col[positive].astype(np.int64)
+        docNos = weights.row[positive].astype(np.int64)
+        data = weights.data[positive]
+        levels = 2**self.bits - 1
+        self.scale = data.max() / levels if len(data) else 1.
+        # Every posting keeps an impact of at least 1
+        impacts = np.clip(np.rint(data / self.scale), 1, levels).astype(
+            np.uint8 if self.bits <= 8 else np.uint16)
+        order = np.lexsort((docNos, -impacts.astype(np.int64), stemNos))
+        stemNos, docNos = stemNos[order], docNos[order]
+        impacts = impacts[order]
+        # A new segment starts at each new stem or impact
+        starts = np.flatnonzero(np.diff(stemNos, prepend=-1)
+                                | np.diff(impacts.astype(np.int64),
+                                          prepend=-1))
+        self.segStarts = np.append(starts, len(docNos))
+        self.segImpacts = impacts[starts]
+        self.stemSegs = np.searchsorted(stemNos[starts],
+                                        np.arange(len(self.index.stemList)+1))
+        self.docNos = docNos.astype(np.int32)
+        np.savez(self.path, files=files, bits=self.bits, scale=self.scale,
+                 stemSegs=self.stemSegs, segImpacts=self.segImpacts,
+                 segStarts=self.segStarts, docNos=self.docNos)
+
+    def topK(self, stems, k, budget=None):
+        """ Find the k best docs for some stems, score at a time: the
+        segments of the stems are read by decreasing impact, until budget
+        postings were read.
+        :param stems: iterable of strings, the stems of the query
+        :param k: int, the number of docs to retrieve
+        :param budget: int, the number of postings to read, None for all
+        :return: (list of (doc id, score) sorted by score, int number of
+            postings of the stems, int number of postings read)
+        """
+        segments = []
+        for stem in dict.fromkeys(stems):
+            stemNo = self.index.vocab.get(stem)
+            if stemNo is not None:
+                segments.extend(range(self.stemSegs[stemNo],
+                                      self.stemSegs[stemNo+1]))
+        segments = np.array(segments, dtype=np.int64)
+        postingsNbr = int((self.segStarts[segments+1]
+                           - self.segStarts[segments]).sum())
+        # Highest impacts first, in the order of the query on equal impacts
+        segments = segments[np.argsort(-self.segImpacts[segments]
+                                       .astype(np.int64), kind="stable")]
+        accumulators = np.zeros(len(self.index.docList), dtype=np.int64)
+        readNbr = 0
+        for segNo in segments.tolist():
+            start, end = self.segStarts[segNo], self.segStarts[segNo+1]
+            if budget is not None:
+                end = min(end, start + budget - readNbr)
+            accumulators[self.docNos[start:end]] += self.segImpacts[segNo]
+            readNbr += end - start
+            if budget is not None and readNbr >= budget:
+                break
+        docNos = np.flatnonzero(accumulators)
+        # By decreasing score, the first docs first on equal scores
+        docNos = docNos[np.lexsort((docNos, -accumulators[docNos]))[:k]]
+        docList = self.index.docList
+        return ([(docList[d], s * self.scale) for (d, s)
+                 in zip(docNos.tolist(), accumulators[docNos].tolist())],
+                postingsNbr, int(readNbr))
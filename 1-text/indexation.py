@@ -5,167 +5,1277 @@
 """
 
 import os
+import collections
+import copy
+import itertools
+import mmap
+from array import array
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from scipy.sparse import dok_matrix
+from scipy.sparse import csr_matrix, csc_matrix
+import postings
+import cache
+import docstore
+
+# Version of the manifest written by Index.save(), to increase whenever
+# the content of the manifest changes.
+MANIFEST_VERSION = 13
+
+# Number of documents parsed at once by the indexation on a single
+# process, and size in bytes of the ranges of the corpus parsed by each
+# worker process, see iterShards() and Index.indexation()
+SHARD_DOCS = 1000
+SHARD_BYTES = 8 * 2**20
+
+# Size in bytes of the dynamic part of the posting cache of an Index
+POSTING_CACHE_BYTES = 64 * 2**20
+
+
+class StaleIndexError(Exception):
+    """ Raised when the manifest of an index can't be used: it was written 
+    by another version of the code, or the index files changed since."""
+    pass
+
+
+def splitCorpus(corpus, begin, shardsNbr):
+    """ Split a corpus in ranges of documents of about the same size.
+    :param corpus: the path to the corpus
+    :param begin: bytes, the tag that starts a document (Parser.begin)
+    :param shardsNbr: int, the wanted number of ranges
+    :return: list of (start, end) byte offsets, each range starts at the 
+        beginning of a document
+    """
+    docStarts = []
+    pos = 0
+    with open(corpus, "rb") as f:
+        for line in f:
+            if line.startswith(begin):
+                docStarts.append(pos)
+            pos += len(line)
+    targets = np.linspace(0, pos, shardsNbr, endpoint=False)[1:]
+    cuts = [docStarts[i] for i in np.searchsorted(docStarts, targets)
+            if i < len(docStarts)]
+    cuts = sorted(set([0] + cuts)) + [pos]
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def parseDocs(parser, txtRepr, corpus, start, end, positions=False,
+              texts=True):
+    """ Parse and stem the documents of a range of the corpus, one at a 
+    time.
+    :param parser: The Parser object
+    :param txtRepr: The TextRepresenter object
+    :param corpus: the path to the corpus
+    :param start: the byte offset of the first document of the range
+    :param end: the byte offset after the range
+    :param positions: bool, keep the positions of the stems, with
+        txtRepr.getStemPositions()
+    :param texts: bool, read the documents as they are in the corpus
+    :return: a generator of (title, source, text as it is in the corpus
+        or None without texts, links, dict {stem: frequency}, dict 
+        {stem: list of positions} or None without positions), one per 
+        document
+    """
+    parser.initFile(corpus)
+    parser.file.seek(start)
+    source = open(corpus, "rb")
+    try:
+        doc = parser.nextDocument() if start < end else None
+        while doc is not None:
+            if positions:
+                docPositions = txtRepr.getStemPositions(doc.getText())
+                stems = {stem: len(pos) 
+                         for (stem, pos) in docPositions.items()}
+            else:
+                docPositions = None
+                stems = txtRepr.getTextRepresentation(doc.getText())
+            if texts:
+                srcPath, pos, length = doc.get("from").split(';')
+                source.seek(int(pos))
+                text = source.read(int(length)).decode()
+            else:
+                text = None
+            yield (doc.getId(), doc.get("from"), text,
+                   doc.others.get('links', ''), stems, docPositions)
+            if parser.file.closed or parser.file.tell() >= end:
+                break
+            doc = parser.nextDocument()
+    finally:
+        if not parser.file.closed:
+            parser.file.close()
+        source.close()
+
+
+def makeShard(docs, positions=False):
+    """ Gather parsed documents in a shard.
+    :param docs: iterable of the documents returned by parseDocs()
+    :param positions: bool, the documents have the positions of their 
+        stems
+    :return: dict of the lists "titles", "froms" (sources), "links", 
+        "lines" (lines of the index of documents), "texts" (the docs as 
+        they are in the corpus, empty without texts), "stemList" (the 
+        stems of the shard, by shard stem number) and of "triples", the 
+        uint32 array of (shard doc number, shard stem number, frequency).
+        With positions, "positions" is the uint32 array of the positions 
+        of each triple, in the order of the triples.
+    """
+    shard = {"titles": [], "froms": [], "links": [], "lines": [], 
+             "texts": []}
+    # {stem: shard stem number}
+    stemNos = {}
+    # Flat (doc number, stem number, frequency) triples, and positions
+    triples = array('I')
+    stemPositions = array('I')
+    for title, source, text, docLinks, stems, docPositions in docs:
+        docNo = len(shard["titles"])
+        docRepr = [w + ":" + str(freq) for (w, freq) in stems.items()]
+        shard["titles"].append(title)
+        shard["froms"].append(source)
+        if text is not None:
+            shard["texts"].append(text)
+        shard["links"].append(docLinks)
+        shard["lines"].append(title + '{' + ','.join(docRepr) + '}\n')
+        for stem, freq in stems.items():
+            stemNo = stemNos.setdefault(stem, len(stemNos))
+            triples.extend((docNo, stemNo, freq))
+        if positions:
+            for stemList in docPositions.values():
+                stemPositions.extend(stemList)
+    shard["stemList"] = list(stemNos)
+    shard["triples"] = np.frombuffer(triples, dtype=np.uint32).reshape(-1, 3)
+    if positions:
+        shard["positions"] = np.frombuffer(stemPositions, dtype=np.uint32)
+    return shard
+
+
+def indexShard(parser, txtRepr, corpus, start, end, positions=False,
+               texts=True):
+    """ Parse and stem the documents of a range of the corpus, see 
+    parseDocs()
+    :return: dict, see makeShard()
+    """
+    return makeShard(parseDocs(parser, txtRepr, corpus, start, end, 
+                               positions, texts), positions)
+
+
+def iterShards(parser, txtRepr, corpus, start, end, positions=False,
+               docsNbr=None, texts=True):
+    """ Parse and stem the documents of a range of the corpus in shards of
+    at most docsNbr documents: a shard is only parsed when the previous 
+    one was used, so only one shard is in memory.
+    :param docsNbr: int, the size of the shards, by default SHARD_DOCS
+    :return: a generator of dicts, see makeShard()
+    """
+    docs = parseDocs(parser, txtRepr, corpus, start, end, positions, texts)
+    while True:
+        shard = makeShard(itertools.islice(docs, docsNbr or SHARD_DOCS), 
+                          positions)
+        if not shard["titles"]:
+            return
+        yield shard
+
+
+def mapBounded(executor, function, argsList, pending):
+    """ Like executor.map(), but at most pending calls are submitted 
+    before their results are used, so the results don't pile up in memory
+    when they are used slower than they are computed.
+    :return: a generator of the results, in the order of argsList
+    """
+    futures = collections.deque()
+    for args in argsList:
+        if len(futures) >= pending:
+            yield futures.popleft().result()
+        futures.append(executor.submit(function, *args))
+    while futures:
+        yield futures.popleft().result()
+
+
+def linkGraph(docNos, links):
+    """ Build a citation graph from the raw links of some documents: the 
+    edges are collected in arrays and converted at once, the duplicated 
+    links are summed.
+    :param docNos: dict {doc id: doc number}
+    :param links: list of the raw links of each doc, by doc number
+    :return: (csr_matrix of the successors, csc_matrix of the 
+              predecessors, set of the (source doc number, dest id) of the
+              links to unknown docs)
+    """
+    sources, dests = [], []
+    unknown = set()
+    for docNo, docLinks in enumerate(links):
+        # doc.others['links'] is  '2\t5\t2;3\t5\t2;4\t5\t2;'
+        for link in docLinks.split(';'):
+            if not link:
+                continue
+            dest = link.split()[0]
+            destNo = docNos.get(dest)
+            if destNo is None:
+                unknown.add((docNo, dest))
+            elif destNo != docNo:
+                sources.append(docNo)
+                dests.append(destNo)
+    docsNbr = len(links)
+    network = csr_matrix((np.ones(len(sources)), 
+                          (np.array(sources, dtype=np.int64), 
+                           np.array(dests, dtype=np.int64))),
+                         shape=(docsNbr, docsNbr))
+    network.sum_duplicates()
+    return network, network.tocsc(), unknown
+
+
+def closeAndRemove(mmaps, paths):
+    """ Unmap and delete the files of an index, see Index._retire()
+    :param mmaps: dict of the MmapFile objects of the index, or None
+    :param paths: list of the paths of the files"""
+    if mmaps is not None:
+        for mapped in mmaps.values():
+            mapped.close()
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class MmapFile(object):
+    """ Read-only memory map of an index file.
+    Lookups are slices of the map: they do not move any file cursor, 
+    so a single MmapFile can be shared between threads. """
+    
+    def __init__(self, path, warmup=False):
+        """
+        :param path: the file to map
+        :param warmup: bool, ask the OS to load the whole file in memory
+            now instead of on the first page faults
+        """
+        self.path = path
+        self.file = open(path, "rb")
+        if os.fstat(self.file.fileno()).st_size == 0:
+            # An empty file can't be mapped
+            self.map = b""
+        else:
+            self.map = mmap.mmap(self.file.fileno(), 0, 
+                                 access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        if warmup:
+            self.warmup()
+            
+    def warmup(self):
+        """ Prefetch the pages of the file """
+        if hasattr(self.map, "madvise") and hasattr(mmap, "MADV_WILLNEED"):
+            self.map.madvise(mmap.MADV_WILLNEED)
+        else:
+            # Touch one byte per page
+            sum(self.view[::mmap.PAGESIZE])
+        
+    def slice(self, pos, length):
+        """ Return a zero-copy memoryview of [pos, pos+length[ """
+        return self.view[pos:pos+length]
+    
+    def line(self, pos):
+        """ Return the bytes from pos to the end of the line (excluded) """
+        end = self.map.find(b"\n", pos)
+        return self.map[pos:end if end >= 0 else len(self.map)]
+        
+    def close(self):
+        self.view.release()
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.file.close()
+
 
 class Index(object):
     """ Stores word frequencies among documents """
 
 
-    def __init__(self, name, out_dir):
+    def __init__(self, name, out_dir, postingsFormat="binary"):
         """ Constructor 
         :param name: the name of the index. The index will be 
             stored under [directory]/[name]_{index, inverted}
         :param out_dir: Where to save the index.
+        :param postingsFormat: "binary" (default) for compressed posting
+            lists (see postings.py), or "text" for the legacy
+            "stem{doc:freq,...}" inverted index.
         """
         # The name of the index
         self.name = name
+        self.outDir = out_dir
         # The path to the index file
         self.indexPath = os.path.join(out_dir, self.name + "_index.txt")
         # The path to the inverted index file
-        self.invertedPath = os.path.join(out_dir, self.name + "_inverted.txt")
-        # Dictionary {doc: (position in index, len of representation)} 
-        self.docs = {}
-        # Dict {stem: {"pos":position in inverted idx, "len":len of repr.}}
-        # self.stems["foo"]["pos"] gives the position of "foo"
-        self.stems = {}
+        self.postingsFormat = postingsFormat
+        self.invertedPath = self._invertedPath(postingsFormat)
+        # The path to the manifest written by save()
+        self.manifestPath = os.path.join(out_dir, self.name + "_manifest.npz")
+        # The path to the positions of the stems, see indexation()
+        self.positionsPath = os.path.join(out_dir, 
+                                          self.name + "_positions.bin")
+        # The path to the compressed docs, see getDocs()
+        self.storePath = os.path.join(out_dir, self.name + "_docs.bin")
+        # Temporary files holding the stems of each doc (and their 
+        # positions) between the 2 passes
+        self.spillPath = os.path.join(out_dir, self.name + "_spill.bin")
+        self.positionsSpillPath = os.path.join(out_dir, 
+                                               self.name + "_posspill.bin")
+        # Documents and stems are numbered in the order they were found.
+        # The doc (resp. stem) strings are only used at the edges of the 
+        # API, the index works with the numbers.
+        # Dict {doc title: doc number}
+        self.docNos = {}
+        # List of the doc titles, by doc number
+        self.docList = []
+        # Position in index and len of representation, by doc number
+        self.docPos = array('q')
+        self.docLen = array('q')
+        # Dict {stem: stem number}
+        self.vocab = {}
+        # List of the stems, by stem number
+        self.stemList = []
+        # Position in inverted idx, len of repr. and number of docs, by 
+        # stem number: stemPos[vocab["foo"]] gives the position of "foo"
+        self.stemPos = array('q')
+        self.stemLen = array('q')
+        self.stemDf = array('q')
+        # True if the positions of the stems are indexed: the positions of
+        # the stem number i are stored at positionsPos[i] in the positions
+        # file, on positionsLen[i] bytes
+        self.positional = False
+        self.positionsPos = None
+        self.positionsLen = None
+        # Statistics computed at the end of the indexation, see 
+        # computeStats(): collection frequency, collection language model,
+        # max frequency and length of the shortest doc by stem number, 
+        # length and L2 norm by doc number
+        self.stemCf = None
+        self.stemProb = None
+        self.stemMaxTf = None
+        self.stemMinLen = None
+        self.docLens = None
+        self.docNorms = None
+        # The posting lists are cut in blocks of postings.BLOCK_SIZE docs:
+        # the blocks of the stem number i are the positions
+        # blockIndptr[i]:blockIndptr[i+1] of the arrays of the last doc
+        # number, max frequency, shortest doc and max frequency/doc norm
+        # of each block, see computeBlocks(). With the offsets of the gaps
+        # and of the frequencies of each block in the binary posting list
+        # of its stem, they are the skip pointers of the lists.
+        self.blockIndptr = None
+        self.blockLastDoc = None
+        self.blockMaxTf = None
+        self.blockMinLen = None
+        self.blockMaxNormTf = None
+        self.blockGapPos = None
+        self.blockTfPos = None
+        # Forward index in CSR format: the stems of the doc number i are
+        # fwdTermIds[fwdIndptr[i]:fwdIndptr[i+1]] (stem numbers), with 
+        # the frequencies fwdTfs[fwdIndptr[i]:fwdIndptr[i+1]]
+        self.fwdIndptr = None
+        self.fwdTermIds = None
+        self.fwdTfs = None
+        # The same matrix in CSC format, see getStemsMatrix()
+        self.stemsMatrix = None
         # Dict {int(doc): string("source path;position in source;text length")}
         self.docFrom = {}
-        # sparse matrix, m[i,j] = nbr of links from i to j
-        self.network = {}
-        # Inverse doc frequencies:
-        self.idf = {}
+        # The docStore.DocStore of the docs, compressed with 
+        # storeCompression, None if storeDocs is False: the docs are then
+        # read from their source files
+        self.store = None
+        self.storeCompression = "zlib"
+        self.storeDocs = True
+        # List of the raw links of each doc, by doc number
+        self.links = []
+        # Citation graph by doc number, m[i,j] = nbr of links from i to j,
+        # in CSR (successors) and CSC (predecessors) formats
+        self.network = csr_matrix((0, 0))
+        self.networkIn = csc_matrix((0, 0))
+        # (generation, graph of the docs and segments), see getNetwork()
+        self.networkView = None
+        # Statistics of the docs that are not deleted, see getStats()
+        self.stats = None
+        # {phase: {"seconds", "docs", "docsPerSec"}} of the last indexation
+        self.buildStats = {}
+        # {"index": MmapFile, "inverted": MmapFile} when the files are mapped
+        self.mmaps = None
+        self.mmapLock = threading.Lock()
         
-        self.meanDocLen = None
+        # Incremental updates: tombstones[i] is True if the doc number i 
+        # was deleted, the docs added later are stored in self.segments,
+        # a tuple of smaller Index objects (replaced, never modified, so a
+        # query can work on a consistent view of the segments).
+        self.tombstones = np.zeros(0, dtype=bool)
+        # Number of deleted docs in this index and its segments
+        self.deletedNbr = 0
+        self.segments = ()
+        self.segmentCounter = 0
+        self.segmentsLock = threading.RLock()
+        # Number of segments that triggers a background merge
+        self.mergeFactor = 4
+        self.mergeThread = None
+        # Increased each time the documents change
+        self.generation = 0
+        # Decoded posting lists, shared with the segments, see 
+        # getPostings() and warmPostingCache()
+        self.postingCache = cache.PostingCache(POSTING_CACHE_BYTES)
         
-    def indexation(self, corpus, parser, txtRepr, verbose=False):
+    def _invertedPath(self, postingsFormat):
+        """ Return the path of the inverted index for a postings format"""
+        ext = {"binary": ".bin", "text": ".txt"}[postingsFormat]
+        return os.path.join(self.outDir, self.name + "_inverted" + ext)
+        
+    def indexation(self, corpus, parser, txtRepr, verbose=False, workers=1,
+                   positions=False, storeCompression="zlib", store=True):
         """ Create the indexes.
+        Every document is parsed and stemmed only once: the first pass
+        writes the index of documents and the doc store, and spills the 
+        stem counts of each document to [directory]/[name]_spill.bin, the
+        second pass reads them back to write the inverted index. The 
+        documents are parsed in shards of SHARD_DOCS docs (or SHARD_BYTES
+        bytes with several workers), each written before the next ones 
+        are kept in memory.
         :param corpus: the path to the files that contains 
             all document informations
         :param parser: The Parser object, must implement nextDocument() 
             method
         :param txtRepr: The TextRepresenter object, must implement
             getTextRepresentation(str) method.
+        :param workers: int, number of processes parsing the corpus. With
+            more than 1 worker, the corpus is split in ranges of documents
+            that are indexed in parallel, then merged in order: the index
+            is the same as with 1 worker.
+        :param positions: bool, also write the positions of the stems in
+            the docs to [directory]/[name]_positions.bin, for the phrase
+            and proximity queries (see positional.py). The posting lists
+            don't change.
+        :param storeCompression: "zlib" or "lzma", the compression of 
+            the docs written to [directory]/[name]_docs.bin, see getDocs()
+        :param store: bool, write the doc store. Without it, getDocs()
+            reads the docs from the corpus, which must stay where it is.
+            The docs added later (see addDocuments()) aren't stored 
+            either.
         :return: None
         """ 
         print("Performing the indexation...")
         self.parser = parser
         self.textRepresenter = txtRepr
+        self.positional = positions
+        self.storeCompression = storeCompression
+        self.storeDocs = store
+        if workers > 1:
+            # Ranges of at most SHARD_BYTES, and at most 2 ranges per 
+            # worker waiting to be merged
+            ranges = splitCorpus(corpus, parser.begin.encode(), 
+                                 max(4 * workers, 
+                                     os.path.getsize(corpus) // SHARD_BYTES
+                                     + 1))
+            # The file of the parser can't be sent to the workers
+            shardParser = copy.copy(parser)
+            shardParser.file = None
+            with ProcessPoolExecutor(workers) as executor:
+                shards = mapBounded(executor, indexShard, 
+                                    [(shardParser, txtRepr, corpus, start, 
+                                      end, positions, store) 
+                                     for (start, end) in ranges],
+                                    2 * workers)
+                self.build(shards, verbose)
+        else:
+            # The shards are parsed while build() consumes them, in its
+            # parse phase
+            self.build(iterShards(parser, txtRepr, corpus, 0, 
+                                  os.path.getsize(corpus), positions,
+                                  texts=store), 
+                       verbose)
+        print("Finished.")
         
-        self.parser.initFile(corpus)
-        
-        # Build the index of documents and compute the length of each
-        # stem representation
+    def build(self, shards, verbose=False):
+        """ Write the indexes from parsed documents.
+        :param shards: iterable of dicts returned by indexShard() or 
+            toShard(), in the order of the documents, with their positions
+            if self.positional. It may be a generator: the time spent
+            producing the shards is counted in the "parse" phase.
+        :return: None
+        """
+        self.closeMmap()
+        # Build the index of documents, compute the length of each
+        # stem representation and spill the stems of each document
         if verbose:
             print("1st pass: build the index...")
-        doc = self.parser.nextDocument()
-        with open(self.indexPath, "w") as index:
-            while doc is not None:
-                title = doc.getId()
-                self.docFrom[title] = doc.get("from")
-                #~ print("Parsing doc n°" + title)
-                stems = (self.textRepresenter
-                             .getTextRepresentation(doc.getText()))
-                #~ print("Doc",title,"stems:",stems)
-                # Add all the stems in the vocabulary
-                for stem, freq in stems.items():
-                    self.addStem(stem, title, freq)
-                    
-                docRepr = [w + ":" + str(freq) for (w, freq) in stems.items()]
-                # the string that will be written:
-                toWrite = title + '{'
-                toWrite += ','.join(docRepr) + '}\n'
-                self.docs[title] = (index.tell(), len(toWrite))
-                index.write(toWrite)
-                
-                    
-                
-                doc = self.parser.nextDocument()
+        start = time.time()
+        if self.storeDocs:
+            store = docstore.DocStoreWriter(self.storePath, 
+                                            self.storeCompression)
+        else:
+            store = None
+            if os.path.exists(self.storePath):
+                os.remove(self.storePath)
+        with open(self.indexPath, "w") as index, \
+             open(self.spillPath, "wb") as spill, \
+             open(self.positionsSpillPath, "wb") as positionsSpill:
+            for shard in shards:
+                self.mergeShard(shard, index, spill)
+                if self.positional:
+                    shard["positions"].tofile(positionsSpill)
+                if store is not None:
+                    for text in shard["texts"]:
+                        store.add(text)
+        self.store = store.close() if store is not None else None
+        self.tombstones = np.zeros(len(self.docList), dtype=bool)
+        self.docPos = np.array(self.docPos, dtype=np.int64)
+        self.docLen = np.array(self.docLen, dtype=np.int64)
+        self._logPhase("parse", start, len(self.docList), verbose)
         
         
         # Build the inverted index
         if verbose:
             print("2nd pass: build the inverted index...")
-        self.parser.initFile(corpus) # Reset the parser 
-        self.network = dok_matrix((len(self.docs), len(self.docs)))
-        # Iterate over all documents:
-        doc = self.parser.nextDocument()
-        with open(self.invertedPath, "w+") as invIndex:
-            while doc is not None:
-                title = doc.getId()
-                #~ print("Parsing doc n°" + title)
-                stems = (self.textRepresenter
-                            .getTextRepresentation(doc.getText()))
-                for stem, freq in stems.items():
-                    self.writeStem(stem, title, freq, invIndex)
-                
-                # Parsing the link to build the network:
-                # doc.others['links'] is  '2\t5\t2;3\t5\t2;4\t5\t2;'
-                links = doc.others['links'].split(';') # list of strings
-                # neighbours is the dict {link_dest: nbr of links}
-                neighbours = dict(zip(*np.unique([s.split()[0] for s in links if len(s) > 0], 
-                                                  return_counts=True)))
-                titleId = int(title) -1
-                for dest, linkNbr in neighbours.items():
-                    destId = int(dest) -1
-                    if titleId != destId and destId < len(self.docs):
-                        self.network[int(title)-1, int(dest)-1] = linkNbr
-                    elif destId >= len(self.docs) and verbose:
-                        print("Warning, could not store link %s -> %s" % (title, dest))
-                doc = self.parser.nextDocument()
+        start = time.time()
+        triples = np.fromfile(self.spillPath, dtype=np.uint32).reshape(-1, 3)
+        if self.postingsFormat == "text":
+            with open(self.invertedPath, "w+") as invIndex:
+                for docNo, stemNo, freq in triples.tolist():
+                    self.writeStem(stemNo, self.docList[docNo], freq, 
+                                   invIndex)
+            self.stemPos = np.array(self.stemPos, dtype=np.int64)
+            self.stemLen = np.array(self.stemLen, dtype=np.int64)
+        else:
+            self.writeBinaryPostings(triples[:, 1], triples[:, 0],
+                                     triples[:, 2])
+        # The spill is sorted by doc, it is already the forward index:
+        self.fwdIndptr = np.zeros(len(self.docList)+1, dtype=np.int64)
+        np.cumsum(np.bincount(triples[:, 0], minlength=len(self.docList)),
+                  out=self.fwdIndptr[1:])
+        self.fwdTermIds = triples[:, 1].astype(np.int32)
+        self.fwdTfs = triples[:, 2].astype(np.int32)
+        if self.positional:
+            self.writePositions(triples[:, 1], triples[:, 2], np.fromfile(
+                self.positionsSpillPath, dtype=np.uint32))
+        elif os.path.exists(self.positionsPath):
+            os.remove(self.positionsPath)
+        self._invalidate()
+        self.postingCache.discard(self.name)
+        os.remove(self.spillPath)
+        os.remove(self.positionsSpillPath)
+        self.computeStats()
         
-        print("Finished.")
+        self.buildNetwork(verbose)
+        self._logPhase("invert", start, len(self.docList), verbose)
+        
+    def buildNetwork(self, verbose=False):
+        """ Build the citation graph from the links of the documents (used
+        at the end of build()), see linkGraph().
+        :return: None
+        """
+        self.network, self.networkIn, unknown = linkGraph(self.docNos, 
+                                                          self.links)
+        if verbose:
+            for source, dest in sorted(unknown):
+                print("Warning, could not store link %s -> %s" 
+                      % (self.docList[source], dest))
+        
+    def computeStats(self):
+        """ Compute the statistics of the collection from the forward index
+        (used at the end of build()): df, collection frequency, 
+        probability in the collection, max frequency and shortest doc of
+        each stem, length and L2 norm of each doc.
+        :return: None
+        """
+        stemsNbr = len(self.stemList)
+        docNos = np.repeat(np.arange(len(self.docList)), 
+                           np.diff(self.fwdIndptr))
+        tfs = self.fwdTfs.astype(np.int64)
+        self.stemDf = np.bincount(self.fwdTermIds, minlength=stemsNbr)
+        self.stemCf = np.bincount(self.fwdTermIds, weights=tfs, 
+                                  minlength=stemsNbr).astype(np.int64)
+        self.stemProb = self.stemCf / max(self.stemCf.sum(), 1)
+        self.stemMaxTf = np.zeros(stemsNbr, dtype=np.int64)
+        np.maximum.at(self.stemMaxTf, self.fwdTermIds, tfs)
+        self.docLens = np.bincount(docNos, weights=tfs, 
+                                   minlength=len(self.docList)
+                                   ).astype(np.int64)
+        self.docNorms = np.sqrt(np.bincount(docNos, weights=tfs**2,
+                                            minlength=len(self.docList)))
+        self.stemMinLen = np.full(stemsNbr, np.iinfo(np.int64).max)
+        np.minimum.at(self.stemMinLen, self.fwdTermIds, self.docLens[docNos])
+        self.computeBlocks(docNos)
+        
+    def computeBlocks(self, docNos):
+        """ Compute the maximum impacts and the skip pointers of the blocks
+        of the posting lists (used by computeStats())
+        :param docNos: array, the doc number of each posting of the 
+            forward index
+        :return: None
+        """
+        # Postings by stem, then by doc:
+        order = np.argsort(self.fwdTermIds, kind="stable")
+        termIds = self.fwdTermIds[order]
+        docNos = docNos[order]
+        tfs = self.fwdTfs[order].astype(np.int64)
+        starts = np.concatenate(([0], np.cumsum(self.stemDf)[:-1]))
+        blocksNbr = -(-self.stemDf // postings.BLOCK_SIZE)
+        self.blockIndptr = np.concatenate(([0], np.cumsum(blocksNbr)))
+        # Block of each posting:
+        blocks = (self.blockIndptr[termIds] 
+                  + (np.arange(len(termIds)) - starts[termIds]) 
+                  // postings.BLOCK_SIZE)
+        self.blockLastDoc = np.zeros(self.blockIndptr[-1], dtype=np.int64)
+        np.maximum.at(self.blockLastDoc, blocks, docNos)
+        self.blockMaxTf = np.zeros(self.blockIndptr[-1], dtype=np.int64)
+        np.maximum.at(self.blockMaxTf, blocks, tfs)
+        self.blockMinLen = np.full(self.blockIndptr[-1], 
+                                   np.iinfo(np.int64).max)
+        np.minimum.at(self.blockMinLen, blocks, self.docLens[docNos])
+        self.blockMaxNormTf = np.zeros(self.blockIndptr[-1])
+        np.maximum.at(self.blockMaxNormTf, blocks, tfs / self.docNorms[docNos])
+        # Offsets of the blocks in the binary posting lists: the gaps
+        # restart at each new stem (see postings.encodeAllPostings()), 
+        # the frequencies follow all the gaps of the stem.
+        gaps = np.diff(docNos, prepend=0)
+        firsts = starts[self.stemDf > 0]
+        gaps[firsts] = docNos[firsts]
+        gapLens = postings.vbyteLengths(gaps)
+        tfLens = postings.vbyteLengths(tfs)
+        gapPos = np.cumsum(gapLens) - gapLens
+        tfPos = np.cumsum(tfLens) - tfLens
+        stemGapLens = np.bincount(termIds, weights=gapLens, 
+                                  minlength=len(self.stemList)
+                                  ).astype(np.int64)
+        gapPos -= gapPos[starts[termIds]]
+        tfPos += stemGapLens[termIds] - tfPos[starts[termIds]]
+        blockStarts = (np.arange(len(termIds)) - starts[termIds]) \
+            % postings.BLOCK_SIZE == 0
+        self.blockGapPos = gapPos[blockStarts]
+        self.blockTfPos = tfPos[blockStarts]
+        
+    def toShard(self):
+        """ Return the documents of the index that are not deleted in the
+        format of indexShard(), to build another index with them.
+        :return: dict, see indexShard()
+        """
+        live = np.flatnonzero(~self.tombstones)
+        starts, stops = self.fwdIndptr[live], self.fwdIndptr[live+1]
+        postingNos = np.concatenate([np.arange(start, stop) 
+                                     for (start, stop) in zip(starts, stops)]
+                                    + [[]]).astype(int)
+        termIds = self.fwdTermIds[postingNos]
+        # Renumber the stems that remain, by order of appearance
+        stems, first = np.unique(termIds, return_index=True)
+        stems = stems[np.argsort(first)]
+        stemNos = np.zeros(len(self.stemList), dtype=np.uint32)
+        stemNos[stems] = np.arange(len(stems))
+        shard = {"titles": [], "froms": [], "links": [], "lines": [],
+                 "texts": (self.store.getDocs(live, self._storeSource())
+                           if self.store is not None else []),
+                 "stemList": [self.stemList[t] for t in stems]}
+        for docNo in live.tolist():
+            title = self.docList[docNo]
+            termIds, tfs = self.getDocVector(title)
+            docRepr = [self.stemList[t] + ":" + str(tf) 
+                       for (t, tf) in zip(termIds.tolist(), tfs.tolist())]
+            shard["titles"].append(title)
+            shard["froms"].append(self.docFrom[title])
+            shard["links"].append(self.links[docNo])
+            shard["lines"].append(title + '{' + ','.join(docRepr) + '}\n')
+        shard["triples"] = np.array([np.repeat(np.arange(len(live)), 
+                                               stops - starts),
+                                     stemNos[self.fwdTermIds[postingNos]],
+                                     self.fwdTfs[postingNos]],
+                                    dtype=np.uint32).T.reshape(-1, 3)
+        if self.positional:
+            tfs = self.fwdTfs.astype(np.int64)
+            shard["positions"] = postings.gatherRuns(
+                self.getForwardPositions(), (np.cumsum(tfs) - tfs)[postingNos],
+                tfs[postingNos]).astype(np.uint32)
+        return shard
+        
+    def getForwardPositions(self):
+        """ Read all the positions of the stems, in the order of the 
+        forward index
+        :return: array of the positions of each posting of the forward 
+            index, see getPositions()"""
+        with open(self.positionsPath, "rb") as positionsFile:
+            buf = positionsFile.read()
+        # The positions file is sorted by stem, then by doc:
+        order = np.argsort(self.fwdTermIds, kind="stable")
+        tfs = self.fwdTfs.astype(np.int64)
+        positions = postings.decodePositions(buf, tfs[order])
+        starts = np.empty(len(order), dtype=np.int64)
+        starts[order] = np.cumsum(tfs[order]) - tfs[order]
+        return postings.gatherRuns(positions, starts, tfs)
+        
+    def getSegments(self):
+        """ Return the current view of the index: this index followed by
+        the segments of the added documents.
+        :return: tuple of Index objects"""
+        return (self,) + self.segments
+        
+    def hasUpdates(self):
+        """ Return True if documents were added or deleted since the 
+        indexation (or the last compact())"""
+        return len(self.segments) > 0 or self.deletedNbr > 0
+        
+    def _findSegment(self, docId):
+        """ Return the segment holding the current version of a doc 
+        :raise KeyError: if the doc is unknown or deleted"""
+        for segment in reversed(self.getSegments()):
+            docNo = segment.docNos.get(str(docId))
+            if docNo is not None and not segment.tombstones[docNo]:
+                return segment
+        raise KeyError(docId)
         
+    def _invalidate(self):
+        """ Forget what was computed on the documents """
+        self.stats = None
+        self.stemsMatrix = None
+        self.generation += 1
         
-    def writeStem(self, stem, docId, freq, indexFile):
+    def addDocuments(self, parser, source, txtRepr=None, verbose=False):
+        """ Index new documents in a new segment, without modifying the
+        files of the index. A document with the same ID as an indexed 
+        document replaces it. 
+        :param parser: The Parser object
+        :param source: the path to the file of the new documents
+        :param txtRepr: The TextRepresenter object, by default the one
+            used for the indexation
+        :return: the new segment (Index object)
+        """
+        txtRepr = txtRepr or self.textRepresenter
+        with self.segmentsLock:
+            name = "%s_seg%d" % (self.name, self.segmentCounter)
+            self.segmentCounter += 1
+        segment = Index(name, self.outDir, self.postingsFormat)
+        segment.postingCache = self.postingCache
+        segment.textRepresenter = txtRepr
+        segment.positional = self.positional
+        segment.storeCompression = self.storeCompression
+        segment.storeDocs = self.storeDocs
+        segment.build(iterShards(parser, txtRepr, source, 0, 
+                                 os.path.getsize(source), self.positional,
+                                 texts=self.storeDocs),
+                      verbose)
+        segment.save()
+        segment.openMmap()
+        with self.segmentsLock:
+            self._delete(segment.docList)
+            self.segments = self.segments + (segment,)
+            self._invalidate()
+        self._maybeMerge()
+        return segment
+        
+    def deleteDocuments(self, ids):
+        """ Mark documents as deleted. 
+        :param ids: list of docs ID (int or string)
+        :return: int, the number of deleted docs
+        """
+        with self.segmentsLock:
+            deleted = self._delete(ids)
+            self._invalidate()
+        return deleted
+    
+    def _delete(self, ids):
+        """ Set the tombstones of docs, the lock must be held """
+        deleted = 0
+        for docId in ids:
+            try:
+                segment = self._findSegment(docId)
+            except KeyError:
+                continue
+            segment.tombstones[segment.docNos[str(docId)]] = True
+            deleted += 1
+        self.deletedNbr += deleted
+        return deleted
+        
+    def _maybeMerge(self):
+        """ Merge the segments in a background thread when there are at
+        least self.mergeFactor of them (and no merge is running)"""
+        with self.segmentsLock:
+            if len(self.segments) < self.mergeFactor:
+                return
+            if self.mergeThread is not None and self.mergeThread.is_alive():
+                return
+            self.mergeThread = threading.Thread(target=self._mergeSegments,
+                                                args=(self.segments,),
+                                                daemon=True)
+            self.mergeThread.start()
+            
+    def _mergeSegments(self, segments):
+        """ Replace some consecutive segments by a single one with their
+        documents that are not deleted. 
+        :param segments: tuple of segments of self.segments"""
+        with self.segmentsLock:
+            name = "%s_seg%d" % (self.name, self.segmentCounter)
+            self.segmentCounter += 1
+        merged = Index(name, self.outDir, self.postingsFormat)
+        merged.postingCache = self.postingCache
+        merged.textRepresenter = self.textRepresenter
+        merged.positional = self.positional
+        merged.storeCompression = self.storeCompression
+        merged.storeDocs = self.storeDocs
+        with self.segmentsLock:
+            shards = [segment.toShard() for segment in segments]
+            tombstones = [segment.tombstones.copy() for segment in segments]
+        merged.build(shards)
+        merged.openMmap()
+        with self.segmentsLock:
+            # Docs deleted during the merge:
+            for segment, before in zip(segments, tombstones):
+                deleted = segment.tombstones & ~before
+                for docNo in np.flatnonzero(deleted).tolist():
+                    title = segment.docList[docNo]
+                    if title in merged.docNos:
+                        merged.tombstones[merged.docNos[title]] = True
+            start = self.segments.index(segments[0])
+            self.segments = (self.segments[:start] + (merged,) 
+                             + self.segments[start+len(segments):])
+            self.deletedNbr = sum(int(segment.tombstones.sum()) 
+                                  for segment in self.getSegments())
+            merged.save()
+            # The saved index must not point to the removed segments
+            if os.path.exists(self.manifestPath):
+                self.save()
+        self._retire(segments)
+        self._maybeMerge()
+        
+    def waitForMerges(self):
+        """ Wait until the background merges are finished """
+        while self.mergeThread is not None and self.mergeThread.is_alive():
+            self.mergeThread.join()
+            
+    def compact(self, verbose=False):
+        """ Rewrite the index with all its segments, without the deleted
+        documents. The index has then no segment and no tombstone.
+        :return: None
+        """
+        self.waitForMerges()
+        with self.segmentsLock:
+            compacted = Index(self.name + "_compact", self.outDir, 
+                              self.postingsFormat)
+            compacted.positional = self.positional
+            compacted.storeCompression = self.storeCompression
+            compacted.storeDocs = self.storeDocs
+            compacted.build([segment.toShard() 
+                             for segment in self.getSegments()], verbose)
+            self.closeMmap()
+            os.replace(compacted.indexPath, self.indexPath)
+            os.replace(compacted.invertedPath, self.invertedPath)
+            if self.positional:
+                os.replace(compacted.positionsPath, self.positionsPath)
+            if self.storeDocs:
+                os.replace(compacted.storePath, self.storePath)
+            for attr in ("docList", "docNos", "docPos", "docLen", "vocab",
+                         "stemList", "stemPos", "stemLen", "stemDf", 
+                         "positionsPos", "positionsLen", "stemCf", 
+                         "stemProb", "stemMaxTf", "stemMinLen", "docLens", 
+                         "docNorms", "blockIndptr", "blockLastDoc", 
+                         "blockMaxTf", "blockMinLen", "blockMaxNormTf",
+                         "blockGapPos", "blockTfPos", "fwdIndptr", 
+                         "fwdTermIds", "fwdTfs", "docFrom", "store", "links",
+                         "network", "networkIn", "tombstones"):
+                setattr(self, attr, getattr(compacted, attr))
+            self.postingCache.discard(self.name)
+            self._retire(self.segments)
+            self.segments = ()
+            self.deletedNbr = 0
+            self._invalidate()
+            # The saved index must not point to the removed segments, nor
+            # to the old files
+            if os.path.exists(self.manifestPath):
+                self.save()
+            
+    def _retire(self, segments):
+        """ Forget segments replaced by a merge or by compact(). A reader 
+        may still use them through an older view of getSegments(), so 
+        their files are unmapped and deleted once the segments are garbage
+        collected.
+        :param segments: tuple of Index objects"""
+        for segment in segments:
+            self.postingCache.discard(segment.name)
+            weakref.finalize(segment, closeAndRemove, segment.mmaps,
+                             segment._filePaths())
+            
+    def _filePaths(self):
+        """ Return the paths of the files of the index """
+        return [self.indexPath, self.invertedPath, self.positionsPath,
+                self.storePath, self.manifestPath]
+
+    def removeFiles(self):
+        """ Delete the files of the index """
+        for path in self._filePaths():
+            if os.path.exists(path):
+                os.remove(path)
+        
+    def _filesSignature(self):
+        """ Return the (size, modification time) of the index files """
+        paths = [self.indexPath, self.invertedPath]
+        if self.storeDocs:
+            paths.append(self.storePath)
+        if self.positional:
+            paths.append(self.positionsPath)
+        return np.array([[os.stat(path).st_size, os.stat(path).st_mtime_ns]
+                         for path in paths], dtype=np.int64)
+        
+    def save(self):
+        """ Write the in-memory part of the index (documents, vocabulary,
+        sources, network) to [directory]/[name]_manifest.npz, so it can be
+        reopened with Index.open() without redoing the indexation. The 
+        manifest is written to a temporary file that replaces the old one,
+        so a crash leaves either the old or the new manifest.
+        :return: None
+        """
+        with self.segmentsLock:
+            for segment in self.segments:
+                segment.save()
+            tmpPath = self.manifestPath + ".tmp"
+            with open(tmpPath, "wb") as manifest:
+                self._writeManifest(manifest)
+            os.replace(tmpPath, self.manifestPath)
+
+    def _writeManifest(self, manifest):
+        """ Write the manifest of save() to an open file """
+        np.savez(manifest,
+                 version=MANIFEST_VERSION,
+                 postingsFormat=self.postingsFormat,
+                 files=self._filesSignature(),
+                 docList=np.array(self.docList, dtype=str),
+                 docPos=self.docPos,
+                 docLen=self.docLen,
+                 docFrom=np.array([self.docFrom[title] 
+                                   for title in self.docList], dtype=str),
+                 storeDocs=self.storeDocs,
+                 storeCompression=self.storeCompression,
+                 storeBlockPos=(self.store.blockPos if self.storeDocs
+                                else np.zeros(0, dtype=np.int64)),
+                 storeBlockFirstDoc=(self.store.blockFirstDoc 
+                                     if self.storeDocs
+                                     else np.zeros(0, dtype=np.int64)),
+                 storeDocStarts=(self.store.docStarts if self.storeDocs
+                                 else np.zeros(0, dtype=np.int64)),
+                 stemList=np.array(self.stemList, dtype=str),
+                 stemPos=self.stemPos,
+                 stemLen=self.stemLen,
+                 stemDf=self.stemDf,
+                 positional=self.positional,
+                 positionsPos=(self.positionsPos if self.positional 
+                               else np.zeros(0, dtype=np.int64)),
+                 positionsLen=(self.positionsLen if self.positional 
+                               else np.zeros(0, dtype=np.int64)),
+                 stemCf=self.stemCf,
+                 stemProb=self.stemProb,
+                 stemMaxTf=self.stemMaxTf,
+                 stemMinLen=self.stemMinLen,
+                 docLens=self.docLens,
+                 docNorms=self.docNorms,
+                 blockIndptr=self.blockIndptr,
+                 blockLastDoc=self.blockLastDoc,
+                 blockMaxTf=self.blockMaxTf,
+                 blockMinLen=self.blockMinLen,
+                 blockMaxNormTf=self.blockMaxNormTf,
+                 blockGapPos=self.blockGapPos,
+                 blockTfPos=self.blockTfPos,
+                 fwdIndptr=self.fwdIndptr,
+                 fwdTermIds=self.fwdTermIds,
+                 fwdTfs=self.fwdTfs,
+                 networkIndptr=self.network.indptr,
+                 networkIndices=self.network.indices,
+                 networkData=self.network.data,
+                 networkInIndptr=self.networkIn.indptr,
+                 networkInIndices=self.networkIn.indices,
+                 networkInData=self.networkIn.data,
+                 links=np.array(self.links, dtype=str),
+                 tombstones=self.tombstones,
+                 segmentNames=np.array([segment.name for segment 
+                                        in self.segments], dtype=str),
+                 segmentCounter=self.segmentCounter)
+    
+    @classmethod
+    def open(cls, name, out_dir):
+        """ Reopen an index written by save().
+        :param name: the name of the index
+        :param out_dir: the directory of the index
+        :return: an Index object
+        :raise StaleIndexError: if the manifest has another version, or if
+            the index files were modified after the manifest was written.
+        """
+        index = cls(name, out_dir)
+        with np.load(index.manifestPath, allow_pickle=False) as manifest:
+            if int(manifest["version"]) != MANIFEST_VERSION:
+                raise StaleIndexError("Manifest version %d, expected %d"
+                    % (int(manifest["version"]), MANIFEST_VERSION))
+            index.postingsFormat = str(manifest["postingsFormat"])
+            index.invertedPath = index._invertedPath(index.postingsFormat)
+            index.positional = bool(manifest["positional"])
+            index.storeDocs = bool(manifest["storeDocs"])
+            try:
+                files = index._filesSignature()
+            except FileNotFoundError as e:
+                raise StaleIndexError("Missing index file: %s" % e.filename)
+            if not np.array_equal(files, manifest["files"]):
+                raise StaleIndexError("The index files changed since the "
+                                      "manifest was written")
+            index.docList = manifest["docList"].tolist()
+            index.docNos = {title: i for (i, title) 
+                            in enumerate(index.docList)}
+            index.docPos = manifest["docPos"]
+            index.docLen = manifest["docLen"]
+            index.docFrom = dict(zip(index.docList, 
+                                     manifest["docFrom"].tolist()))
+            index.storeCompression = str(manifest["storeCompression"])
+            if index.storeDocs:
+                index.store = docstore.DocStore(index.storeCompression,
+                                                manifest["storeBlockPos"],
+                                                manifest["storeBlockFirstDoc"],
+                                                manifest["storeDocStarts"])
+            index.stemList = manifest["stemList"].tolist()
+            index.vocab = {stem: i for (i, stem) 
+                           in enumerate(index.stemList)}
+            index.stemPos = manifest["stemPos"]
+            index.stemLen = manifest["stemLen"]
+            index.stemDf = manifest["stemDf"]
+            if index.positional:
+                index.positionsPos = manifest["positionsPos"]
+                index.positionsLen = manifest["positionsLen"]
+            index.stemCf = manifest["stemCf"]
+            index.stemProb = manifest["stemProb"]
+            index.stemMaxTf = manifest["stemMaxTf"]
+            index.stemMinLen = manifest["stemMinLen"]
+            index.docLens = manifest["docLens"]
+            index.docNorms = manifest["docNorms"]
+            for attr in ("blockIndptr", "blockLastDoc", "blockMaxTf", 
+                         "blockMinLen", "blockMaxNormTf", "blockGapPos",
+                         "blockTfPos"):
+                setattr(index, attr, manifest[attr])
+            index.fwdIndptr = manifest["fwdIndptr"]
+            index.fwdTermIds = manifest["fwdTermIds"]
+            index.fwdTfs = manifest["fwdTfs"]
+            shape = (len(index.docList), len(index.docList))
+            index.network = csr_matrix((manifest["networkData"], 
+                                        manifest["networkIndices"],
+                                        manifest["networkIndptr"]), 
+                                       shape=shape)
+            index.networkIn = csc_matrix((manifest["networkInData"],
+                                          manifest["networkInIndices"],
+                                          manifest["networkInIndptr"]),
+                                         shape=shape)
+            index.links = manifest["links"].tolist()
+            index.tombstones = manifest["tombstones"]
+            index.segmentCounter = int(manifest["segmentCounter"])
+            segmentNames = manifest["segmentNames"].tolist()
+        try:
+            index.segments = tuple(cls.open(segmentName, out_dir) 
+                                   for segmentName in segmentNames)
+        except FileNotFoundError as e:
+            raise StaleIndexError("Missing segment file: %s" % e.filename)
+        for segment in index.segments:
+            segment.postingCache = index.postingCache
+            segment.openMmap()
+        index.deletedNbr = sum(int(segment.tombstones.sum()) 
+                               for segment in index.getSegments())
+        return index
+        
+    def openMmap(self, warmup=False):
+        """ Map the index and the inverted index in memory: the lookups
+        will then be served by slices of the maps instead of opening and
+        reading the files on each call.
+        :param warmup: bool, prefetch the whole files in memory
+        :return: None
+        """
+        with self.mmapLock:
+            if self.mmaps is not None:
+                for mapped in self.mmaps.values():
+                    mapped.close()
+            self.mmaps = {"index": MmapFile(self.indexPath, warmup),
+                          "inverted": MmapFile(self.invertedPath, warmup)}
+            if self.storeDocs:
+                self.mmaps["store"] = MmapFile(self.storePath, warmup)
+            if self.positional:
+                self.mmaps["positions"] = MmapFile(self.positionsPath, 
+                                                   warmup)
+            
+    def closeMmap(self):
+        """ Unmap the index files, the lookups will read the files again
+        """
+        with self.mmapLock:
+            if self.mmaps is not None:
+                for mapped in self.mmaps.values():
+                    mapped.close()
+                self.mmaps = None
+    
+    def _logPhase(self, phase, start, docsNbr, verbose):
+        """ Store (and print if verbose) the duration of an indexation phase
+        in self.buildStats[phase]
+        :param phase: string, the name of the phase
+        :param start: float, the time.time() when the phase started
+        :param docsNbr: int, the number of documents processed
+        """
+        seconds = time.time() - start
+        docsPerSec = docsNbr / seconds if seconds > 0 else float("inf")
+        self.buildStats[phase] = {"seconds": seconds, "docs": docsNbr,
+                                  "docsPerSec": docsPerSec}
+        if verbose:
+            print("%s phase: %d docs in %.3fs (%.1f docs/s)"
+                  % (phase, docsNbr, seconds, docsPerSec))
+        
+        
+    def mergeShard(self, shard, index, spill):
+        """ Append the documents of a shard to the index (used in 1st pass)
+        
+        :param shard: dict returned by indexShard()
+        :param index: the open index file
+        :param spill: the open spill file
+        
+        :return: None"""
+        offset = len(self.docList)
+        # Stem numbers of the shard -> stem numbers of the index
+        stemNos = np.array([self.addToVocabulary(stem) 
+                            for stem in shard["stemList"]], dtype=np.uint32)
+        for title, source, line, docLinks in zip(shard["titles"], 
+                shard["froms"], shard["lines"], shard["links"]):
+            self.docFrom[title] = source
+            self.docPos.append(index.tell())
+            self.docLen.append(len(line))
+            index.write(line)
+            self.docNos[title] = len(self.docList)
+            self.docList.append(title)
+            self.links.append(docLinks)
+        triples = shard["triples"].copy()
+        triples[:, 0] += offset
+        triples[:, 1] = stemNos[triples[:, 1]]
+        if self.postingsFormat == "text":
+            for docNo, stemNo, freq in triples.tolist():
+                self.addStem(stemNo, self.docList[docNo], freq)
+        triples.tofile(spill)
+        
+    def writeBinaryPostings(self, stemNos, docNos, tfs):
+        """ Write the binary inverted index (used in 2nd pass)
+        
+        :param stemNos: array of the stem number of each posting
+        :param docNos: array of the doc number of each posting
+        :param tfs: array of the frequency of each posting
+        
+        :return: None"""
+        self.stemPos = np.zeros(len(self.stemList), dtype=np.int64)
+        self.stemLen = np.zeros(len(self.stemList), dtype=np.int64)
+        self.stemDf = np.zeros(len(self.stemList), dtype=np.int64)
+        with open(self.invertedPath, "wb") as invIndex:
+            for stemNo, buf, df in postings.encodeAllPostings(
+                    stemNos, docNos, tfs, len(self.stemList)):
+                self.stemPos[stemNo] = invIndex.tell()
+                self.stemLen[stemNo] = len(buf)
+                self.stemDf[stemNo] = df
+                invIndex.write(buf)
+        
+    def writePositions(self, stemNos, tfs, positions):
+        """ Write the positions of the stems (used in 2nd pass), in the
+        order of the posting lists, see postings.encodePositions()
+        
+        :param stemNos: array of the stem number of each posting, by doc
+        :param tfs: array of the frequency of each posting
+        :param positions: array of the positions of each posting, in the
+            order of the postings
+        
+        :return: None"""
+        tfs = tfs.astype(np.int64)
+        order = np.argsort(stemNos, kind="stable")
+        positions = postings.gatherRuns(positions, 
+                                        (np.cumsum(tfs) - tfs)[order], 
+                                        tfs[order])
+        buf, lens = postings.encodePositions(positions, tfs[order])
+        # Bytes of each stem:
+        self.positionsLen = np.bincount(
+            np.repeat(stemNos[order], tfs[order]), weights=lens,
+            minlength=len(self.stemList)).astype(np.int64)
+        self.positionsPos = np.cumsum(self.positionsLen) - self.positionsLen
+        buf.tofile(self.positionsPath)
+        
+    def convertPostings(self, verbose=False):
+        """ Convert the text inverted index of an indexed collection into
+        the binary format, and use it from now on.
+        
+        :return: None"""
+        if self.postingsFormat == "binary":
+            return
+        mapped = self.mmaps is not None
+        self.closeMmap()
+        stemNos, docNos, tfs = [], [], []
+        for stem, docs, freqs in postings.readTextPostings(self.invertedPath):
+            stemNos += [self.vocab[stem]] * len(docs)
+            docNos += [self.docNos[doc] for doc in docs]
+            tfs += freqs
+        self.postingsFormat = "binary"
+        self.invertedPath = self._invertedPath("binary")
+        self.writeBinaryPostings(np.array(stemNos, dtype=np.int64),
+                                 np.array(docNos, dtype=np.int64),
+                                 np.array(tfs, dtype=np.int64))
+        if mapped:
+            self.openMmap()
+        if verbose:
+            print("Converted postings to", self.invertedPath)
+        
+    def writeStem(self, stemNo, docId, freq, indexFile):
         """Write the stem in the inverted index (used in 2nd pass)
         
-        :param stem: The word to write
+        :param stemNo: The number of the word to write
         :param docId: The identifier for the document
         :param freq: The frequency of the stem in the document
         :param indexFile: The file handler. Should be an open file
         
         :return: None"""
-        if self.stems[stem]["pos"] >= 0:  # We already encoutered this stem
-            cursor = self.stems[stem]["pos"]
+        if self.stemPos[stemNo] >= 0:  # We already encoutered this stem
+            cursor = self.stemPos[stemNo]
             indexFile.seek(cursor)
-            repres = indexFile.read(self.stems[stem]["len"])
+            repres = indexFile.read(self.stemLen[stemNo])
              # Write the docId after the first ',,'
             idx_empty = repres.find(',,')
             # Relative seek:
             indexFile.seek(cursor + idx_empty + 1)
             indexFile.write(docId + ':' + str(freq))
-            indexFile.seek(cursor)
-            repres = indexFile.read(self.stems[stem]["len"])
 
         else: # New stem
             indexFile.seek(0, os.SEEK_END)
-            self.stems[stem]["pos"] = indexFile.tell()
-            startRepr = stem + '{' + docId + ":" + str(freq)
+            self.stemPos[stemNo] = indexFile.tell()
+            startRepr = self.stemList[stemNo] + '{' + docId + ":" + str(freq)
             endRepr = '}\n'
-            midRepr = (self.stems[stem]["len"] - len(startRepr) - len(endRepr)) * ','
+            midRepr = (self.stemLen[stemNo] - len(startRepr) 
+                       - len(endRepr)) * ','
             repres = startRepr + midRepr + endRepr
             indexFile.write(repres)
         
-    def addStem(self, stem, docId, freq):
-        """ Add the stem in self.stems (used in 1st pass)
+    def addToVocabulary(self, stem):
+        """ Add the stem in the vocabulary if it is new (used in 1st pass)
         
         :param stem: The word to add to the vocabulary
+        
+        :return: int, the stem number"""
+        stemNo = self.vocab.get(stem)
+        if stemNo is None:
+            stemNo = len(self.stemList)
+            self.vocab[stem] = stemNo
+            self.stemList.append(stem)
+            self.stemPos.append(-1)
+            self.stemLen.append(0)
+            self.stemDf.append(-1)
+        return stemNo
+        
+    def addStem(self, stemNo, docId, freq):
+        """ Compute the length of the text representation of a stem 
+        (used in 1st pass)
+        
+        :param stemNo: The number of the word, see addToVocabulary()
         :param docId: string, the identifier for the document
         :param freq: The frequency of stem in doc.
         
         :return: None
         """
-        if stem in self.stems:        # Not a new stem
+        if self.stemLen[stemNo] > 0:        # Not a new stem
             addRepr = docId + ':' + str(freq) + ','
             lenToAdd = len(addRepr) 
-            self.stems[stem]["len"] += lenToAdd
+            self.stemLen[stemNo] += lenToAdd
             
-        else:  # Or add the new stem:
-            addRepr = stem + '{' + docId + ':' + str(freq) + '}\n'
-            lenToAdd = len(addRepr)
-            self.stems[stem] = {"pos": -1,
-                                "len": lenToAdd}
+        else:  # Or the first doc of the stem:
+            addRepr = (self.stemList[stemNo] + '{' + docId + ':' + str(freq) 
+                       + '}\n')
+            self.stemLen[stemNo] = len(addRepr)
         
     def getTfsForDoc(self, docId):
         """ Return the stems found inside a document, with their
@@ -175,49 +1285,325 @@ class Index(object):
         
         :return: a dictionary of {string(stem): int(frequency)}"""
         
-        (pos, length) = self.docs[str(docId)]
-        tfs = None
-        with open(self.indexPath, 'r') as index:
-            index.seek(pos)
-            descr = index.read(length)
-            start = descr.find('{')
-            stop = descr.find('}')
-            descr = descr[start+1:stop]
-            freqs = [stem.split(':') for stem in descr.split(',')]
-            tfs = {word:int(freq) for (word, freq) in freqs}
+        if self.hasUpdates():
+            segment = self._findSegment(docId)
+            if segment is not self:
+                return segment.getTfsForDoc(docId)
+        if self.fwdIndptr is not None:
+            termIds, tfs = self.getDocVector(docId)
+            return {self.stemList[t]: tf 
+                    for (t, tf) in zip(termIds.tolist(), tfs.tolist())}
+        docNo = self.docNos[str(docId)]
+        pos, length = self.docPos[docNo], self.docLen[docNo]
+        mmaps = self.mmaps
+        if mmaps is not None:
+            descr = mmaps["index"].line(pos).decode()
+        else:
+            with open(self.indexPath, 'r') as index:
+                index.seek(pos)
+                descr = index.read(length)
+        start = descr.find('{')
+        stop = descr.find('}')
+        descr = descr[start+1:stop]
+        freqs = [stem.split(':') for stem in descr.split(',') if stem]
+        tfs = {word:int(freq) for (word, freq) in freqs}
         
         return tfs
         
+    def getDocVector(self, docId):
+        """ Return the stems of a document from the forward index, without
+        copying them.
+        
+        :param docId: The identifier for the wanted document (may be int or
+            string)
+        
+        :return: (array of stem numbers, array of frequencies), views on
+            the forward index. The stem numbers are positions in 
+            self.stemList.
+        Like the other arrays of the index, it ignores the added and the
+        deleted documents until compact() is called."""
+        docNo = self.docNos[str(docId)]
+        start, stop = self.fwdIndptr[docNo], self.fwdIndptr[docNo+1]
+        return self.fwdTermIds[start:stop], self.fwdTfs[start:stop]
+    
+    def getDocTermMatrix(self):
+        """ Return the whole forward index as a sparse matrix, sharing the
+        arrays of the index.
+        :return: scipy.sparse.csr_matrix m, m[i,j] = frequency of the stem 
+            number j in the doc number i"""
+        return csr_matrix((self.fwdTfs, self.fwdTermIds, self.fwdIndptr),
+                          shape=(len(self.docList), len(self.stemList)),
+                          copy=False)
+        
+    def getStemsMatrix(self):
+        """ Return the forward index as a CSC sparse matrix, to slice the
+        columns of some stems. It is computed on the first call.
+        :return: scipy.sparse.csc_matrix m, m[i,j] = frequency of the stem
+            number j in the doc number i"""
+        stemsMatrix = self.stemsMatrix
+        if stemsMatrix is None:
+            stemsMatrix = self.getDocTermMatrix().tocsc()
+            self.stemsMatrix = stemsMatrix
+        return stemsMatrix
+        
+    def getPostings(self, stem):
+        """Return the posting list of a given stem as arrays
+        :param stem: The wanted word
+        :return: (array of doc numbers, array of frequencies), the doc 
+            numbers are the positions of the docs in self.docList"""
+        stemNo = self.vocab.get(stem)
+        if stemNo is None:
+            return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+        cached = self.postingCache.get(self.name, stem)
+        if cached is not None:
+            return cached
+        if self.postingsFormat == "text":
+            docFreq = self._readTextPostings(stemNo)
+            docTfs = (np.array([self.docNos[docId] 
+                                for (docId, freq) in docFreq], dtype=np.int64),
+                      np.array([freq for (docId, freq) in docFreq], 
+                               dtype=np.int64))
+            return self.postingCache.put(self.name, stem, docTfs)
+        mmaps = self.mmaps
+        if mmaps is not None:
+            buf = mmaps["inverted"].slice(self.stemPos[stemNo],
+                                          self.stemLen[stemNo])
+        else:
+            with open(self.invertedPath, "rb") as invIndex:
+                invIndex.seek(self.stemPos[stemNo])
+                buf = invIndex.read(self.stemLen[stemNo])
+        return self.postingCache.put(self.name, stem, 
+                                     postings.decodePostings(
+                                         buf, self.stemDf[stemNo]))
+    
+    def warmPostingCache(self, queries, txtRepr=None, stemsNbr=100):
+        """ Load the posting lists of the stems that are the most frequent
+        in a query log in the static part of the posting cache, where they
+        stay (see cache.PostingCache).
+        :param queries: list of query texts, see query.readQueryLog()
+        :param txtRepr: The TextRepresenter object, by default the one
+            used for the indexation
+        :param stemsNbr: int, the number of stems to load
+        :return: list of the loaded stems, the most frequent first
+        """
+        txtRepr = txtRepr or self.textRepresenter
+        counts = collections.Counter()
+        for text in queries:
+            counts.update(txtRepr.getTextRepresentation(text))
+        vocab = self.getStats()["vocab"]
+        stems = [stem for (stem, count) in counts.most_common() 
+                 if stem in vocab][:stemsNbr]
+        self.postingCache.pin(stems)
+        for segment in self.getSegments():
+            for stem in stems:
+                segment.getPostings(stem)
+        return stems
+    
+    def getPostingCacheStats(self):
+        """ Return the counters of the posting cache, see 
+        cache.PostingCache.getStats()"""
+        return self.postingCache.getStats()
+        
+    def getBlocks(self, stem):
+        """ Return the maximum impacts of the blocks of the posting list of
+        a stem, see computeBlocks(). 
+        :param stem: The wanted word
+        :return: dict of arrays, one value per block {"lastDoc": last doc 
+            number, "maxTf": highest frequency, "minLen": length of the
+            shortest doc, "maxNormTf": highest frequency/doc norm}"""
+        stemNo = self.vocab.get(stem)
+        if stemNo is None:
+            start, stop = 0, 0
+        else:
+            start, stop = self.blockIndptr[stemNo:stemNo+2]
+        return {"lastDoc": self.blockLastDoc[start:stop],
+                "maxTf": self.blockMaxTf[start:stop],
+                "minLen": self.blockMinLen[start:stop],
+                "maxNormTf": self.blockMaxNormTf[start:stop]}
+        
+    def getPostingsBlock(self, stem, block):
+        """ Decode one block of the posting list of a stem, without reading
+        the other blocks (the skip pointers are in getBlocks()). A list of
+        the posting cache is sliced instead. The text format has no 
+        blocks: its whole list is read.
+        :param stem: The wanted word, in the index
+        :param block: int, the number of the block in the list of the stem
+        :return: (array of doc numbers, array of frequencies)"""
+        stemNo = self.vocab[stem]
+        cached = self.postingCache.peek(self.name, stem)
+        if cached is None and self.postingsFormat == "text":
+            cached = self.getPostings(stem)
+        if cached is not None:
+            start = block * postings.BLOCK_SIZE
+            return (cached[0][start:start+postings.BLOCK_SIZE],
+                    cached[1][start:start+postings.BLOCK_SIZE])
+        first, stop = self.blockIndptr[stemNo:stemNo+2]
+        blockNo = first + block
+        gapStart = self.blockGapPos[blockNo]
+        tfStart = self.blockTfPos[blockNo]
+        # The gaps of the last block stop at the first frequency
+        gapEnd = (self.blockGapPos[blockNo+1] if blockNo+1 < stop 
+                  else self.blockTfPos[first])
+        tfEnd = (self.blockTfPos[blockNo+1] if blockNo+1 < stop 
+                 else self.stemLen[stemNo])
+        pos = self.stemPos[stemNo]
+        mmaps = self.mmaps
+        if mmaps is not None:
+            gapBuf = mmaps["inverted"].slice(pos + gapStart, gapEnd - gapStart)
+            tfBuf = mmaps["inverted"].slice(pos + tfStart, tfEnd - tfStart)
+        else:
+            with open(self.invertedPath, "rb") as invIndex:
+                invIndex.seek(pos + gapStart)
+                gapBuf = invIndex.read(gapEnd - gapStart)
+                invIndex.seek(pos + tfStart)
+                tfBuf = invIndex.read(tfEnd - tfStart)
+        base = self.blockLastDoc[blockNo-1] if block > 0 else 0
+        return postings.decodeBlock(gapBuf, tfBuf, base)
+        
+    def getPositions(self, stem):
+        """ Return the posting list of a stem with the positions of the 
+        stem in each doc, read from the positions file. 
+        :param stem: The wanted word
+        :return: (array of doc numbers, array of frequencies, array of the
+            positions), the positions of the i-th doc are the frequencies[i]
+            positions after the ones of the previous docs
+        :raise ValueError: if the positions are not indexed"""
+        if not self.positional:
+            raise ValueError("The positions of %s are not indexed, see "
+                             "Index.indexation(positions=True)" % self.name)
+        docNos, tfs = self.getPostings(stem)
+        stemNo = self.vocab.get(stem)
+        if stemNo is None:
+            return docNos, tfs, np.zeros(0, dtype=np.int64)
+        mmaps = self.mmaps
+        if mmaps is not None:
+            buf = mmaps["positions"].slice(self.positionsPos[stemNo],
+                                           self.positionsLen[stemNo])
+        else:
+            with open(self.positionsPath, "rb") as positionsFile:
+                positionsFile.seek(self.positionsPos[stemNo])
+                buf = positionsFile.read(self.positionsLen[stemNo])
+        return docNos, tfs, postings.decodePositions(buf, tfs)
+        
     def getTfsForStem(self, stem):
         """Return the doc frequencies of a given stem
         :param stem: The wanted word
         :return: A dictionary {int(docId}: int(frequency)}"""
-        if stem not in self.stems:
-            return {}
-        with open(self.invertedPath, "r") as invIndex:
-            invIndex.seek(self.stems[stem]["pos"])
-            repres = invIndex.read(self.stems[stem]["len"])             
-            # 'repres' should look like: "[stem]{[doc]:[freq], ...}\n"
-            if not repres.startswith(stem):
-                print("Error with the representation.")                
+        docFreq = {}
+        for segment in self.getSegments():
+            docNos, tfs = segment.getPostings(stem)
+            if self.deletedNbr > 0:
+                live = ~segment.tombstones[docNos]
+                docNos, tfs = docNos[live], tfs[live]
+            docList = segment.docList
+            docFreq.update({int(docList[d]): tf 
+                            for (d, tf) in zip(docNos.tolist(), tfs.tolist())})
+        return docFreq
+        
+    def _readTextPostings(self, stemNo):
+        """ Read the posting list of a stem in the text inverted index
+        :param stemNo: the number of the stem
+        :return: list of (string doc id, int frequency)"""
+        stem = self.stemList[stemNo]
+        mmaps = self.mmaps
+        if mmaps is not None:
+            repres = mmaps["inverted"].line(self.stemPos[stemNo]).decode()
+            repres += "\n"
+        else:
+            with open(self.invertedPath, "r") as invIndex:
+                invIndex.seek(self.stemPos[stemNo])
+                repres = invIndex.read(self.stemLen[stemNo])             
+        # 'repres' should look like: "[stem]{[doc]:[freq], ...}\n"
+        if not repres.startswith(stem):
+            print("Error with the representation.")                
         # Parsing the representation:
         # List of strings of the format "[docId]:[freq]":
-        docFreq = repres.strip(stem)[1:-2].split(',')
+        docFreq = repres[len(stem)+1:-2].split(',')
         # List of lists of the format ['[docId]', '[freq]']:
-        docFreq = [s.split(':') for s in docFreq]
-        # Constructing the final dictionary:
-        docFreq = {int(docId):int(freq) for (docId, freq) in docFreq}
-        return docFreq
+        docFreq = [s.split(':') for s in docFreq if s]
+        return [(docId, int(freq)) for (docId, freq) in docFreq]
+        
+    def getStats(self):
+        """ Return the statistics of the docs that are not deleted, in this
+        index and its segments. Without updates, they are the arrays of 
+        computeStats(), otherwise they are merged once per generation.
+        :return: dict {"vocab": {stem: number}, 
+                       "df", "cf", "prob", "maxTf": arrays by number of 
+                       "vocab", "prob" being the collection language model,
+                       "docsCount": int, "totalLen": int}"""
+        with self.segmentsLock:
+            if self.stats is None and not self.hasUpdates():
+                self.stats = {"vocab": self.vocab, "df": self.stemDf,
+                              "cf": self.stemCf, "prob": self.stemProb,
+                              "maxTf": self.stemMaxTf,
+                              "docsCount": len(self.docList),
+                              "totalLen": int(self.docLens.sum())}
+            elif self.stats is None:
+                self.stats = self._mergeStats()
+            return self.stats
+            
+    def _mergeStats(self):
+        """ Compute the statistics of the segments, see getStats() """
+        vocab = {}
+        stemNos, tfs = [], []
+        for segment in self.getSegments():
+            docNos = np.repeat(np.arange(len(segment.docList)),
+                               np.diff(segment.fwdIndptr))
+            live = ~segment.tombstones[docNos]
+            # Stem numbers of the segment -> stem numbers of the stats
+            segmentNos = np.array([vocab.setdefault(stem, len(vocab)) 
+                                   for stem in segment.stemList], 
+                                  dtype=np.int64)
+            stemNos.append(segmentNos[segment.fwdTermIds[live]])
+            tfs.append(segment.fwdTfs[live].astype(np.int64))
+        stemNos, tfs = np.concatenate(stemNos), np.concatenate(tfs)
+        maxTf = np.zeros(len(vocab), dtype=np.int64)
+        np.maximum.at(maxTf, stemNos, tfs)
+        cf = np.bincount(stemNos, weights=tfs, 
+                         minlength=len(vocab)).astype(np.int64)
+        return {"vocab": vocab, 
+                "df": np.bincount(stemNos, minlength=len(vocab)),
+                "cf": cf, "prob": cf / max(cf.sum(), 1),
+                "maxTf": maxTf,
+                "docsCount": self.getDocsCount(),
+                "totalLen": int(tfs.sum())}
+        
+    def _stemStat(self, stem, stat):
+        """ Return a statistic of getStats() for a stem, 0 if unknown """
+        stats = self.getStats()
+        stemNo = stats["vocab"].get(stem)
+        if stemNo is None:
+            return 0
+        return int(stats[stat][stemNo])
+        
+    def getDf(self, stem):
+        """ Return the number of docs that contain a stem """
+        return self._stemStat(stem, "df")
+    
+    def getCf(self, stem):
+        """ Return the number of occurences of a stem in the collection """
+        return self._stemStat(stem, "cf")
+    
+    def getMaxTf(self, stem):
+        """ Return the highest frequency of a stem in a doc """
+        return self._stemStat(stem, "maxTf")
+    
+    def getCollectionProb(self, stem):
+        """ Return the probability of a stem in the collection language 
+        model: its number of occurences over the length of the collection.
+        0 if the stem is unknown."""
+        stats = self.getStats()
+        stemNo = stats["vocab"].get(stem)
+        if stemNo is None:
+            return 0.
+        return float(stats["prob"][stemNo])
         
     def computeIdf(self, stem):
         """ Compute the inverse doc frequency for a stem"""
-        if stem not in self.idf:
-            n = len(self.getTfsForStem(stem))
-            if n == 0:
-                return 0
-            else :
-                self.idf[stem] = np.log(len(self.docs)/n)
-        return self.idf[stem]
+        n = self.getDf(stem)
+        if n == 0:
+            return 0
+        return np.log(self.getStats()["docsCount"]/n)
 
 
     def probIdf(self, stem):
@@ -226,90 +1612,195 @@ class Index(object):
         :param stem: string, the word.
         :return: The probabilistic IDF weight.
         """
-        N = len(self.docs)
-        nt = len(self.getTfsForStem(stem))
+        N = self.getStats()["docsCount"]
+        nt = self.getDf(stem)
         return max(0, np.log((N-nt+0.5)/(nt+0.5)))
     
     def getStrDoc(self, doc):
         """ Return the string from where a document came in the 
-        source file""" 
-        srcPath, pos, length = self.docFrom[int(doc)]
-        with open(srcPath, 'r') as f:
-            f.seek(pos)
-            txt = f.read(length)
-        return txt
+        source file, read from the doc store, see getDocs()""" 
+        return self.getDocs([doc])[0]
+    
+    def getDocs(self, docIds):
+        """ Return some documents as they were in the source files. They
+        are read from the compressed doc store written by the indexation,
+        each block of docs is decompressed once (see docstore.py), or from
+        the source files if the index has no doc store. 
+        :param docIds: list of doc ids
+        :return: list of strings, in the order of docIds
+        :raise KeyError: if a doc is unknown or deleted"""
+        docIds = [str(docId) for docId in docIds]
+        # {segment: positions in docIds}
+        bySegment = {}
+        for i, docId in enumerate(docIds):
+            segment = self._findSegment(docId) if self.hasUpdates() else self
+            bySegment.setdefault(segment, []).append(i)
+        texts = [None] * len(docIds)
+        for segment, positions in bySegment.items():
+            docNos = [segment.docNos[docIds[i]] for i in positions]
+            if segment.store is not None:
+                segmentTexts = segment.store.getDocs(docNos, 
+                                                     segment._storeSource())
+            else:
+                segmentTexts = [segment._readSource(docIds[i]) 
+                                for i in positions]
+            for i, text in zip(positions, segmentTexts):
+                texts[i] = text
+        return texts
+    
+    def _readSource(self, docId):
+        """ Read a document in its source file, see docFrom """
+        srcPath, pos, length = self.docFrom[docId].split(';')
+        with open(srcPath, "rb") as source:
+            source.seek(int(pos))
+            return source.read(int(length)).decode()
+    
+    def _storeSource(self):
+        """ Return the memory map of the doc store if the files are mapped,
+        otherwise its path """
+        mmaps = self.mmaps
+        return mmaps["store"] if mmaps is not None else self.storePath
+    
+    def getSnippets(self, docIds, query, txtRepr=None, parser=None,
+                    length=200, highlight=None):
+        """ Return the query-biased snippets of some documents, see 
+        docstore.makeSnippet().
+        :param docIds: list of doc ids, for instance the first results of
+            a model
+        :param query: dict {stem: frequency}, or string stemmed by txtRepr
+        :param txtRepr: The TextRepresenter object, by default the one
+            used for the indexation
+        :param parser: The Parser object whose getDocument() extracts the
+            text of a doc, by default the one used for the indexation,
+            otherwise the snippets are made from the docs as they are in
+            the source files
+        :param length: int, the maximum number of characters of a snippet
+        :param highlight: (before, after) strings that surround the words
+            of the query, for instance ("<b>", "</b>")
+        :return: list of strings, in the order of docIds"""
+        txtRepr = txtRepr or self.textRepresenter
+        parser = parser or getattr(self, "parser", None)
+        if isinstance(query, str):
+            query = txtRepr.getTextRepresentation(query)
+        snippets = []
+        for text in self.getDocs(docIds):
+            if parser is not None:
+                text = parser.getDocument(text).getText()
+            snippets.append(docstore.makeSnippet(text, query, txtRepr, 
+                                                 length, highlight))
+        return snippets
 
     def getDocsID(self):
         """
         :return: list of string, the list of all known documents.
         """
-        return list(self.docs.keys())
+        if self.hasUpdates():
+            return [title for segment in self.getSegments() 
+                    for (title, deleted) in zip(segment.docList, 
+                                                segment.tombstones) 
+                    if not deleted]
+        return list(self.docList)
+    
+    def getDocsCount(self):
+        """ Return the number of documents """
+        if self.hasUpdates():
+            return sum(len(segment.docList) for segment 
+                       in self.getSegments()) - self.deletedNbr
+        return len(self.docList)
         
     def getStems(self):
         """ Return the entire vocabulary of the collection 
         :return: list of string, the list of all known words.
         """
-        return list(self.stems.keys())
+        if self.segments:
+            return list(dict.fromkeys(itertools.chain.from_iterable(
+                segment.stemList for segment in self.getSegments())))
+        return list(self.stemList)
 
     def getDocsLen(self, doc_id):
         """Return the number of words inside a document"""
-        stems = self.getTfsForDoc(doc_id)
-        length = sum(stems.values())
-        return length
+        if self.hasUpdates():
+            segment = self._findSegment(doc_id)
+            if segment is not self:
+                return segment.getDocsLen(doc_id)
+        return int(self.docLens[self.docNos[str(doc_id)]])
+    
+    def getDocNorm(self, doc_id):
+        """Return the L2 norm of the frequencies of a document"""
+        if self.hasUpdates():
+            segment = self._findSegment(doc_id)
+            if segment is not self:
+                return segment.getDocNorm(doc_id)
+        return float(self.docNorms[self.docNos[str(doc_id)]])
+    
+    def getDocsLens(self):
+        """ Return the number of words inside every document of the index
+        (deleted docs included, added docs excluded)
+        :return: array, by doc number"""
+        return self.docLens
     
     def getMeanDocLen(self):
-        if self.meanDocLen is None:
-            totalLen = 0
-            docsNumber = 0
-            for doc_id in self.getDocsID():
-                totalLen += self.getDocsLen(doc_id)
-                docsNumber += 1
-            self.meanDocLen = totalLen/docsNumber
-        return self.meanDocLen
+        stats = self.getStats()
+        return stats["totalLen"] / stats["docsCount"]
+
+    def getNetwork(self):
+        """ Return the citation graph of the docs of the index and of its
+        segments that are not deleted. Without updates it is the graph 
+        built at the indexation, otherwise the links of all the segments 
+        are resolved again (a doc of a segment may cite a doc of another
+        one), once per generation.
+        :return: (list of the doc ids, by doc number of the graph, dict 
+                  {doc id: doc number}, csr_matrix of the successors, 
+                  csc_matrix of the predecessors)"""
+        if not self.hasUpdates():
+            return self.docList, self.docNos, self.network, self.networkIn
+        with self.segmentsLock:
+            view = self.networkView
+            if view is not None and view[0] == self.generation:
+                return view[1:]
+            docList, links = [], []
+            for segment in self.getSegments():
+                for docNo in np.flatnonzero(~segment.tombstones).tolist():
+                    docList.append(segment.docList[docNo])
+                    links.append(segment.links[docNo])
+            docNos = {title: i for (i, title) in enumerate(docList)}
+            network, networkIn, unknown = linkGraph(docNos, links)
+            self.networkView = (self.generation, docList, docNos, network,
+                                networkIn)
+            return self.networkView[1:]
 
     def getSuccNodes(self, doc_id):
         """
         Get docs pointed by a document
-        :return: List of ints of document ID
+        :return: List of strings of document ID
+        :raise KeyError: if the doc is unknown or deleted
         """
-        return np.array(self.network[int(doc_id)-1,:].nonzero()[1], dtype=int)+1
+        docList, docNos, network, networkIn = self.getNetwork()
+        docNo = docNos[str(doc_id)]
+        start, stop = network.indptr[docNo:docNo+2]
+        return [docList[d] for d in network.indices[start:stop].tolist()]
         
     def getPrevNodes(self, doc_id):
         """ Get docs that point to a document
+        :return: List of strings of document ID
+        :raise KeyError: if the doc is unknown or deleted
         """
-        return np.array(self.network[:,int(doc_id)-1].nonzero()[0], dtype=int)+1
+        docList, docNos, network, networkIn = self.getNetwork()
+        docNo = docNos[str(doc_id)]
+        start, stop = networkIn.indptr[docNo:docNo+2]
+        return [docList[d] for d in networkIn.indices[start:stop].tolist()]
 
 class InMemoryIndex(Index):
+    """ An index of a small collection that isn't saved: it is built like
+    an Index in a temporary directory, removed with the object, and its
+    files are prefetched in memory """
 
     def __init__(self, srcFile, parser, txtRepr):
-        super().__init__("index",".")
-        parser.initFile(srcFile)
-        doc = parser.nextDocument()
-        while doc is not None:
-            docId = doc.getId()
-            docStems = txtRepr.getTextRepresentation(doc.getText())
-            for stem, freq in docStems.items():
-                if stem in self.stems:
-                    self.stems[stem][docId] = freq
-                else:
-                    self.stems[stem]={docId:freq}
-                if docId in self.docs:
-                    self.docs[docId][stem] = freq
-                else:
-                    self.docs[docId] = {stem:freq}
-            doc = parser.nextDocument()
-
-    def getTfsForDoc(self, docId):
-        if docId not in self.docs.keys():
-            return []
-        else:
-            return self.docs[docId]
-
-    def getTfsForStem(self, stem):
-        if stem not in self.stems.keys():
-            return []
-        else:
-            return self.stems[stem]
+        outDir = tempfile.mkdtemp(prefix="index_")
+        super().__init__("index", outDir)
+        self.removeDir = weakref.finalize(self, shutil.rmtree, outDir, True)
+        self.indexation(srcFile, parser, txtRepr)
+        self.openMmap(warmup=True)
 
 
         
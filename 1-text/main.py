@@ -33,11 +33,16 @@ if __name__ == "__main__":
     cacm_qry = os.path.join(srcFolder, qryFile)
     cacm_rel = os.path.join(srcFolder, relFile)
 
-    # Construct the index:
-    idx = indexation.Index(indexName, gendata)
+    # Reopen the index, or construct it if it was never saved:
     stemmer = TextRepresenter.PorterStemmer()
-    idx.indexation(cacm_txt, ParserCACM.ParserCACM(),
-                   stemmer)
+    try:
+        idx = indexation.Index.open(indexName, gendata)
+    except (FileNotFoundError, indexation.StaleIndexError) as e:
+        print("Could not reopen the index (%s), reindexing" % e)
+        idx = indexation.Index(indexName, gendata)
+        idx.indexation(cacm_txt, ParserCACM.ParserCACM(),
+                       stemmer)
+        idx.save()
 
     print("\n###### A bit of testing: ###### ")
     print("Retrieve stems in doc %d:" % docId)
@@ -68,7 +73,7 @@ if __name__ == "__main__":
     print("\n###### Testing Vectoriel with BinaryWeighter: ###### ")
     vect = modeles.Vectoriel(idx, bw)
     print("Top 10 documents for the query:")
-    print(vect.getRanking(query)[:10])
+    print(vect.getRanking(query, 10))
 
     print("\n###### Testing BinaryWeighter: ###### ")
     tfidfWeighter = modeles.TfidfWeighter(idx)
@@ -83,7 +88,7 @@ if __name__ == "__main__":
     print("\n###### Testing Vectoriel with TfidfWeighter: ###### ")
     vect = modeles.Vectoriel(idx, tfidfWeighter)
     print("Top 10 documents for the query:")
-    print(vect.getRanking(query)[:10])
+    print(vect.getRanking(query, 10))
 
     print("\n###### Testing QueryParserCACM: ###### ")
     qp = QueryParserCACM(cacm_qry, cacm_rel)
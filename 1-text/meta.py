@@ -4,6 +4,7 @@
 @author: Sébastien P
 """
 from modeles import IRmodel
+import cache
 import graphes
 import random
 import numpy as np
@@ -99,7 +100,7 @@ class MetaModel(IRmodel):
         # Init param theta
         randQueries = np.random.choice(queries, size=max_iter)
         for randQry in randQueries:
-            relevantDocs = list(randQry.getRelevants().keys())
+            relevantDocs = [str(d) for d in randQry.getRelevants().keys()]
             irrelevantDocs = list(set(self.index.getDocsID()) - set(relevantDocs))
             # Get random documents 
             relDoc = random.choice(relevantDocs)
@@ -129,6 +130,7 @@ class MetaModel(IRmodel):
             xdq = self.featurer_list.getFeatures(docId, query)
             return self.theta.dot(xdq)
         
+    @cache.cached
     def getScores(self, query, normalized=False):
         allDocs = self.index.getDocsID()
         scores = {}
@@ -4,15 +4,31 @@
 @author: Loïc Herbelot
 """
 
+import heapq
 import numpy as np
 import operator
+import os
+from scipy.sparse import csr_matrix, diags
 import graphes
 import itertools
+import retrieval
+import cache
+import impacts
+
+# Number of queries multiplied at once by getScoresBatch()
+BATCH_SIZE = 256
+
+# Query processing strategies of IRmodel.getTopScores(): the document at a
+# time strategies of retrieval.py, and "saat", score at a time on the 
+# impact-ordered posting lists of impacts.py
+STRATEGIES = retrieval.STRATEGIES + ("saat",)
 
 class Weighter():
     def __init__(self, index):
         """param index: Index object"""
         self.index = index
+        # (index generation, matrix) of getNormalizedMatrix()
+        self.normalizedMatrix = None
 
     def getDocWeightsForDoc(self, docId):
         raise NotImplementedError("Abstract method.")
@@ -23,39 +39,137 @@ class Weighter():
     def getWeightsForQuery(self, query):
         raise NotImplementedError("Abstract method.")
         
+    def getDocsMatrix(self, docsList):
+        """ Return the weights of some documents as a sparse matrix.
+        The default weights are the frequencies of the stems, taken from
+        the forward index. 
+        :param docsList: list of docs ID
+        :return: scipy.sparse.csr_matrix, one line per doc of docsList and
+            one column per stem of the index"""
+        rows = [self.index.docNos[str(docId)] for docId in docsList]
+        return self.index.getDocTermMatrix()[rows]
+        
     def constructMatrix(self, docsList):
-        docsWeights = {} # {docId: {stem representation}}
-        docMap = {}# {docID: doc position in matrix (line)}
-        stemMap = {} # {stem: position in matrix (column)}
-        # We are going to store all the stems inside the docs
-        Nwords = 0
+        """ Return the dense matrix of the weights of some documents, 
+        restricted to the stems found in these documents.
+        :param docsList: list of docs ID
+        :return: numpy array, one line per doc of docsList"""
+        X = self.getDocsMatrix(docsList)
+        # Keep only the columns of the stems inside the docs
+        X = X[:, np.unique(X.indices)]
+        return X.toarray().astype(float)
+    
+    def getMatrixPath(self):
+        """ Return the path of the file of getNormalizedMatrix():
+        [directory]/[index name]_[weighter class]_weights.npz """
+        return os.path.join(self.index.outDir, "%s_%s_weights.npz" 
+                            % (self.index.name, type(self).__name__))
+    
+    def getNormalizedMatrix(self):
+        """ Return the weights of every doc of the index divided by their
+        L2 norm, so that the cosine of two docs is the product of their 
+        lines. The matrix is computed from getDocsMatrix() on the first 
+        call, and saved next to the index files. It is reloaded if the 
+        index files didn't change since.
+        Like the forward index, it ignores the added and the deleted 
+        documents until Index.compact() is called.
+        :return: scipy.sparse.csr_matrix, one line per doc number and one 
+            column per stem number of the index"""
+        if (self.normalizedMatrix is not None 
+                and self.normalizedMatrix[0] == self.index.generation):
+            return self.normalizedMatrix[1]
+        files = self.index._filesSignature()
+        shape = (len(self.index.docList), len(self.index.stemList))
+        path = self.getMatrixPath()
+        matrix = None
+        if os.path.exists(path):
+            with np.load(path, allow_pickle=False) as saved:
+                if (np.array_equal(saved["files"], files) 
+                        and tuple(saved["shape"]) == shape):
+                    matrix = csr_matrix((saved["data"], saved["indices"],
+                                         saved["indptr"]), shape=shape)
+        if matrix is None:
+            matrix = csr_matrix(self.getDocsMatrix(self.index.docList), 
+                                dtype=float)
+            norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1))
+                            .ravel())
+            # The empty docs keep their null weights
+            norms[norms == 0] = 1
+            matrix = csr_matrix(diags(1 / norms).dot(matrix))
+            np.savez(path, files=files, shape=shape, data=matrix.data, 
+                     indices=matrix.indices, indptr=matrix.indptr)
+        self.normalizedMatrix = (self.index.generation, matrix)
+        return matrix
+    
+    def getNormalizedRows(self, docsList, vocab=None):
+        """ Return the lines of getNormalizedMatrix() of some docs. If 
+        docs were added or deleted since the last Index.compact(), the 
+        lines are normalized on the fly from getDocWeightsForDoc().
+        :param docsList: list of docs ID
+        :param vocab: dict {stem: column}, a copy of Index.vocab. With 
+            updates, the stems that are not in it are given new columns.
+        :return: scipy.sparse.csr_matrix, one line per doc of docsList"""
+        if not self.index.hasUpdates():
+            rows = [self.index.docNos[str(docId)] for docId in docsList]
+            return self.getNormalizedMatrix()[rows]
+        if vocab is None:
+            vocab = dict(self.index.vocab)
+        data, indices, indptr = [], [], [0]
         for docId in docsList:
-            docWeight = self.getDocWeightsForDoc(docId)
-            docsWeights[docId] = docWeight
-#            print("docId:", docId)
-#            print("docWeight:", docWeight)
-            # Add the new word to the vocabulary
-#            vocabSet.update(set(docWeight.keys()))
-            for stem in docWeight:
-                if stem not in stemMap:
-                    stemMap[stem] = Nwords
-                    Nwords += 1
-            
-        # Create the matrix
-        Ndocs = len(docsList)
-        X = np.zeros((Ndocs, Nwords))
-        
-        # Populate the matrix
-        allDocId = list(docsWeights.keys())
-        for i, docId in enumerate(allDocId):
-            docRepr = docsWeights[docId]
-            docMap[i] = docId
-            for stem in docRepr:
-                j = stemMap[stem]
-                X[i, j] = docRepr[stem]
-#        print(allDocId, stemMap)
-#        print(X)
-        return X
+            weights = self.getDocWeightsForDoc(docId)
+            norm = IRmodel.dictNorm(weights) or 1
+            for stem, weight in weights.items():
+                indices.append(vocab.setdefault(stem, len(vocab)))
+                data.append(weight / norm)
+            indptr.append(len(indices))
+        return csr_matrix((data, indices, indptr), 
+                          shape=(len(docsList), len(vocab)))
+    
+    def getDocsSimilarities(self, docsList):
+        """ Return the cosine similarities between some docs, as the 
+        products of their normalized weights.
+        :param docsList: list of docs ID
+        :return: numpy array s, s[i,j] = cosine of docsList[i] and 
+            docsList[j]"""
+        rows = self.getNormalizedRows(docsList)
+        return rows.dot(rows.T).toarray()
+    
+    def getQuerySimilarities(self, query, docsList):
+        """ Return the cosine similarities between a query and some docs.
+        :param query: dict {stem: frequency}
+        :param docsList: list of docs ID
+        :return: numpy array of the cosines, in the order of docsList"""
+        queryWeights = self.getWeightsForQuery(query)
+        queryNorm = IRmodel.dictNorm(queryWeights)
+        if queryNorm == 0:
+            return np.zeros(len(docsList))
+        vocab = self.index.vocab
+        if self.index.hasUpdates():
+            vocab = dict(vocab)
+        rows = self.getNormalizedRows(docsList, vocab)
+        stems = [stem for stem in queryWeights if stem in vocab]
+        queryVector = csr_matrix(
+            ([queryWeights[stem] for stem in stems],
+             [vocab[stem] for stem in stems], [0, len(stems)]),
+            shape=(1, rows.shape[1]))
+        return rows.dot(queryVector.T).toarray().ravel() / queryNorm
+    
+    def getPostingsWeights(self, index, stem):
+        """ Return the weights of a stem in the docs that contain it, the
+        same as getDocWeightsForDoc(). The default weights are the 
+        frequencies, taken from the posting list.
+        :param index: the Index object, or one of its segments
+        :param stem: string
+        :return: (array of doc numbers of index, array of weights)"""
+        return index.getPostings(stem)
+    
+    def getDocsNorms(self, index):
+        """ Return the L2 norms of the weights of every doc, the same as
+        dictNorm(getDocWeightsForDoc()). By default, the norms of the
+        frequencies, precomputed by the index.
+        :param index: the Index object, or one of its segments
+        :return: array of norms, by doc number of index"""
+        return index.docNorms
 
 class BinaryWeighter(Weighter):
     def __init__(self, index):
@@ -95,8 +209,67 @@ class TfidfWeighter(Weighter):
 
 
 class IRmodel():
-    def __init__(self, index):
+    def __init__(self, index, strategy="exhaustive"):
+        """
+        :param index: Index object
+        :param strategy: string, how getTopScores() processes the queries,
+            one of STRATEGIES. The pruning strategies are only used by the
+            models that implement getScorer(), "saat" by the models that
+            implement getImpactName()."""
         self.index = index
+        self.setStrategy(strategy)
+        # Number of postings of the query stems, and of the postings that
+        # were used to score a doc, by the last call to getTopScores()
+        self.postingsNbr = 0
+        self.scoredNbr = 0
+        # Results of getScores() and getRanking(), see setCache()
+        self.cache = None
+        # (index generation, name, ImpactIndex) of getImpactIndex()
+        self.impactIndex = None
+    
+    # The attributes that don't change the scores, see getCacheKey()
+    stateAttributes = ("index", "cache", "postingsNbr", "scoredNbr", 
+                       "impactIndex")
+        
+    def setCache(self, resultCache):
+        """ Keep the results of getScores() (also when they are computed by
+        getScoresBatch()) and getRanking() in a cache. It may be shared by
+        several models, of several indexes.
+        :param resultCache: a cache.ResultCache object, None to disable
+            the cache"""
+        self.cache = resultCache
+        
+    def getCacheKey(self):
+        """ Return the parameters of the model, to key its results in the
+        cache: its class, its index, its numbers, strings and arrays, the 
+        keys of the models it uses and the classes of its other attributes.
+        :return: hashable tuple"""
+        params = []
+        for name, value in sorted(vars(self).items()):
+            if name in self.stateAttributes:
+                continue
+            if value is None or isinstance(value, (bool, int, float, str)):
+                params.append((name, value))
+            elif isinstance(value, IRmodel):
+                params.append((name, value.getCacheKey()))
+            elif isinstance(value, np.ndarray):
+                params.append((name, value.tobytes()))
+            else:
+                params.append((name, type(value).__name__))
+        return (type(self).__name__, cache.indexKey(self.index), 
+                tuple(params))
+        
+    def setStrategy(self, strategy, budget=None):
+        """ Choose the query processing strategy of getTopScores()
+        :param strategy: "exhaustive", "wand", "bmw" (Block-Max WAND) or
+            "saat" (score at a time)
+        :param budget: int, the number of postings the "saat" strategy 
+            may read for a query, None for all"""
+        if strategy not in STRATEGIES:
+            raise ValueError("Unknown strategy %s, expected one of %s"
+                             % (strategy, STRATEGIES))
+        self.strategy = strategy
+        self.budget = budget
 
     def score(self, query, docId):
         """Compute score between one query and one doc"""
@@ -109,12 +282,170 @@ class IRmodel():
         raise NotImplementedError("Abstract method.")
 
         
-    def getRanking(self, query):
+    @cache.cached
+    def getRanking(self, query, k=None):
         """ Compute the of documents for the query
         :param query: dict of term frequencies
+        :param k: int, only return the k best documents (None for all)
         :return: A list of tuples (doc id, score) sorted by score """
+        return IRmodel.rankScores(self.getScores(query), k)
+    
+    def rankScores(scores, k=None):
+        """ Sort the scores of getScores()
+        :param scores: dict {docID: score}
+        :param k: int, only return the k best documents (None for all)
+        :return: A list of tuples (doc id, score) sorted by score """
+        if k is None:
+            return sorted(scores.items(), key=operator.itemgetter(1), 
+                          reverse=True)
+        # Bounded heap, same order as the sort on equal scores
+        return heapq.nlargest(k, scores.items(), key=operator.itemgetter(1))
+    
+    def getCandidatesScores(self, query, candidates):
+        """ Score only some docs, for instance the docs found by a Boolean
+        query (see boolean.BooleanEngine). By default the scores of 
+        getScores() are filtered, the models whose score() only reads the
+        stems of a doc score the candidates one by one, without reading 
+        any posting list.
+        :param query: dict {stem: frequency}
+        :param candidates: iterable of doc ids
+        :return: a dict {docID: score}, for the candidates"""
         scores = self.getScores(query)
-        return sorted(scores.items(), key=operator.itemgetter(1), reverse=True)
+        return {docId: scores[docId] for docId in candidates 
+                if docId in scores}
+    
+    def getCandidatesRanking(self, query, candidates, k=None):
+        """ Rank only some docs, see getCandidatesScores()
+        :param k: int, only return the k best documents (None for all)
+        :return: A list of tuples (doc id, score) sorted by score """
+        return IRmodel.rankScores(self.getCandidatesScores(query, candidates),
+                                  k)
+    
+    @cache.cachedBatch
+    def getScoresBatch(self, queries):
+        """ Score several queries. By default getScores() is called for 
+        each query, the models whose scores are sums over the query stems
+        multiply all the queries with the doc weights, see 
+        getProductsBatch().
+        :param queries: list of dicts {stem: frequency}
+        :return: list of dicts {docID: score}, the same as getScores() for
+            each query"""
+        return [self.getScores(query) for query in queries]
+    
+    def getRankingBatch(self, queries, k=None):
+        """ Rank the documents for several queries, see getScoresBatch()
+        :param queries: list of dicts {stem: frequency}
+        :param k: int, only return the k best documents (None for all)
+        :return: list of lists of tuples (doc id, score) sorted by score, 
+            one per query"""
+        return [IRmodel.rankScores(scores, k) 
+                for scores in self.getScoresBatch(queries)]
+    
+    def getQueriesMatrix(self, queriesWeights):
+        """ Return the weights of some queries as a sparse matrix. The 
+        stems that aren't in the index, and the null weights, are left out.
+        :param queriesWeights: list of dicts {stem: weight}
+        :return: scipy.sparse.csr_matrix, one line per query, one column 
+            per stem number of the index"""
+        vocab = self.index.vocab
+        data, indices, indptr = [], [], [0]
+        for weights in queriesWeights:
+            for stem, weight in weights.items():
+                if weight != 0 and stem in vocab:
+                    indices.append(vocab[stem])
+                    data.append(weight)
+            indptr.append(len(indices))
+        return csr_matrix((data, indices, indptr), dtype=float,
+                          shape=(len(queriesWeights), 
+                                 len(self.index.stemList)))
+    
+    def getProductsBatch(self, queriesWeights, docsMatrix, 
+                         blockSize=BATCH_SIZE):
+        """ Multiply the weights of some queries with the weights of the 
+        docs, blockSize queries at a time: the posting list of a stem is
+        read once for all the queries of a block. The index must have no 
+        added or deleted docs.
+        :param queriesWeights: list of dicts {stem: weight}
+        :param docsMatrix: sparse matrix of the weights of the stems in the
+            docs, one line per doc number and one column per stem number
+        :return: a generator of (array of doc numbers, array of products),
+            one per query, for the docs that contain a stem of the query,
+            by doc number"""
+        stemsDocs = csr_matrix(docsMatrix.T)
+        for start in range(0, len(queriesWeights), blockSize):
+            products = self.getQueriesMatrix(
+                queriesWeights[start:start+blockSize]).dot(stemsDocs)
+            products.sort_indices()
+            for i in range(products.shape[0]):
+                begin, end = products.indptr[i], products.indptr[i+1]
+                yield products.indices[begin:end], products.data[begin:end]
+    
+    def getScorer(self, query):
+        """ Return the retrieval.Scorer of a query, for the document at a 
+        time strategies of getTopScores(), None if the model doesn't 
+        support them."""
+        return None
+    
+    def getTopScores(self, query, k):
+        """ Return the k best docs for a query, with the strategy 
+        self.strategy. The "wand" and "bmw" strategies skip the docs that
+        can't enter the top k, they give the same docs as the first k of
+        getRanking() (among the docs that contain a stem of the query), 
+        without normalizing the scores. The "saat" strategy sums the 
+        quantized impacts of the model (see getImpactIndex()), highest
+        impacts first, and stops after self.budget postings: its scores 
+        and docs are approximate.
+        :param query: dict {stem: frequency}
+        :param k: int, the number of docs
+        :return: A list of tuples (doc id, score) sorted by score"""
+        if self.strategy == "saat":
+            impactIndex = self.getImpactIndex()
+            if impactIndex is None:
+                return self.getRanking(query, k)
+            results, self.postingsNbr, self.scoredNbr = impactIndex.topK(
+                self.getImpactStems(query), k, self.budget)
+            return results
+        scorer = self.getScorer(query)
+        if scorer is None:
+            return self.getRanking(query, k)
+        results, self.postingsNbr, self.scoredNbr = retrieval.topK(
+            self.index, scorer, k, self.strategy)
+        return results
+
+    def getImpactName(self):
+        """ Return the name of the impacts of the model and of its 
+        parameters, None if the model has no impacts: its scores must be
+        sums over the stems of the query of a weight of the stem in the doc
+        (see getWeightsMatrix()). """
+        return None
+        
+    def getWeightsMatrix(self):
+        """ Return the weight of every stem in every doc, see 
+        getImpactName()
+        :return: scipy.sparse.csr_matrix, one line per doc number and one 
+            column per stem number of the index"""
+        raise NotImplementedError("Abstract method.")
+        
+    def getImpactStems(self, query):
+        """ Return the stems of a query whose impacts are summed """
+        return list(query)
+        
+    def getImpactIndex(self, bits=8):
+        """ Return the impact-ordered posting lists of the model, computed
+        on the first call and saved next to the index files (see 
+        impacts.ImpactIndex).
+        :return: an ImpactIndex object, None if the model has no impacts, 
+            or if documents were added or deleted since the indexation"""
+        name = self.getImpactName()
+        if name is None or self.index.hasUpdates():
+            return None
+        if (self.impactIndex is None 
+                or self.impactIndex[:2] != (self.index.generation, name)):
+            self.impactIndex = (self.index.generation, name, 
+                                impacts.ImpactIndex(self.index, name, 
+                                                    self.getWeightsMatrix,
+                                                    bits))
+        return self.impactIndex[2]
 
     def dictProduct(a,b):
         s = sum([a[i]*b[i] for i in a.keys() if i in b.keys()])
@@ -123,40 +454,138 @@ class IRmodel():
     def dictNorm(a):
         return np.linalg.norm(list(a.values()))
 
+class VectorielScorer(retrieval.Scorer):
+    """ Scores of Vectoriel for retrieval.topK(). The bounds assume the
+    default weights of the docs, see Weighter.getPostingsWeights(). """
+    def __init__(self, weighter, query, normalized):
+        self.queryWeights = weighter.getWeightsForQuery(query)
+        self.queryNorm = IRmodel.dictNorm(self.queryWeights)
+        self.normalized = normalized
+        self.weighter = weighter
+        
+    def getStems(self):
+        return [stem for (stem, weight) in self.queryWeights.items() 
+                if weight != 0]
+        
+    def getBlockBounds(self, segment, stem):
+        blocks = segment.getBlocks(stem)
+        if self.normalized:
+            return (self.queryWeights[stem] * blocks["maxNormTf"] 
+                    / self.queryNorm)
+        return self.queryWeights[stem] * blocks["maxTf"]
+    
+    def score(self, segment, docNo, cursors):
+        product = 0.
+        for cursor in cursors:
+            product += self.queryWeights[cursor.stem] * cursor.tf()
+        if self.normalized:
+            product /= (self.queryNorm 
+                        * self.weighter.getDocsNorms(segment)[docNo])
+        return product
+
+
 class Vectoriel(IRmodel):
-    def __init__(self, index, weighter):
-        super().__init__(index)
+    def __init__(self, index, weighter, strategy="wand", normalized=True):
+        super().__init__(index, strategy)
         self.weighter = weighter
+        # Normalization of the scores of getTopScores()
+        self.normalized = normalized
 
     def getWeighter(self):
         return self.weighter
     
     def score(self, query, docId, normalized=True):
+        if normalized:
+            return self.weighter.getQuerySimilarities(query, [docId])[0]
         queryWeights = self.weighter.getWeightsForQuery(query)
         docWeights = self.weighter.getDocWeightsForDoc(docId)
-        norm = 1
-        if normalized:
-            norm = IRmodel.dictNorm(queryWeights) * IRmodel.dictNorm(docWeights)
-        product = IRmodel.dictProduct(docWeights, queryWeights)
-        return product / norm
+        return IRmodel.dictProduct(docWeights, queryWeights)
 
+    @cache.cached
     def getScores(self, query, normalized=True):
-        """
+        """ Score the docs term at a time: only the posting lists of the
+        query stems are read, and the products are accumulated by doc.
         :param query: dict {stem: frequency}
-        :return: a dict {docID: score}"""
-        docsID = self.index.getDocsID()
+        :return: a dict {docID: score}, for the docs that contain at least
+            one stem of the query"""
         scores = {}
         queryWeights = self.weighter.getWeightsForQuery(query)
-        for i in docsID:
-            docWeights = self.weighter.getDocWeightsForDoc(i)
-            norm = 1
+        queryNorm = IRmodel.dictNorm(queryWeights)
+        for segment in self.index.getSegments():
+            products = np.zeros(len(segment.docList))
+            found = np.zeros(len(segment.docList), dtype=bool)
+            for stem, queryWeight in queryWeights.items():
+                if queryWeight == 0:
+                    continue
+                docNos, weights = self.weighter.getPostingsWeights(segment, 
+                                                                   stem)
+                products[docNos] += queryWeight * weights
+                found[docNos] = True
+            found &= ~segment.tombstones
+            docNos = np.flatnonzero(found)
+            products = products[docNos]
             if normalized:
-                norm = IRmodel.dictNorm(queryWeights) * IRmodel.dictNorm(docWeights)
-            product = IRmodel.dictProduct(docWeights, queryWeights)
-
-            scores[i] = product/norm
-
+                products /= (queryNorm 
+                             * self.weighter.getDocsNorms(segment)[docNos])
+            scores.update(zip([segment.docList[d] for d in docNos.tolist()],
+                              products.tolist()))
         return scores
+    
+    def getCandidatesScores(self, query, candidates, normalized=True):
+        """ The candidates are scored by the products of their lines of the
+        weights with the query, see Weighter.getQuerySimilarities()"""
+        candidates = list(candidates)
+        if normalized:
+            scores = self.weighter.getQuerySimilarities(query, candidates)
+            return dict(zip(candidates, scores.tolist()))
+        return {docId: self.score(query, docId, normalized) 
+                for docId in candidates}
+    
+    @cache.cachedBatch
+    def getScoresBatch(self, queries, normalized=True):
+        """ Score several queries at once, as products with the (normalized)
+        weights of the docs, see Weighter.getNormalizedMatrix().
+        :param queries: list of dicts {stem: frequency}
+        :return: list of dicts {docID: score}, see getScores()"""
+        if self.index.hasUpdates():
+            return [self.getScores(query, normalized) for query in queries]
+        queriesWeights = [self.weighter.getWeightsForQuery(query) 
+                          for query in queries]
+        if normalized:
+            docsMatrix = self.weighter.getNormalizedMatrix()
+        else:
+            docsMatrix = self.weighter.getDocsMatrix(self.index.docList)
+        docList = self.index.docList
+        scoresList = []
+        for queryWeights, (docNos, products) in zip(queriesWeights, 
+                self.getProductsBatch(queriesWeights, docsMatrix)):
+            if normalized:
+                products = products / IRmodel.dictNorm(queryWeights)
+            scoresList.append(dict(zip([docList[d] for d in docNos.tolist()],
+                                       products.tolist())))
+        return scoresList
+    
+    def getScorer(self, query):
+        return VectorielScorer(self.weighter, query, self.normalized)
+    
+    def getImpactName(self):
+        return type(self.weighter).__name__
+        
+    def getWeightsMatrix(self):
+        """ The normalized weights of the docs, times the weight of each 
+        stem in a query (the weights of the query stems don't depend on 
+        the other stems). The scores are not divided by the norm of the
+        query."""
+        stemWeights = self.weighter.getWeightsForQuery(
+            dict.fromkeys(self.index.stemList, 1))
+        return csr_matrix(self.weighter.getNormalizedMatrix().dot(
+            diags(np.array([stemWeights[stem] for stem 
+                            in self.index.stemList], dtype=float))))
+        
+    def getImpactStems(self, query):
+        return [stem for (stem, weight) 
+                in self.weighter.getWeightsForQuery(query).items() 
+                if weight != 0]
 
 
 class PRClustering(IRmodel):
@@ -189,9 +618,10 @@ class PRClustering(IRmodel):
     def setDocRank(self, docRank):
         self.docRank = docRank
     
+    @cache.cached
     def getRanking(self, query, Nclusters=None, maxClusters=20, verbose=False):
         # Get ranking from base model, sorted list of (docsID, score)
-        baseRanking = self.baseModel.getRanking(query)[:self.nDocs]
+        baseRanking = self.baseModel.getRanking(query, self.nDocs)
         
         docsScores = {docId:score for (docId, score) in baseRanking}
         docsList = [docId for (docId, score) in baseRanking]
@@ -255,17 +685,17 @@ class GreedyAlgorithm(IRmodel):
         self.nDocs = nDocs
 
     def score(self, doc1, doc2, normalized=True):
+        if normalized:
+            return self.baseModel.weighter.getDocsSimilarities(
+                [doc1, doc2])[0, 1]
         doc1Weights = self.baseModel.weighter.getDocWeightsForDoc(doc1)
         doc2Weights = self.baseModel.weighter.getDocWeightsForDoc(doc2)
-        norm = 1
-        if normalized:
-            norm = IRmodel.dictNorm(doc1Weights) * IRmodel.dictNorm(doc2Weights)
-        product = IRmodel.dictProduct(doc1Weights, doc2Weights)
-        return product / norm
+        return IRmodel.dictProduct(doc1Weights, doc2Weights)
 
+    @cache.cached
     def getRanking(self, query, verbose=False):
         # Get ranking from base model, sorted list of (docsID, score)
-        baseRanking = self.baseModel.getRanking(query)[:self.nDocs]
+        baseRanking = self.baseModel.getRanking(query, self.nDocs)
 
         # dictionnary of Similiarity 1 (sim between query and documents)
         docsScores = {docId: score for (docId, score) in baseRanking}
@@ -274,12 +704,18 @@ class GreedyAlgorithm(IRmodel):
         # Ordered documents
         result = []
         #print("Doc score", docsScores)
+        # Cosine between the documents, computed once
+        similarities = self.baseModel.weighter.getDocsSimilarities(docsList)
+        docsPos = {docId: i for (i, docId) in enumerate(docsList)}
+        # Highest similarity of each document with the returned ones
+        maxSims = np.full(len(docsList), -float("inf"))
 
         for i in range(len(docsList)):
             #print("Document number", i+1)
             if i == 0:
                 du = max(docsScores, key=docsScores.get)
                 result.append(du)
+                maxSims = np.maximum(maxSims, similarities[:, docsPos[du]])
                 # Remove document from the scores dictionnary
                 del docsScores[du]
                 # Remove document from the list of documents
@@ -289,12 +725,7 @@ class GreedyAlgorithm(IRmodel):
                 du_selected = None
                 for du in docsScores.keys():
                     #print("Document in the disctionnary score", du)
-                    max_sim2 = -float("inf")
-                    for doc_returned in result:
-                        score = self.score(du, doc_returned)
-                        #print("Document already returned", doc_returned, "With score", score)
-                        if score > max_sim2:
-                            max_sim2 = score
+                    max_sim2 = maxSims[docsPos[du]]
                     value_score = self.alpha * docsScores[du] + (self.alpha - 1) * max_sim2
                     #print("Value", value_score )
                     if value_score > max_value:
@@ -302,6 +733,8 @@ class GreedyAlgorithm(IRmodel):
                         du_selected = du
                 #print("Document selected", du_selected)
                 result.append(du_selected)
+                maxSims = np.maximum(maxSims, 
+                                     similarities[:, docsPos[du_selected]])
                 # Remove document from the scores dictionnary
                 del docsScores[du_selected]
                 # Remove document from the list of documents
@@ -311,79 +744,183 @@ class GreedyAlgorithm(IRmodel):
         return result
 
 class UnigramLanguage(IRmodel):
-    def __init__(self, index, regularization=0.9):
+    def __init__(self, index, regularization=0.9, smoothing="jelinek-mercer",
+                 mu=2000):
         """ Create a new unigram model.
+        The model of each doc is smoothed by the collection model 
+        (Index.getCollectionProb()), to avoid having a null probability 
+        because of a word that isn't in the doc.
         :param index: The Index object that parsed all files
-        :param txt_repr: a TextRepresenter object
-        :param regularization: The regularization parameter to avoid having 
-        a null probability because of an unkown word.
-        :param args: Dictionary of {string:param}
+        :param regularization: float in [0, 1[, the weight of the doc 
+            model in the Jelinek-Mercer smoothing
+        :param smoothing: "jelinek-mercer" or "dirichlet"
+        :param mu: float, the prior of the Dirichlet smoothing (a number of 
+            words)
         """
         super().__init__(index)
+        if smoothing not in ("jelinek-mercer", "dirichlet"):
+            raise ValueError("Unknown smoothing %s, expected "
+                             "'jelinek-mercer' or 'dirichlet'" % smoothing)
+        if smoothing == "jelinek-mercer" and not 0 <= regularization < 1:
+            raise ValueError("The regularization must be in [0, 1[")
         self.reg = regularization
-        self.model_corpus = None
-        # TODO: cache document models with a queue
-       # self.models = {}
+        self.smoothing = smoothing
+        self.mu = mu
     
     def get_model_corpus(self):
-        """ Return the unigram model for the entire collection, and create
-        it if the model is not already computed.
+        """ Return the unigram model for the entire collection, computed 
+        by the index.
+        :return: dict {stem: probability}
         """ 
-        if self.model_corpus is None:
-            self.model_corpus = {}
-            collec_length = 0
-            for stem in self.index.getStems():
-                term_freq_dic = self.index.getTfsForStem(stem)
-                freq = sum(term_freq_dic.values())
-                collec_length += freq
-                self.model_corpus[stem] = freq
-                
-            for stem in self.model_corpus:
-                self.model_corpus[stem] /= collec_length
-            
-        return self.model_corpus
+        stats = self.index.getStats()
+        return dict(zip(stats["vocab"], stats["prob"].tolist()))
+    
+    def getQueryModel(self, query):
+        """ Split the log-likelihood of a query in a doc into:
+        - a background constant, that only depends on the query: the 
+          log-likelihood of the query in a doc without any of its stems,
+          without the length of the doc for the Dirichlet smoothing,
+        - a correction for each stem of the query found in the doc, see
+          termCorrection(),
+        - for the Dirichlet smoothing, a penalty on the doc length, see
+          lengthPenalty().
+        The stems that aren't in the collection are ignored.
+        :param query: dict {stem: frequency}
+        :return: (float background, 
+                  dict {stem: (frequency in the query, collection prob)},
+                  int number of words of the query in the collection)"""
+        stems = {}
+        for stem, qFreq in query.items():
+            prob = self.index.getCollectionProb(stem)
+            if prob > 0:
+                stems[stem] = (qFreq, prob)
+        if self.smoothing == "jelinek-mercer":
+            background = sum(qFreq * np.log((1-self.reg) * prob) 
+                             for (qFreq, prob) in stems.values())
+        else:
+            background = sum(qFreq * np.log(self.mu * prob) 
+                             for (qFreq, prob) in stems.values())
+        return background, stems, sum(q for (q, p) in stems.values())
+    
+    def termCorrection(self, qFreq, prob, tfs, docLens):
+        """ Return the correction of the background score of a query for 
+        a stem found in some docs (see getQueryModel()).
+        :param tfs: array of the frequencies of the stem in the docs
+        :param docLens: array of the lengths of the docs
+        :return: array of floats"""
+        if self.smoothing == "jelinek-mercer":
+            return qFreq * np.log1p(self.reg * tfs 
+                                    / ((1-self.reg) * prob * docLens))
+        return qFreq * np.log1p(tfs / (self.mu * prob))
+    
+    def lengthPenalty(self, queryLen, docLens):
+        """ Return the part of the score that depends on the length of the
+        docs: 0 for the Jelinek-Mercer smoothing, 
+        -queryLen * log(docLen + mu) for the Dirichlet smoothing."""
+        if self.smoothing == "jelinek-mercer":
+            return 0.
+        return -queryLen * np.log(docLens + self.mu)
     
     def score(self, query, doc_id):
         """ Compute the likelihood of a query inside a document. 
-        :param query: The Query object
+        :param query: dict {stem: frequency}
         :param doc: int or string, the ID of the document 
-        :return: float, the likelihood a the query inside the document.
-        May be -inf if a word of the query isn't found in the entire collection.
+        :return: float, the log-likelihood a the query inside the document.
         """
-        doc_model = self.index.getTfsForDoc(doc_id)
-        self.get_model_corpus()
-        doc_len = sum(doc_model.values())
-        doc_model = {s:tf/doc_len for s,tf in doc_model.items()}
-        score = 0
-        for word, q_freq in query.items():
-            if word not in self.model_corpus:
-                continue
-            in_log = (1-self.reg) * self.model_corpus[word]
-            if word in doc_model:
-                in_log += self.reg * doc_model[word]
-#            print("in log:", in_log)
-            if in_log == 0:
-                print("Warning in_log = 0, docid=%s, word=%s" % (doc_id, word))
-            score += q_freq * np.log(in_log)
-#            else:
-#                score = -np.infty
-#                break
-        return score
+        background, stems, queryLen = self.getQueryModel(query)
+        docTfs = self.index.getTfsForDoc(doc_id)
+        docLen = self.index.getDocsLen(doc_id)
+        score = background + self.lengthPenalty(queryLen, docLen)
+        for stem, (qFreq, prob) in stems.items():
+            if stem in docTfs:
+                score += self.termCorrection(qFreq, prob, docTfs[stem], 
+                                             docLen)
+        return float(score)
     
+    @cache.cached
     def getScores(self, query, normalized=False):
+        """ Score the docs from the posting lists of the query stems: the
+        background score of the query is corrected in the docs that 
+        contain its stems.
+        :param query: dict {stem: frequency}
+        :param normalized: bool, divide the scores by their L2 norm
+        :return: a dict {docID: log-likelihood}. With the Jelinek-Mercer
+            smoothing, only the docs that contain at least one stem of the
+            query: the other docs would all have the background score. 
+            With the Dirichlet smoothing, every doc: the length penalty 
+            of the docs without a stem of the query differs, some of them
+            may beat docs with a stem."""
+        background, stems, queryLen = self.getQueryModel(query)
         scores = {}
-        norm = 0
-        for doc in self.index.getDocsID():
-            s = self.score(query, doc)   
-            scores[doc] = s
-            norm += s**2
-        scores = {k:v/np.sqrt(norm) for k,v in scores.items()}
-        
+        for segment in self.index.getSegments():
+            corrections = np.zeros(len(segment.docList))
+            found = np.full(len(segment.docList), 
+                            self.smoothing == "dirichlet")
+            for stem, (qFreq, prob) in stems.items():
+                docNos, tfs = segment.getPostings(stem)
+                corrections[docNos] += self.termCorrection(
+                    qFreq, prob, tfs, segment.docLens[docNos])
+                found[docNos] = True
+            found &= ~segment.tombstones
+            docNos = np.flatnonzero(found)
+            docScores = (background + corrections[docNos] 
+                         + self.lengthPenalty(queryLen, 
+                                              segment.docLens[docNos]))
+            scores.update(zip([segment.docList[d] for d in docNos.tolist()],
+                              docScores.tolist()))
+        if normalized and scores:
+            norm = np.sqrt(sum(s**2 for s in scores.values()))
+            scores = {k:v/norm for k,v in scores.items()}
         return scores
+    
+    def getCandidatesScores(self, query, candidates):
+        """ The candidates are scored one by one by score(), from their 
+        stems, the docs without a stem of the query included"""
+        return {docId: self.score(query, docId) for docId in candidates}
+    
+    @cache.cachedBatch
+    def getScoresBatch(self, queries, normalized=False):
+        """ Score several queries at once: the corrections of every stem in
+        every doc (see termCorrection()) are multiplied with the 
+        frequencies of the stems in the queries.
+        :param queries: list of dicts {stem: frequency}
+        :return: list of dicts {docID: log-likelihood}, see getScores()"""
+        if self.index.hasUpdates():
+            return [self.getScores(query, normalized) for query in queries]
+        allDocs = np.arange(len(self.index.docList))
+        index = self.index
+        docTerms = index.getDocTermMatrix()
+        docNos = np.repeat(np.arange(len(index.docList)), 
+                           np.diff(docTerms.indptr))
+        corrections = csr_matrix(
+            (self.termCorrection(1, index.stemProb[docTerms.indices], 
+                                 docTerms.data, index.docLens[docNos]),
+             docTerms.indices, docTerms.indptr), shape=docTerms.shape)
+        queryModels = [self.getQueryModel(query) for query in queries]
+        queriesWeights = [{stem: qFreq for (stem, (qFreq, prob)) 
+                           in stems.items()} 
+                          for (background, stems, queryLen) in queryModels]
+        scoresList = []
+        for (background, stems, queryLen), (docNos, products) in zip(
+                queryModels, 
+                self.getProductsBatch(queriesWeights, corrections)):
+            if self.smoothing == "dirichlet":
+                # Every doc, see getScores()
+                allProducts = np.zeros(len(allDocs))
+                allProducts[docNos] = products
+                docNos, products = allDocs, allProducts
+            docScores = (background + products 
+                         + self.lengthPenalty(queryLen, index.docLens[docNos]))
+            if normalized and len(docScores):
+                docScores = docScores / np.sqrt((docScores**2).sum())
+            scoresList.append(dict(zip([index.docList[d] 
+                                        for d in docNos.tolist()],
+                                       docScores.tolist())))
+        return scoresList
         
 class Okapi(IRmodel):
-    def __init__(self, index, k=1, b=1):
-        super().__init__(index)
+    def __init__(self, index, k=1, b=1, strategy="wand"):
+        super().__init__(index, strategy)
         self.k = k
         self.b = b
 
@@ -404,9 +941,8 @@ class Okapi(IRmodel):
                 tf = docStems[word]
             else:
                 tf = 0
-            numer = (self.k+1) * tf
-            denom = self.k * ((1-self.b) + self.b*docLen/meanDocLen) + tf
-            w = self.index.probIdf(word) * numer / denom
+            w = self.termWeight(self.index.probIdf(word), tf, docLen, 
+                                meanDocLen)
             if verbose:
                 print("weight for "+word+":", w)
             s += w
@@ -415,9 +951,19 @@ class Okapi(IRmodel):
 #            else:
 #                print("word=%s, tf=%d, numer=%.3f, den=%.3f" % (word, tf, numer, denom))
         return s
-        
     
+    def termWeight(self, idf, tf, docLen, meanDocLen):
+        """ Return the BM25 weight of a stem in a doc """
+        numer = (self.k+1) * tf
+        denom = self.k * ((1-self.b) + self.b*docLen/meanDocLen) + tf
+        return idf * numer / denom
+    
+    @cache.cached
     def getScores(self, query, normalized=False):
+        if not self.index.hasUpdates():
+            scores = self.getScoresArray(query)[0]
+            scores = scores / np.sqrt((scores**2).sum())
+            return dict(zip(self.index.docList, scores.tolist()))
         scores = {}
         norm = 0
         for doc in self.index.getDocsID():
@@ -427,6 +973,106 @@ class Okapi(IRmodel):
         scores = {k:v/np.sqrt(norm) for k,v in scores.items()}
         return scores
     
+    def getCandidatesScores(self, query, candidates):
+        """ The candidates are scored one by one by score(), from their 
+        stems: the scores are not normalized"""
+        return {docId: self.score(query, docId) for docId in candidates}
+    
+    @cache.cachedBatch
+    def getScoresBatch(self, queries):
+        """ Score several queries at once, as products of the BM25 weights
+        of every stem in every doc with the stems of the queries.
+        :param queries: list of dicts {stem: frequency}
+        :return: list of dicts {docID: score}, see getScores()"""
+        if self.index.hasUpdates():
+            return [self.getScores(query) for query in queries]
+        index = self.index
+        # The frequencies of the query stems are not used
+        queriesWeights = [dict.fromkeys(query, 1) for query in queries]
+        scoresList = []
+        for docNos, products in self.getProductsBatch(
+                queriesWeights, self.getWeightsMatrix()):
+            scores = np.zeros(len(index.docList))
+            scores[docNos] = products
+            scores = scores / np.sqrt((scores**2).sum())
+            scoresList.append(dict(zip(index.docList, scores.tolist())))
+        return scoresList
+    
+    def getScoresArray(self, query, params=None, dtype=np.float64):
+        """ Compute the BM25 scores (not normalized) of every doc at once,
+        from the columns of the query stems in the doc-term matrix. The 
+        index must have no added or deleted docs.
+        :param query: dict {stem: frequency}
+        :param params: list of (k, b) to compute the scores with, by 
+            default [(self.k, self.b)]
+        :param dtype: np.float64 or np.float32, the type of the scores
+        :return: array (len(params), number of docs), by doc number"""
+        params = params or [(self.k, self.b)]
+        index = self.index
+        stemNos = [index.vocab[stem] for stem in query if stem in index.vocab]
+        columns = index.getStemsMatrix()[:, stemNos]
+        docNos = columns.indices
+        tfs = columns.data.astype(dtype)
+        # Probabilistic IDF of the stem of each posting
+        N = index.getStats()["docsCount"]
+        dfs = index.stemDf[stemNos]
+        idfs = np.maximum(0, np.log((N-dfs+0.5)/(dfs+0.5))).astype(dtype)
+        idfs = np.repeat(idfs, np.diff(columns.indptr))
+        meanDocLen = index.getMeanDocLen()
+        scores = np.zeros((len(params), len(index.docList)), dtype=dtype)
+        for i, (k, b) in enumerate(params):
+            # Length normalization of each doc
+            docNorms = (k * ((1-b) + b*index.docLens/meanDocLen)).astype(dtype)
+            weights = idfs * ((k+1) * tfs) / (docNorms[docNos] + tfs)
+            scores[i] = np.bincount(docNos, weights=weights, 
+                                    minlength=len(index.docList))
+        return scores
+    
+    def getScorer(self, query):
+        return OkapiScorer(self, query)
+    
+    def getImpactName(self):
+        return "okapi_k%g_b%g" % (self.k, self.b)
+    
+    def getWeightsMatrix(self):
+        """ The BM25 weights of every posting, the index must have no added
+        or deleted docs """
+        index = self.index
+        docTerms = index.getDocTermMatrix()
+        docNos = np.repeat(np.arange(len(index.docList)), 
+                           np.diff(docTerms.indptr))
+        N = index.getStats()["docsCount"]
+        dfs = index.stemDf[docTerms.indices]
+        idfs = np.maximum(0, np.log((N-dfs+0.5)/(dfs+0.5)))
+        return csr_matrix(
+            (self.termWeight(idfs, docTerms.data, index.docLens[docNos], 
+                             index.getMeanDocLen()),
+             docTerms.indices, docTerms.indptr), shape=docTerms.shape)
+    
+
+class OkapiScorer(retrieval.Scorer):
+    """ Scores of Okapi for retrieval.topK() """
+    def __init__(self, model, query):
+        self.model = model
+        self.stems = list(query)
+        self.meanDocLen = model.index.getMeanDocLen()
+        self.idfs = {stem: model.index.probIdf(stem) for stem in query}
+        
+    def getStems(self):
+        return self.stems
+    
+    def getBlockBounds(self, segment, stem):
+        # The weight grows with tf and decreases with the doc length 
+        # (b >= 0)
+        blocks = segment.getBlocks(stem)
+        return self.model.termWeight(self.idfs[stem], blocks["maxTf"],
+                                     blocks["minLen"], self.meanDocLen)
+    
+    def score(self, segment, docNo, cursors):
+        docLen = int(segment.docLens[docNo])
+        return sum(self.model.termWeight(self.idfs[c.stem], c.tf(), docLen,
+                                         self.meanDocLen) for c in cursors)
+    
 class PageRankModel(IRmodel):
     def __init__(self, index, baseModel, seedsNbr, parentsNbr):
         super().__init__(index)
@@ -435,17 +1081,18 @@ class PageRankModel(IRmodel):
         self.parentsNbr = parentsNbr
     
     def score(self, query, docId):
-        baseRanking = self.baseModel.getRanking(query)
-        seeds = [seed for (seed, score) in baseRanking[:self.seedsNbr]]
+        baseRanking = self.baseModel.getRanking(query, self.seedsNbr)
+        seeds = [seed for (seed, score) in baseRanking]
         if docId not in seeds:
             seeds.append(docId)
         pagerank = graphes.PageRank(self.index, seeds, self.parentsNbr)
         return pagerank.getScores(nIter=100, teleportProba=0.1)[docId]
 
     
+    @cache.cached
     def getScores(self, query, normalized=True):
-        baseRanking = self.baseModel.getRanking(query)
-        seeds = [seed for (seed, score) in baseRanking[:self.seedsNbr]]
+        baseRanking = self.baseModel.getRanking(query, self.seedsNbr)
+        seeds = [seed for (seed, score) in baseRanking]
         pagerank = graphes.PageRank(self.index, seeds, self.parentsNbr)
         return pagerank.getScores(nIter=100, teleportProba=0.1)
         
@@ -458,8 +1105,8 @@ class HitsModel(IRmodel):
     
     
     def score(self, query, docId):
-        baseRanking = self.baseModel.getRanking(query)
-        seeds = [seed for (seed, score) in baseRanking[:self.seedsNbr]]
+        baseRanking = self.baseModel.getRanking(query, self.seedsNbr)
+        seeds = [seed for (seed, score) in baseRanking]
         if docId not in seeds:
             seeds.append(docId)
         hits = graphes.HITS(self.index, seeds, self.parentsNbr)
@@ -467,12 +1114,127 @@ class HitsModel(IRmodel):
         return hits.getScores(nIter=10)[docId]
 
     
+    @cache.cached
     def getScores(self, query, normalized=True):
 #        print("retrieve base ranking")
-        baseRanking = self.baseModel.getRanking(query)
-        seeds = [seed for (seed, score) in baseRanking[:self.seedsNbr]]
+        baseRanking = self.baseModel.getRanking(query, self.seedsNbr)
+        seeds = [seed for (seed, score) in baseRanking]
 #        print("retrieved base ranking, call HITS")
         hits = graphes.HITS(self.index, seeds, self.parentsNbr)
 #        print("call getScores")
         return hits.getScores(nIter=10)
-        
\ No newline at end of file
+        
+
+class TieredModel(IRmodel):
+    """ Ranks the docs of a two-tier index (see tiers.TieredIndex) by the
+    score of a model on the full index, plus tierWeight times the score of
+    a model on the first tier: the words of the title and of the keywords
+    count more. Both models must implement getScorer(). """
+    def __init__(self, fullModel, tierModel, tierWeight=1., depth=None,
+                 strategy="wand"):
+        """
+        :param fullModel: the IRmodel of the full index, like Okapi
+        :param tierModel: the IRmodel of the first tier
+        :param tierWeight: float >= 0, the weight of the first tier
+        :param depth: int, the number of docs of the first tier rescored
+            on the full index by getTopScores(), None for 5k: a doc of
+            the first tier must beat the next ones by the upper bound of
+            the full index, so a few more docs than k are needed
+        :param strategy: "exhaustive", "wand" or "bmw", see retrieval.topK()
+        """
+        super().__init__(fullModel.index, strategy)
+        if fullModel.getScorer({}) is None or tierModel.getScorer({}) is None:
+            raise ValueError("The models of a TieredModel must implement "
+                             "getScorer()")
+        self.fullModel = fullModel
+        self.tierModel = tierModel
+        self.tierWeight = tierWeight
+        self.depth = depth
+        # True if the first tier answered the last call to getTopScores()
+        self.tierAnswered = False
+
+    stateAttributes = IRmodel.stateAttributes + ("tierAnswered",)
+
+    def setStrategy(self, strategy, budget=None):
+        """ Choose the strategy of the top-k retrieval in each tier, one of
+        retrieval.STRATEGIES """
+        if strategy not in retrieval.STRATEGIES:
+            raise ValueError("Unknown strategy %s, expected one of %s"
+                             % (strategy, retrieval.STRATEGIES))
+        super().setStrategy(strategy, budget)
+
+    def getTierScores(self, query, k=None):
+        """ Return the scores of the first tier, times tierWeight
+        :param k: int, only the k best docs (None for all)
+        :return: list of (doc id, score) sorted by score"""
+        tier = self.tierModel.index
+        if k is None:
+            k, strategy = tier.getStats()["docsCount"], "exhaustive"
+        else:
+            strategy = self.strategy
+        results, postingsNbr, scoredNbr = retrieval.topK(
+            tier, self.tierModel.getScorer(query), k, strategy)
+        self.postingsNbr += postingsNbr
+        self.scoredNbr += scoredNbr
+        return [(docId, self.tierWeight * score) 
+                for (docId, score) in results]
+
+    def score(self, query, docId):
+        tier = self.tierModel.index
+        return (retrieval.scoreDocs(self.index, 
+                                    self.fullModel.getScorer(query), 
+                                    [docId])[docId]
+                + self.tierWeight * retrieval.scoreDocs(
+                    tier, self.tierModel.getScorer(query), [docId])[docId])
+
+    @cache.cached
+    def getScores(self, query, normalized=False):
+        """ Score every doc that has a stem of the query in one of the 
+        tiers, the scores are not normalized
+        :return: a dict {docID: score}"""
+        self.postingsNbr, self.scoredNbr = 0, 0
+        results, postingsNbr, scoredNbr = retrieval.topK(
+            self.index, self.fullModel.getScorer(query), 
+            self.index.getStats()["docsCount"], "exhaustive",
+            dict(self.getTierScores(query)))
+        self.postingsNbr += postingsNbr
+        self.scoredNbr += scoredNbr
+        return dict(results)
+
+    def getTopScores(self, query, k):
+        """ Return the k best docs for a query, from the first tier when it
+        can guarantee them: its depth best docs are rescored on the full
+        index from their stems (see retrieval.scoreDocs()). A doc outside
+        of them can't score more than the next score of the first tier 
+        plus the upper bound of the query on the full index (see 
+        retrieval.upperBound()), so if the k-th best rescored doc beats 
+        this bound, they are the top k. Otherwise the posting lists of the
+        full index are traversed, the scores of the first tier being one
+        more list, see retrieval.topK().
+        Both ways give the same docs as the first k of getRanking().
+        :param query: dict {stem: frequency}
+        :param k: int, the number of docs
+        :return: A list of tuples (doc id, score) sorted by score"""
+        self.postingsNbr, self.scoredNbr = 0, 0
+        fullScorer = self.fullModel.getScorer(query)
+        depth = max(k, self.depth or 5 * k)
+        tierTop = self.getTierScores(query, depth + 1)
+        candidates = tierTop[:depth]
+        self.tierAnswered = False
+        if len(candidates) >= k:
+            fullScores = retrieval.scoreDocs(self.index, fullScorer, 
+                                             [d for (d, s) in candidates])
+            results = IRmodel.rankScores({d: s + fullScores[d] for (d, s) 
+                                          in candidates}, k)
+            nextScore = tierTop[depth][1] if len(tierTop) > depth else 0.
+            bound = nextScore + retrieval.upperBound(self.index, fullScorer)
+            if results[-1][1] > bound:
+                self.tierAnswered = True
+                return results
+        if len(tierTop) > depth:
+            tierTop = self.getTierScores(query)
+        results, postingsNbr, scoredNbr = retrieval.topK(
+            self.index, fullScorer, k, self.strategy, dict(tierTop))
+        self.postingsNbr += postingsNbr
+        self.scoredNbr += scoredNbr
+        return results
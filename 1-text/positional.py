@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+""" Phrase and proximity queries, on the positions of the stems written by
+Index.indexation(positions=True).
+The positions of the stems count every word of a doc, stop words
+included (see TextRepresenter.getStemPositions()): a phrase matches where
+each of its stems is found at the same distance from the first one as in
+the phrase. The positions of a stem are turned into keys
+(doc number, position - offset of the stem in the phrase), and the keys of
+all the stems of the phrase are intersected.
+"""
+
+import numpy as np
+
+# Bits of the position in the keys of matchPhrase()
+POSITION_BITS = 32
+
+
+class PositionalEngine():
+    """ Evaluates phrase and proximity queries on an index and its
+    segments """
+    def __init__(self, index, txtRepr=None):
+        """
+        :param index: the Index object, indexed with its positions
+        :param txtRepr: The TextRepresenter object that stems the queries,
+            by default the one used for the indexation
+        """
+        self.index = index
+        self.txtRepr = txtRepr or index.textRepresenter
+
+    def parsePhrase(self, text):
+        """ Return the stems of a phrase and their offsets from the first
+        stem, by offset
+        :param text: string, for instance "Chinese Remainder theorem"
+        :return: list of (stem, int offset)"""
+        terms = [(pos, stem) for (stem, positions)
+                 in self.txtRepr.getStemPositions(text).items()
+                 for pos in positions]
+        if not terms:
+            return []
+        first = min(terms)[0]
+        return [(stem, pos - first) for (pos, stem) in sorted(terms)]
+
+    def getPhraseDocs(self, text):
+        """ Return the docs that contain a phrase.
+        :param text: string, the phrase
+        :return: dict {docID: number of occurrences of the phrase}"""
+        terms = self.parsePhrase(text)
+        docs = {}
+        if not terms:
+            return docs
+        for segment in self.index.getSegments():
+            docNos, counts = matchPhrase(segment, terms)
+            live = ~segment.tombstones[docNos]
+            docList = segment.docList
+            docs.update((docList[d], c) for (d, c)
+                        in zip(docNos[live].tolist(), counts[live].tolist()))
+        return docs
+
+    def getProximityScores(self, query, window=5):
+        """ Score the docs by the proximity of the different stems of a
+        query: each pair of neighbour occurrences of two different stems,
+        at most window words away, adds 1/distance^2 to the score of the
+        doc (the term proximity of Rasolofo and Savoy 2003).
+        :param query: string, or dict {stem: frequency}
+        :param window: int, the largest distance between two stems
+        :return: dict {docID: score}, for the docs with a score"""
+        if isinstance(query, str):
+            query = self.txtRepr.getStemPositions(query)
+        scores = {}
+        for segment in self.index.getSegments():
+            docNos, segmentScores = proximityScores(segment, list(query),
+                                                    window)
+            live = ~segment.tombstones[docNos]
+            docList = segment.docList
+            scores.update(zip([docList[d] for d in docNos[live].tolist()],
+                              segmentScores[live].tolist()))
+        return scores
+
+
+def matchPhrase(segment, terms):
+    """ Find a phrase in one index (or segment), deleted docs included.
+    :param segment: the Index object
+    :param terms: list of (stem, offset), see PositionalEngine.parsePhrase()
+    :return: (sorted array of the doc numbers that contain the phrase,
+              array of the number of occurrences in each doc)"""
+    keys = None
+    # The rarest stems first, to keep few keys
+    for stem, offset in sorted(terms, key=lambda term:
+                               segment.getDf(term[0])):
+        docNos, tfs, positions = segment.getPositions(stem)
+        if keys is not None:
+            # Only the docs that still match
+            live = np.isin(docNos, keys >> POSITION_BITS)
+            positions = positions[np.repeat(live, tfs)]
+            docNos, tfs = docNos[live], tfs[live]
+        starts = positions - offset
+        stemKeys = (np.repeat(docNos, tfs) << POSITION_BITS) + starts
+        stemKeys = stemKeys[starts >= 0]
+        keys = (stemKeys if keys is None
+                else np.intersect1d(keys, stemKeys, assume_unique=True))
+        if len(keys) == 0:
+            break
+    docNos, counts = np.unique(keys >> POSITION_BITS, return_counts=True)
+    return docNos, counts
+
+
+def proximityScores(segment, stems, window):
+    """ Compute the proximity scores of the docs of one index (or
+    segment), deleted docs included, see
+    PositionalEngine.getProximityScores()
+    :param segment: the Index object
+    :param stems: list of the different stems of the query
+    :param window: int, the largest distance between two stems
+    :return: (sorted array of doc numbers, array of their scores)"""
+    docNos, positions, termNos = [], [], []
+    for termNo, stem in enumerate(stems):
+        stemDocs, tfs, stemPositions = segment.getPositions(stem)
+        docNos.append(np.repeat(stemDocs, tfs))
+        positions.append(stemPositions)
+        termNos.append(np.full(len(stemPositions), termNo))
+    docNos = np.concatenate(docNos + [np.zeros(0, dtype=np.int64)])
+    positions = np.concatenate(positions + [np.zeros(0, dtype=np.int64)])
+    termNos = np.concatenate(termNos + [np.zeros(0, dtype=np.int64)])
+    # The occurrences of the query stems, in the order of the docs
+    order = np.lexsort((positions, docNos))
+    docNos, positions, termNos = (docNos[order], positions[order],
+                                  termNos[order])
+    distances = np.diff(positions)
+    pairs = ((docNos[1:] == docNos[:-1]) & (termNos[1:] != termNos[:-1])
+             & (distances <= window))
+    pairDocs = docNos[1:][pairs]
+    weights = 1. / distances[pairs].astype(float)**2
+    docs, inverse = np.unique(pairDocs, return_inverse=True)
+    return docs, np.bincount(inverse, weights=weights, minlength=len(docs))
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+""" Binary posting lists.
+A posting list is stored as the variable-byte encoding of the gaps
+between the (sorted) doc numbers, followed by the variable-byte encoding
+of the frequencies. Each value is split in groups of 7 bits, lowest group
+first, and the high bit is set on the last byte of a value.
+The lists are cut in blocks of BLOCK_SIZE postings: the byte offsets of
+the gaps and of the frequencies of each block are kept (see 
+Index.computeBlocks()), and with the last doc of each block they are the
+skip pointers of the list, so a block can be decoded alone.
+The positions of the stems in the docs may be stored in another file,
+with the same layout: the positions of each posting, as gaps, in the 
+order of the posting list.
+Encoding and decoding are done in bulk with NumPy.
+"""
+
+import numpy as np
+
+# Number of postings in a block, see Index.computeBlocks()
+BLOCK_SIZE = 64
+
+
+def encodeVByte(values):
+    """ Variable-byte encode a list of non-negative integers.
+    :param values: array-like of non-negative integers
+    :return: (numpy uint8 array of the encoded bytes,
+              numpy array of the number of bytes of each value)
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    nBytes = vbyteLengths(values)
+    ends = np.cumsum(nBytes)
+    starts = ends - nBytes
+    out = np.empty(ends[-1] if len(ends) else 0, dtype=np.uint8)
+    for k in range(nBytes.max() if len(nBytes) else 0):
+        mask = nBytes > k
+        group = (values[mask] >> np.uint64(7*k)) & np.uint64(0x7f)
+        out[starts[mask] + k] = group
+    out[ends - 1] |= 0x80
+    return out, nBytes
+
+
+def vbyteLengths(values):
+    """ Return the number of bytes of the variable-byte encoding of each
+    value (the number of 7-bits groups it needs).
+    :param values: array-like of non-negative integers
+    :return: numpy int64 array
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    nBytes = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        nBytes += rest > 0
+        rest >>= np.uint64(7)
+    return nBytes
+
+
+def decodeVByte(buf):
+    """ Decode a buffer of variable-byte encoded integers.
+    :param buf: bytes, memoryview or numpy uint8 array
+    :return: numpy int64 array of the decoded values
+    """
+    b = np.frombuffer(buf, dtype=np.uint8)
+    if len(b) == 0:
+        return np.zeros(0, dtype=np.int64)
+    stop = (b & 0x80) != 0
+    ends = np.flatnonzero(stop)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    # Index of the value each byte belongs to:
+    valueIdx = np.cumsum(stop) - stop
+    shifts = 7 * (np.arange(len(b)) - starts[valueIdx])
+    payload = (b & 0x7f).astype(np.uint64) << shifts.astype(np.uint64)
+    return np.bitwise_or.reduceat(payload, starts).astype(np.int64)
+
+
+def encodePostings(docNos, tfs):
+    """ Encode one posting list.
+    :param docNos: sorted array of doc numbers
+    :param tfs: array of frequencies, same length as docNos
+    :return: bytes
+    """
+    gaps = np.diff(np.asarray(docNos, dtype=np.int64), prepend=0)
+    gapBytes, _ = encodeVByte(gaps)
+    tfBytes, _ = encodeVByte(tfs)
+    return gapBytes.tobytes() + tfBytes.tobytes()
+
+
+def decodePostings(buf, df):
+    """ Decode one posting list.
+    :param buf: the bytes written by encodePostings()
+    :param df: int, the number of postings in the list
+    :return: (array of doc numbers, array of frequencies)
+    """
+    values = decodeVByte(buf)
+    return np.cumsum(values[:df]), values[df:]
+
+
+def decodeBlock(gapBuf, tfBuf, base):
+    """ Decode one block of a posting list, see Index.getPostingsBlock().
+    :param gapBuf: the bytes of the gaps of the block
+    :param tfBuf: the bytes of the frequencies of the block
+    :param base: int, the last doc number of the previous block of the
+        list, 0 for the first block
+    :return: (array of doc numbers, array of frequencies)
+    """
+    return base + np.cumsum(decodeVByte(gapBuf)), decodeVByte(tfBuf)
+
+
+def gatherRuns(values, starts, lengths):
+    """ Concatenate runs of consecutive values of an array.
+    :param values: array
+    :param starts: array of the first position of each run
+    :param lengths: array of the length of each run
+    :return: array, values[starts[0]:starts[0]+lengths[0]] followed by the
+        other runs
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    shifts = np.asarray(starts, dtype=np.int64) - (np.cumsum(lengths) 
+                                                   - lengths)
+    return values[np.repeat(shifts, lengths) + np.arange(lengths.sum())]
+
+
+def encodePositions(positions, tfs):
+    """ Encode the positions of some postings: the gaps between the 
+    positions of a posting, the first one being its position.
+    :param positions: array of the positions of every posting, sorted 
+        inside each posting
+    :param tfs: array of the number of positions of each posting
+    :return: (numpy uint8 array of the encoded bytes,
+              numpy array of the number of bytes of each position)
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    starts = (np.cumsum(tfs) - tfs)[np.asarray(tfs) > 0]
+    gaps = np.diff(positions, prepend=0)
+    gaps[starts] = positions[starts]
+    return encodeVByte(gaps)
+
+
+def decodePositions(buf, tfs):
+    """ Decode the positions written by encodePositions().
+    :param buf: the encoded bytes
+    :param tfs: array of the number of positions of each posting, all > 0
+    :return: array of the positions of every posting
+    """
+    gaps = decodeVByte(buf)
+    starts = np.cumsum(tfs) - tfs
+    # The sums restart at each posting:
+    sums = np.cumsum(gaps)
+    return sums - np.repeat(sums[starts] - gaps[starts], tfs)
+
+
+def encodeAllPostings(stemNos, docNos, tfs, stemsNbr):
+    """ Encode the posting lists of a whole collection at once.
+    :param stemNos: array of the stem number of each posting
+    :param docNos: array of the doc number of each posting
+    :param tfs: array of the frequency of each posting
+    :param stemsNbr: int, the size of the vocabulary
+    The postings must be sorted by doc number inside each stem.
+    :return: a generator of (stem number, bytes, df), by stem number
+    """
+    order = np.argsort(stemNos, kind="stable")
+    stemNos = np.asarray(stemNos)[order]
+    docNos = np.asarray(docNos, dtype=np.int64)[order]
+    tfs = np.asarray(tfs)[order]
+    dfs = np.bincount(stemNos, minlength=stemsNbr)
+    ends = np.cumsum(dfs)
+    starts = ends - dfs
+    # The gaps restart at each new stem:
+    gaps = np.diff(docNos, prepend=0)
+    gaps[starts[dfs > 0]] = docNos[starts[dfs > 0]]
+    gapBytes, gapLens = encodeVByte(gaps)
+    tfBytes, tfLens = encodeVByte(tfs)
+    gapEnds = np.cumsum(gapLens)
+    tfEnds = np.cumsum(tfLens)
+    for stemNo in range(stemsNbr):
+        start, end = starts[stemNo], ends[stemNo]
+        if start == end:
+            yield stemNo, b"", 0
+            continue
+        gapStart = gapEnds[start-1] if start > 0 else 0
+        tfStart = tfEnds[start-1] if start > 0 else 0
+        buf = (gapBytes[gapStart:gapEnds[end-1]].tobytes()
+               + tfBytes[tfStart:tfEnds[end-1]].tobytes())
+        yield stemNo, buf, int(dfs[stemNo])
+
+
+def readTextPostings(path):
+    """ Read a text inverted index, as written by Index.writeStem().
+    :param path: the path to the [name]_inverted.txt file
+    :return: a generator of (stem, list of string doc ids, list of int freqs)
+    """
+    with open(path, "r") as invIndex:
+        for line in invIndex:
+            start = line.find('{')
+            stem = line[:start]
+            postings = [p.split(':') for p
+                        in line[start+1:line.rfind('}')].split(',') if p]
+            yield (stem, [doc for (doc, freq) in postings],
+                   [int(freq) for (doc, freq) in postings])
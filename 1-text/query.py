@@ -214,6 +214,19 @@ class QueryParserCACM(QueryParser):
         return Query(queryId, question)
 
 
+def readQueryLog(path):
+    """ Read the texts of the queries of a query log: a CACM .qry file, or
+    a text file with one query per line.
+    :return: list of strings"""
+    with open(path, "r") as f:
+        content = f.read()
+    if re.search(r"^\.I ", content, re.M):
+        return [search.group(1) for search 
+                in re.finditer(r"^\.W\s*([\s\S]*?)(?=^\.[A-Z]\s|\Z)", 
+                               content, re.M)]
+    return [line.strip() for line in content.split('\n') if line.strip()]
+
+
 if __name__ == "__main__":
     qp = QueryParserCACM("cacm_sample/cacm.qry", "cacm_sample/cacm.rel")
     query = qp.nextQuery()
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+
+""" Top-k retrieval with dynamic pruning.
+The posting lists of the query stems are traversed document at a time,
+and a document is only scored when the upper bounds of the stems it may
+contain could bring it in the current top k:
+- WAND (Broder et al. 2003) uses one upper bound per stem,
+- Block-Max WAND (Ding and Suel 2011) also uses the upper bound of each
+  block of postings, to skip whole blocks.
+Scores computed elsewhere (for instance on another index, see tiers.py)
+can be added to the scores of the docs: they are traversed as one more
+posting list, whose upper bound is their highest value.
+"""
+
+import bisect
+import heapq
+import sys
+
+import numpy as np
+
+# Doc number of an exhausted cursor
+END = sys.maxsize
+
+# Query processing strategies of topK()
+STRATEGIES = ("exhaustive", "wand", "bmw")
+
+# Margin of the upper bounds, for the rounding errors of the sums
+BOUND_MARGIN = 1e-9
+
+
+class Scorer():
+    """ The scores of the docs for a query, used by topK().
+    A model that supports the pruning strategies returns a Scorer from
+    IRmodel.getScorer(). """
+    def getStems(self):
+        """ Return the stems of the query that can score, in the order of
+        the query"""
+        raise NotImplementedError("Abstract method.")
+
+    def getBlockBounds(self, segment, stem):
+        """ Return the highest score the stem can give to the docs of each
+        block of its posting list.
+        :param segment: the Index object, or one of its segments
+        :return: array of floats, see Index.getBlocks()"""
+        raise NotImplementedError("Abstract method.")
+
+    def score(self, segment, docNo, cursors):
+        """ Return the score of a doc.
+        :param segment: the Index object, or one of its segments
+        :param docNo: int, the number of the doc in segment
+        :param cursors: the PostingCursor objects on the doc, in the order
+            of the query
+        :return: float"""
+        raise NotImplementedError("Abstract method.")
+
+
+class PostingCursor():
+    """ Iterate over the posting list of a stem, by increasing doc number
+    """
+    def __init__(self, stem, docNos, tfs, blockLastDocs, blockBounds):
+        """
+        :param stem: string, the stem of the posting list
+        :param docNos: sorted array of doc numbers
+        :param tfs: array of frequencies
+        :param blockLastDocs: array, the last doc number of each block
+        :param blockBounds: array, the highest score of each block
+        """
+        self.stem = stem
+        # Python lists are faster than arrays for item by item accesses
+        self.docNos = docNos.tolist()
+        self.tfs = tfs.tolist()
+        self.blockLastDocs = blockLastDocs.tolist()
+        self.blockBounds = blockBounds.tolist()
+        self.upperBound = max(self.blockBounds, default=0)
+        self.pos = 0
+        # Current block, see blockMax()
+        self.block = 0
+        # Number of postings used to score a doc
+        self.scored = 0
+
+    def __len__(self):
+        return len(self.docNos)
+
+    def doc(self):
+        """ Return the current doc number, END if the cursor is exhausted
+        """
+        if self.pos < len(self.docNos):
+            return self.docNos[self.pos]
+        return END
+
+    def tf(self):
+        """ Return the frequency of the stem in the current doc """
+        return self.tfs[self.pos]
+
+    def next(self):
+        """ Move to the next posting """
+        self.pos += 1
+
+    def nextGeq(self, docNo):
+        """ Move to the first posting with a doc number >= docNo """
+        self.pos = bisect.bisect_left(self.docNos, docNo, self.pos)
+
+    def blockMax(self, docNo):
+        """ Return the bound of the block that may contain a doc, without
+        moving the cursor. The docs must be asked in increasing order.
+        :return: (float, the highest score of the block, int, the first 
+            doc number after the block). (0, END) after the last block."""
+        lastDocs = self.blockLastDocs
+        while self.block < len(lastDocs) and lastDocs[self.block] < docNo:
+            self.block += 1
+        if self.block == len(lastDocs):
+            return 0, END
+        return self.blockBounds[self.block], lastDocs[self.block] + 1
+
+
+class DocCursor():
+    """ The posting of a stem in one doc, read from the forward index: a 
+    Scorer can score a doc from it without the posting list, see 
+    scoreDocs() """
+    def __init__(self, stem, tf):
+        self.stem = stem
+        self.freq = tf
+
+    def tf(self):
+        """ Return the frequency of the stem in the doc """
+        return self.freq
+
+
+def pushResult(heap, k, score, key):
+    """ Add a scored doc to a top-k heap if it is good enough.
+    :param heap: list, a heap of (score, key)
+    :param key: tuple, the negated position of the doc in the collection:
+        on equal scores, the first docs are kept.
+    :return: None
+    """
+    if len(heap) < k:
+        heapq.heappush(heap, (score, key))
+    elif (score, key) > heap[0]:
+        heapq.heapreplace(heap, (score, key))
+
+
+def threshold(heap, k):
+    """ Return the score a doc must exceed to enter the top k """
+    if len(heap) < k:
+        return -float("inf")
+    return heap[0][0]
+
+
+def findPivot(cursors, minScore):
+    """ Find the first cursor (sorted by doc) where the sum of the upper
+    bounds could beat minScore, and the cursors after it on the same doc.
+    :return: int, the position of the last cursor on the pivot doc, None
+        if no doc can beat minScore"""
+    bounds = 0
+    for i, cursor in enumerate(cursors):
+        if cursor.doc() == END:
+            return None
+        bounds += cursor.upperBound
+        if bounds > minScore:
+            pivotDoc = cursor.doc()
+            while i+1 < len(cursors) and cursors[i+1].doc() == pivotDoc:
+                i += 1
+            return i
+    return None
+
+
+def scorePivot(queryOrder, pivotDoc, k, heap, scoreDoc, key):
+    """ Score a doc and move the cursors that are on it """
+    onDoc = [c for c in queryOrder if c.doc() == pivotDoc]
+    score = scoreDoc(pivotDoc, onDoc)
+    if score is not None:
+        pushResult(heap, k, score, key + (-pivotDoc,))
+    for cursor in onDoc:
+        cursor.scored += 1
+        cursor.next()
+
+
+def wand(cursors, k, heap, scoreDoc, key=(), blockMax=False, prune=True):
+    """ Find the top k docs of a list of posting lists with WAND.
+    :param cursors: list of PostingCursor objects, with the stems in the
+        order of the query
+    :param k: int, the number of docs to retrieve
+    :param heap: list, the top-k heap to fill, see pushResult(). It may
+        already hold the results of other segments.
+    :param scoreDoc: function(docNo, cursors) -> float or None, the score
+        of the doc from the cursors that are on it (in query order), None
+        if the doc must be ignored.
+    :param key: tuple, prefix of the keys of the heap, see pushResult()
+    :param blockMax: bool, use the bounds of the blocks (Block-Max WAND)
+    :param prune: bool, if False every doc is scored
+    :return: None
+    """
+    queryOrder = [c for c in cursors if len(c) > 0]
+    cursors = list(queryOrder)
+    while True:
+        cursors.sort(key=PostingCursor.doc)
+        minScore = threshold(heap, k) if prune else -float("inf")
+        pivot = findPivot(cursors, minScore)
+        if pivot is None:
+            return
+        pivotDoc = cursors[pivot].doc()
+        if blockMax:
+            blocks = [c.blockMax(pivotDoc) for c in cursors[:pivot+1]]
+            if sum(bound for (bound, end) in blocks) <= minScore:
+                # No doc can enter the top k until one of these blocks
+                # ends, or until the next cursor
+                nextDoc = min(end for (bound, end) in blocks)
+                if pivot+1 < len(cursors):
+                    nextDoc = min(nextDoc, cursors[pivot+1].doc())
+                for cursor in cursors[:pivot+1]:
+                    cursor.nextGeq(nextDoc)
+                continue
+        if cursors[0].doc() == pivotDoc:
+            # Every cursor before the pivot is on the doc: score it
+            scorePivot(queryOrder, pivotDoc, k, heap, scoreDoc, key)
+        else:
+            # The docs before the pivot can't enter the top k
+            for cursor in cursors[:pivot]:
+                cursor.nextGeq(pivotDoc)
+
+
+def bonusCursor(segment, bonus):
+    """ Return a PostingCursor on the docs of a segment that have a bonus,
+    see topK(). Its stem is None, its frequencies are the bonuses. """
+    docNos, values = [], []
+    docNosOf = segment.docNos
+    for docId, value in bonus.items():
+        docNo = docNosOf.get(str(docId))
+        if docNo is not None and not segment.tombstones[docNo]:
+            docNos.append(docNo)
+            values.append(value)
+    order = np.argsort(docNos, kind="stable")
+    docNos = np.array(docNos, dtype=np.int64)[order]
+    values = np.array(values, dtype=float)[order]
+    return PostingCursor(None, docNos, values, docNos[-1:],
+                         values.max(initial=0)[None] * (1 + BOUND_MARGIN))
+
+
+def topK(index, scorer, k, strategy="wand", bonus=None):
+    """ Find the k best docs of an index and its segments.
+    :param index: the Index object
+    :param scorer: a Scorer object
+    :param k: int, the number of docs to retrieve
+    :param strategy: string in STRATEGIES, "exhaustive" scores every doc
+        of the posting lists, "wand" and "bmw" (Block-Max WAND) skip the
+        docs that can't enter the top k. They all give the same results.
+    :param bonus: dict {doc id: float >= 0} added to the score of the 
+        docs, None for none. The docs with a bonus are scored even if they
+        have no stem of the query.
+    :return: (list of (doc id, score) sorted by score, int number of
+        postings of the query stems, int number of postings used to score
+        a doc)
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError("Unknown strategy %s, expected one of %s"
+                         % (strategy, STRATEGIES))
+    heap = []
+    postingsNbr, scoredNbr = 0, 0
+    segments = index.getSegments()
+    for segmentNo, segment in enumerate(segments):
+        cursors = []
+        for stem in scorer.getStems():
+            docNos, tfs = segment.getPostings(stem)
+            if len(docNos) == 0:
+                continue
+            bounds = scorer.getBlockBounds(segment, stem)
+            cursors.append(PostingCursor(stem, docNos, tfs,
+                segment.getBlocks(stem)["lastDoc"],
+                bounds * (1 + BOUND_MARGIN)))
+        if bonus:
+            cursors.append(bonusCursor(segment, bonus))
+        def scoreDoc(docNo, onDoc):
+            if segment.tombstones[docNo]:
+                return None
+            if not bonus:
+                return scorer.score(segment, docNo, onDoc)
+            stemCursors = [c for c in onDoc if c.stem is not None]
+            score = sum(c.tf() for c in onDoc if c.stem is None)
+            if stemCursors:
+                score += scorer.score(segment, docNo, stemCursors)
+            return score
+        wand(cursors, k, heap, scoreDoc, (-segmentNo,),
+             blockMax=(strategy == "bmw"), prune=(strategy != "exhaustive"))
+        postingsNbr += sum(len(c) for c in cursors)
+        scoredNbr += sum(c.scored for c in cursors)
+    results = [(segments[-key[0]].docList[-key[1]], score)
+               for (score, key) in sorted(heap, reverse=True)]
+    return results, postingsNbr, scoredNbr
+
+
+def scoreDocs(index, scorer, docIds):
+    """ Score some docs from the forward index, without reading the 
+    posting lists of the query.
+    :param index: the Index object
+    :param scorer: a Scorer object
+    :param docIds: iterable of doc ids, not deleted
+    :return: dict {doc id: score}, 0 for the docs without a stem of the
+        query
+    :raise KeyError: if a doc is unknown or deleted"""
+    stems = scorer.getStems()
+    scores = {}
+    for docId in docIds:
+        segment = index._findSegment(docId)
+        termIds, tfs = segment.getDocVector(docId)
+        stemList = segment.stemList
+        docStems = {stemList[t]: tf for (t, tf) 
+                    in zip(termIds.tolist(), tfs.tolist())}
+        cursors = [DocCursor(stem, docStems[stem]) for stem in stems 
+                   if stem in docStems]
+        scores[docId] = (scorer.score(segment, segment.docNos[str(docId)], 
+                                      cursors) if cursors else 0.)
+    return scores
+
+
+def upperBound(index, scorer):
+    """ Return a score that no doc of an index and its segments can 
+    exceed: the sum of the highest bound of each stem of the query.
+    :param index: the Index object
+    :param scorer: a Scorer object
+    :return: float"""
+    bound = 0.
+    for stem in scorer.getStems():
+        bound += max(float(scorer.getBlockBounds(segment, stem).max(
+            initial=0)) for segment in index.getSegments())
+    return bound * (1 + BOUND_MARGIN)
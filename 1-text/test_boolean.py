@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+""" Tests of the Boolean queries: the skip pointers must find the same
+docs as a scan of every posting list. """
+
+import random
+
+import pytest
+
+import boolean
+
+
+def bruteForce(index, tree):
+    """ The docs that match a tree, from the posting lists as dicts """
+    if tree[0] == "term":
+        return set(map(str, index.getTfsForStem(tree[1])))
+    if tree[0] == "not":
+        return set(map(str, index.getDocsID())) - bruteForce(index, tree[1])
+    matches = [bruteForce(index, child) for child in tree[1]]
+    if tree[0] == "and":
+        return set.intersection(*matches)
+    return set.union(*matches)
+
+
+def randomTree(rand, stems, depth=0):
+    """ A random query tree of at most 3 levels """
+    draw = rand.random()
+    if depth > 2 or draw < 0.4:
+        term = ("term", rand.choice(stems))
+        return ("not", term) if rand.random() < 0.15 else term
+    op = "and" if draw < 0.8 else "or"
+    return (op, [randomTree(rand, stems, depth + 1)
+                 for _ in range(rand.randint(2, 4))])
+
+
+@pytest.fixture(scope="module")
+def engine(index, stemmer):
+    return boolean.BooleanEngine(index, stemmer)
+
+
+@pytest.mark.parametrize("frequent", [False, True])
+def test_match_brute_force(index, engine, frequent):
+    stems = sorted(index.getStems(), key=lambda stem: -index.getDf(stem))
+    if frequent:
+        # Long posting lists, with several blocks to skip
+        stems = stems[:40]
+    rand = random.Random(3)
+    for _ in range(300):
+        tree = randomTree(rand, stems)
+        docs = engine.match(tree)
+        assert len(docs) == len(set(docs))
+        assert set(docs) == bruteForce(index, tree)
+        assert engine.decodedNbr <= engine.postingsNbr
+
+
+def test_parse(engine):
+    assert engine.parse("(parallel OR distributed) AND algorithm "
+                        "NOT sorting") \
+        == ("and", [("or", [("term", "parallel"), ("term", "distribut")]),
+                    ("term", "algorithm"), ("not", ("term", "sort"))])
+    assert engine.parse("") is None
+    with pytest.raises(ValueError):
+        engine.parse("(parallel OR distributed")
+    with pytest.raises(ValueError):
+        engine.parse("parallel)")
+
+
+def test_search_relaxed(index, engine, stemmer):
+    query = stemmer.getTextRepresentation("parallel algorithm sorting "
+                                          "compiler")
+    conjunctive = set(engine.search(query))
+    assert conjunctive == bruteForce(index, boolean.conjunction(query))
+    strictCounts = engine.postingsNbr
+    relaxed = set(engine.search(query, minDocs=len(conjunctive) + 1))
+    assert relaxed == bruteForce(index, boolean.relax(
+        boolean.conjunction(query)))
+    assert relaxed > conjunctive
+    assert engine.postingsNbr == 2 * strictCounts
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+""" Tests of the cache of the results of the models: hits, time to live,
+least recently used eviction, and invalidation when an index changes. """
+
+import ParserCACM
+import cache
+import modeles
+from conftest import SAMPLE_CORPUS
+from indexation import Index
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+def test_hits_and_eviction():
+    resultCache = cache.ResultCache(maxSize=2)
+    assert resultCache.get("a") is None
+    resultCache.put("a", 1)
+    resultCache.put("b", 2)
+    assert resultCache.get("a") == 1
+    # "b" is the least recently used
+    resultCache.put("c", 3)
+    assert resultCache.get("b") is None
+    assert resultCache.get("a") == 1
+    assert resultCache.get("c") == 3
+    stats = resultCache.getStats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (3, 2, 1)
+    assert stats["size"] == 2
+
+
+def test_time_to_live():
+    clock = FakeClock()
+    resultCache = cache.ResultCache(ttl=10, clock=clock)
+    resultCache.put("a", 1)
+    clock.now = 5
+    assert resultCache.get("a") == 1
+    clock.now = 11
+    assert resultCache.get("a") is None
+    assert resultCache.getStats()["expirations"] == 1
+
+
+def test_generations_by_index():
+    resultCache = cache.ResultCache()
+    resultCache.put("a", 1, generation=0, index="first")
+    resultCache.put("b", 2, generation=0, index="second")
+    # Only the results of the index that changed are removed
+    assert resultCache.get("a", generation=1, index="first") is None
+    assert resultCache.get("b", generation=0, index="second") == 2
+    assert resultCache.getStats()["invalidations"] == 1
+
+
+def test_model_results(index, queries):
+    resultCache = cache.ResultCache()
+    model = modeles.Vectoriel(index, modeles.TfidfWeighter(index))
+    model.setCache(resultCache)
+    uncached = modeles.Vectoriel(index, modeles.TfidfWeighter(index))
+    query = queries[0]
+    ranking = model.getRanking(query, 10)
+    assert ranking == uncached.getRanking(query, 10)
+    # A ranking is kept once, the scores it was computed from aren't
+    assert len(resultCache) == 1
+    ranking.clear()
+    hits = resultCache.hits
+    assert model.getRanking(query, 10) == uncached.getRanking(query, 10)
+    assert resultCache.hits == hits + 1
+    # The default arguments have the same key
+    model.getScores(query)
+    hits = resultCache.hits
+    assert model.getScores(query, normalized=True) \
+        == uncached.getScores(query)
+    assert resultCache.hits == hits + 1
+    # The scores of a batch are kept as results of getScores()
+    batch = model.getScoresBatch(queries[1:4])
+    hits = resultCache.hits
+    assert [model.getScores(q) for q in queries[1:4]] == batch
+    assert resultCache.hits == hits + 3
+
+
+def test_models_of_two_indexes(index, queries, stemmer, tmp_path):
+    other = Index("sample", str(tmp_path))
+    other.indexation(SAMPLE_CORPUS, ParserCACM.ParserCACM(), stemmer)
+    assert other.generation == index.generation
+    resultCache = cache.ResultCache()
+    models = [modeles.Okapi(index), modeles.Okapi(other)]
+    for model in models:
+        model.setCache(resultCache)
+    query = queries[0]
+    rankings = [model.getRanking(query) for model in models]
+    assert rankings[0] != rankings[1]
+    for model, ranking in zip(models, rankings):
+        assert model.getRanking(query) == ranking
+        assert ranking == modeles.Okapi(model.index).getRanking(query)
+
+
+def test_invalidation(tmp_path, stemmer, queries):
+    index = Index("sample", str(tmp_path))
+    index.indexation(SAMPLE_CORPUS, ParserCACM.ParserCACM(), stemmer)
+    model = modeles.Okapi(index)
+    model.setCache(cache.ResultCache())
+    query = queries[0]
+    ranking = model.getRanking(query, 5)
+    index.deleteDocuments([ranking[0][0]])
+    updated = model.getRanking(query, 5)
+    assert ranking[0][0] not in [doc for (doc, _) in updated]
+    assert updated == modeles.Okapi(index).getRanking(query, 5)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+""" Tests of the doc store: the docs read back must be the docs of the
+corpus, in any order and from any block. """
+
+import random
+
+import pytest
+
+import ParserCACM
+import docstore
+from conftest import splitDocs
+from indexation import Index
+
+
+@pytest.mark.parametrize("compression", sorted(docstore.COMPRESSIONS))
+def test_store_round_trip(tmp_path, compression):
+    rand = random.Random(2)
+    texts = ["", "é" * 300, "x" * 5000] \
+        + ["doc %d " % i * rand.randint(1, 40) for i in range(300)]
+    path = str(tmp_path / "docs.bin")
+    writer = docstore.DocStoreWriter(path, compression, blockBytes=512)
+    for text in texts:
+        writer.add(text)
+    store = writer.close()
+    assert len(store.blockPos) > 10
+    docNos = list(range(len(texts)))
+    rand.shuffle(docNos)
+    assert store.getDocs(docNos, path) == [texts[d] for d in docNos]
+    # Each block is decompressed once per call
+    decompressions = store.decompressions
+    store.blocks.clear()
+    store.getDocs(docNos, path)
+    assert store.decompressions - decompressions == len(store.blockPos) - 1
+
+
+def test_index_docs(index, corpus):
+    texts = {doc.split()[1]: doc for doc in splitDocs(corpus)}
+    docs = sorted(texts)
+    random.Random(4).shuffle(docs)
+    assert index.getDocs(docs) == [texts[doc] for doc in docs]
+    assert index.getStrDoc(docs[0]) == texts[docs[0]]
+    with pytest.raises(KeyError):
+        index.getDocs(["999999"])
+
+
+@pytest.mark.parametrize("store", [True, False])
+def test_reopened_docs(tmp_path, corpus, stemmer, store):
+    index = Index("lzma", str(tmp_path))
+    index.indexation(corpus, ParserCACM.ParserCACM(), stemmer,
+                     storeCompression="lzma", store=store)
+    assert (tmp_path / "lzma_docs.bin").exists() == store
+    index.save()
+    reopened = Index.open("lzma", str(tmp_path))
+    reopened.openMmap()
+    texts = {doc.split()[1]: doc for doc in splitDocs(corpus)}
+    docs = sorted(texts)
+    assert reopened.getDocs(docs) == [texts[doc] for doc in docs]
+    reopened.closeMmap()
+
+
+def test_snippets(index, stemmer):
+    query = "parallel computation"
+    stems = stemmer.getTextRepresentation(query)
+    docs = [doc for doc in index.getDocsID()
+            if "comput" in index.getTfsForDoc(doc)][:10]
+    snippets = index.getSnippets(docs, query, stemmer,
+                                 parser=ParserCACM.ParserCACM(),
+                                 highlight=("[", "]"))
+    assert len(snippets) == len(docs)
+    for snippet in snippets:
+        assert "[" in snippet
+        assert len(snippet.replace("[", "").replace("]", "")) \
+            <= 200 + len(" ...")
+        for word in snippet.split("[")[1:]:
+            highlighted = word.split("]")[0]
+            assert set(stemmer.getTextRepresentation(highlighted)) & \
+                set(stems)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+""" Tests of the score at a time strategy: without a budget, it must find
+the top k of the quantized impacts of every doc. """
+
+import numpy as np
+import pytest
+
+import modeles
+
+MODELS = {
+    "okapi": lambda index: modeles.Okapi(index, strategy="saat"),
+    "tfidf": lambda index: modeles.Vectoriel(
+        index, modeles.TfidfWeighter(index), strategy="saat"),
+}
+
+
+def queryStems(model, query):
+    """ The stem numbers of the query whose impacts are summed """
+    stems = dict.fromkeys(model.getImpactStems(query))
+    return [model.index.vocab[stem] for stem in stems
+            if stem in model.index.vocab]
+
+
+@pytest.mark.parametrize("name", sorted(MODELS))
+def test_saat_full_depth_is_exhaustive(index, queries, name):
+    model = MODELS[name](index)
+    impactIndex = model.getImpactIndex()
+    weights = model.getWeightsMatrix().tocsc()
+    levels = 2**impactIndex.bits - 1
+    for query in queries:
+        stems = queryStems(model, query)
+        columns = weights[:, stems].toarray()
+        exact = columns.sum(axis=1)
+        quantized = np.where(columns > 0, np.clip(
+            np.rint(columns / impactIndex.scale), 1, levels), 0).sum(axis=1)
+        docNos = np.flatnonzero(quantized)
+        docNos = docNos[np.lexsort((docNos, -quantized[docNos]))[:10]]
+        top = model.getTopScores(query, 10)
+        assert [doc for (doc, _) in top] \
+            == [index.docList[d] for d in docNos]
+        # The quantized scores are close to the exact ones
+        error = len(stems) * impactIndex.scale
+        for doc, score in top:
+            assert abs(score - exact[index.docNos[doc]]) <= error
+        # The docs far above the 10th exhaustive score are found
+        model.setStrategy("exhaustive")
+        exhaustive = model.getTopScores(query, 10)
+        model.setStrategy("saat")
+        if len(exhaustive) == 10:
+            found = {doc for (doc, _) in top}
+            assert all(doc in found for (doc, score) in exhaustive
+                       if score > exhaustive[-1][1] + 2 * error)
+
+
+@pytest.mark.parametrize("budget", [1, 10, 50])
+def test_saat_budget(index, queries, budget):
+    model = MODELS["okapi"](index)
+    full = MODELS["okapi"](index)
+    model.setStrategy("saat", budget)
+    for query in queries:
+        top = model.getTopScores(query, 10)
+        full.getTopScores(query, 10)
+        assert model.scoredNbr <= budget
+        assert model.postingsNbr == full.postingsNbr
+        assert len(top) <= min(10, budget)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+""" Tests of the index built in memory: it must rank like an Index of
+the same collection. """
+
+import gc
+import os
+
+import pytest
+
+import ParserCACM
+import modeles
+from conftest import SAMPLE_CORPUS
+from indexation import Index, InMemoryIndex
+
+MODELS = {
+    "okapi": lambda index: modeles.Okapi(index),
+    "tfidf": lambda index: modeles.Vectoriel(index,
+                                             modeles.TfidfWeighter(index)),
+    "unigram": lambda index: modeles.UnigramLanguage(index),
+}
+
+
+@pytest.mark.parametrize("name", sorted(MODELS))
+def test_in_memory_ranking(tmp_path, stemmer, queries, name):
+    ref = Index("cacm", str(tmp_path))
+    ref.indexation(SAMPLE_CORPUS, ParserCACM.ParserCACM(), stemmer)
+    index = InMemoryIndex(SAMPLE_CORPUS, ParserCACM.ParserCACM(), stemmer)
+    assert index.getDocsID() == ref.getDocsID()
+    model, refModel = MODELS[name](index), MODELS[name](ref)
+    ranked = 0
+    for query in queries:
+        ranking = model.getRanking(query, 5)
+        refRanking = refModel.getRanking(query, 5)
+        ranked += len(ranking)
+        assert [doc for (doc, _) in ranking] \
+            == [doc for (doc, _) in refRanking]
+        assert [score for (_, score) in ranking] \
+            == pytest.approx([score for (_, score) in refRanking],
+                             nan_ok=True)
+    assert ranked > 0
+
+
+def test_in_memory_files_removed(stemmer):
+    index = InMemoryIndex(SAMPLE_CORPUS, ParserCACM.ParserCACM(), stemmer)
+    outDir = index.outDir
+    assert os.path.exists(index.invertedPath)
+    del index
+    gc.collect()
+    assert not os.path.exists(outDir)
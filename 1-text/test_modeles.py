@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+""" Tests of the unigram language model: the scores computed from the
+postings must be the scores of score() over every doc. """
+
+import pytest
+
+import modeles
+
+
+@pytest.mark.parametrize("smoothing, params", [
+    ("dirichlet", {"mu": 2000}),
+    ("dirichlet", {"mu": 20}),
+    ("jelinek-mercer", {"regularization": 0.9}),
+    ("jelinek-mercer", {"regularization": 0.2}),
+])
+def test_unigram_scores(index, queries, smoothing, params):
+    model = modeles.UnigramLanguage(index, smoothing=smoothing, **params)
+    batch = model.getScoresBatch(queries)
+    for query, batchScores in zip(queries, batch):
+        expected = {doc: model.score(query, doc)
+                    for doc in index.getDocsID()}
+        scores = model.getScores(query)
+        if smoothing == "dirichlet":
+            # Every doc has a score, even without a stem of the query
+            assert scores.keys() == expected.keys()
+            assert batchScores.keys() == expected.keys()
+            ranking = [doc for (doc, _) in model.getRanking(query)]
+            assert ranking == [doc for (doc, _)
+                               in modeles.IRmodel.rankScores(expected)]
+        for doc, score in scores.items():
+            assert score == pytest.approx(expected[doc])
+        for doc, score in batchScores.items():
+            assert score == pytest.approx(expected[doc])
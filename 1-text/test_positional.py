@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+""" Tests of the positional index: the phrase and proximity queries must
+find the same docs as a scan of the stem positions of every doc. """
+
+import random
+
+import pytest
+
+import ParserCACM
+import positional
+
+
+@pytest.fixture(scope="module")
+def docsPositions(corpus, stemmer):
+    """ dict {docID: {stem: list of positions}}, from the corpus """
+    parser = ParserCACM.ParserCACM()
+    parser.initFile(corpus)
+    docs = {}
+    doc = parser.nextDocument()
+    while doc is not None:
+        docs[doc.getId()] = stemmer.getStemPositions(doc.getText())
+        doc = parser.nextDocument()
+    return docs
+
+
+def bruteForcePhrase(docsPositions, terms):
+    """ The docs that contain a phrase, and its number of occurrences """
+    docs = {}
+    for doc, positions in docsPositions.items():
+        if not all(stem in positions for (stem, _) in terms):
+            continue
+        starts = set.intersection(*[{pos - offset for pos in positions[stem]}
+                                    for (stem, offset) in terms])
+        starts = {start for start in starts if start >= 0}
+        if starts:
+            docs[doc] = len(starts)
+    return docs
+
+
+def bruteForceProximity(docsPositions, stems, window):
+    """ The proximity scores of the docs, see getProximityScores() """
+    scores = {}
+    for doc, positions in docsPositions.items():
+        occurrences = sorted((pos, i) for (i, stem) in enumerate(stems)
+                             for pos in positions.get(stem, []))
+        score = sum(1 / (b[0] - a[0])**2 for (a, b)
+                    in zip(occurrences, occurrences[1:])
+                    if a[1] != b[1] and b[0] - a[0] <= window)
+        if score:
+            scores[doc] = score
+    return scores
+
+
+def test_positions(index, docsPositions):
+    for stem in index.getStems()[::7]:
+        docNos, tfs, positions = index.getPositions(stem)
+        start = 0
+        for docNo, tf in zip(docNos.tolist(), tfs.tolist()):
+            assert positions[start:start + tf].tolist() \
+                == docsPositions[index.docList[docNo]][stem]
+            start += tf
+
+
+def test_phrase_and_proximity(index, stemmer, docsPositions):
+    engine = positional.PositionalEngine(index, stemmer)
+    rand = random.Random(1)
+    docs = sorted(docsPositions)
+    found = 0
+    for _ in range(200):
+        # A phrase of 1 to 3 stems of a doc
+        occurrences = sorted((pos, stem) for (stem, positions)
+                             in docsPositions[rand.choice(docs)].items()
+                             for pos in positions)
+        if len(occurrences) < 3:
+            continue
+        first = rand.randrange(len(occurrences) - 2)
+        phrase = occurrences[first:first + rand.randint(1, 3)]
+        terms = [(stem, pos - phrase[0][0]) for (pos, stem) in phrase]
+        docNos, counts = positional.matchPhrase(index, terms)
+        matches = dict(zip([index.docList[d] for d in docNos.tolist()],
+                           counts.tolist()))
+        assert matches == bruteForcePhrase(docsPositions, terms)
+        found += len(matches)
+        stems = list(dict.fromkeys([stem for (stem, _) in terms]
+                                   + [rand.choice(occurrences)[1]]))
+        scores = engine.getProximityScores(dict.fromkeys(stems, 1), 4)
+        expected = bruteForceProximity(docsPositions, stems, 4)
+        assert scores.keys() == expected.keys()
+        for doc, score in scores.items():
+            assert score == pytest.approx(expected[doc])
+    assert found > 0
+
+
+def test_phrase_docs(index, stemmer, docsPositions):
+    engine = positional.PositionalEngine(index, stemmer)
+    text = "theory of computation"
+    assert engine.parsePhrase(text) == [("theori", 0), ("comput", 2)]
+    assert engine.getPhraseDocs(text) \
+        == bruteForcePhrase(docsPositions, engine.parsePhrase(text))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+""" Tests of the top k strategies: WAND and Block-Max WAND must find the
+same docs as the exhaustive scoring. """
+
+import pytest
+
+import modeles
+
+MODELS = {
+    "okapi": lambda index, strategy: modeles.Okapi(index, strategy=strategy),
+    "tfidf": lambda index, strategy: modeles.Vectoriel(
+        index, modeles.TfidfWeighter(index), strategy=strategy),
+    "binary": lambda index, strategy: modeles.Vectoriel(
+        index, modeles.BinaryWeighter(index), strategy=strategy),
+    "tfidf-raw": lambda index, strategy: modeles.Vectoriel(
+        index, modeles.TfidfWeighter(index), normalized=False,
+        strategy=strategy),
+}
+
+
+@pytest.mark.parametrize("name", sorted(MODELS))
+@pytest.mark.parametrize("k", [1, 10, 100])
+@pytest.mark.parametrize("strategy", ["wand", "bmw"])
+def test_pruning_same_top_k(index, queries, name, k, strategy):
+    exhaustive = MODELS[name](index, "exhaustive")
+    pruned = MODELS[name](index, strategy)
+    for query in queries:
+        assert pruned.getTopScores(query, k) \
+            == exhaustive.getTopScores(query, k)
+
+
+def rawScore(model, query, doc):
+    """ The score of a doc as getTopScores() gives it: Okapi.getScores()
+    normalizes the scores, score() doesn't """
+    if isinstance(model, modeles.Vectoriel):
+        return model.score(query, doc, model.normalized)
+    return model.score(query, doc)
+
+
+@pytest.mark.parametrize("name", sorted(MODELS))
+def test_exhaustive_matches_scores(index, queries, name):
+    model = MODELS[name](index, "exhaustive")
+    for query in queries[::3]:
+        top = model.getTopScores(query, 10)
+        scores = {doc: rawScore(model, query, doc)
+                  for doc in index.getDocsID()}
+        scores = {doc: score for (doc, score) in scores.items() if score}
+        ranked = modeles.IRmodel.rankScores(scores, 10)
+        assert [score for (_, score) in top] \
+            == pytest.approx([score for (_, score) in ranked])
+        for doc, score in top:
+            assert score == pytest.approx(scores[doc])
+
+
+def test_pruning_skips_docs(index, queries):
+    exhaustive = MODELS["okapi"](index, "exhaustive")
+    pruned = MODELS["okapi"](index, "bmw")
+    scored = {"exhaustive": 0, "bmw": 0}
+    for query in queries:
+        exhaustive.getTopScores(query, 10)
+        pruned.getTopScores(query, 10)
+        assert pruned.postingsNbr == exhaustive.postingsNbr
+        scored["exhaustive"] += exhaustive.scoredNbr
+        scored["bmw"] += pruned.scoredNbr
+    assert scored["bmw"] < scored["exhaustive"]
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+""" Tests of the incremental updates: an index with added, replaced and
+deleted docs, merged in the background, must answer like a fresh index of
+the same docs. """
+
+import gc
+import os
+
+import pytest
+
+import ParserCACM
+import modeles
+from conftest import SAMPLE_CORPUS, renumber, splitDocs, writeCorpus
+from indexation import Index, StaleIndexError
+
+
+def checkSameIndex(index, ref, stemmer):
+    """ Assert that two indexes have the same docs, postings, statistics,
+    citation graph and scores """
+    docs = sorted(ref.getDocsID())
+    assert sorted(index.getDocsID()) == docs
+    assert index.getDocsCount() == ref.getDocsCount()
+    assert index.getMeanDocLen() == pytest.approx(ref.getMeanDocLen())
+    for doc in docs:
+        assert index.getTfsForDoc(doc) == ref.getTfsForDoc(doc)
+        assert index.getDocsLen(doc) == ref.getDocsLen(doc)
+        assert sorted(index.getSuccNodes(doc)) \
+            == sorted(ref.getSuccNodes(doc))
+        assert sorted(index.getPrevNodes(doc)) \
+            == sorted(ref.getPrevNodes(doc))
+    for stem in ref.getStems():
+        assert index.getTfsForStem(stem) == ref.getTfsForStem(stem)
+        assert index.getDf(stem) == ref.getDf(stem)
+        assert index.getCf(stem) == ref.getCf(stem)
+    assert index.getDocs(docs) == ref.getDocs(docs)
+    query = stemmer.getTextRepresentation("parallel algorithm computation")
+    for strategy in ("exhaustive", "bmw"):
+        top = modeles.Okapi(index, strategy=strategy).getTopScores(query, 20)
+        refTop = modeles.Okapi(ref, strategy=strategy).getTopScores(query,
+                                                                    20)
+        assert [doc for (doc, _) in top] == [doc for (doc, _) in refTop]
+        assert [score for (_, score) in top] \
+            == pytest.approx([score for (_, score) in refTop])
+
+
+@pytest.fixture
+def updated(tmp_path, stemmer):
+    """ An index of 60 docs with 3 batches of new docs, a replaced doc
+    and 2 deleted docs, and the fresh index of the docs that remain """
+    docs = splitDocs(SAMPLE_CORPUS)
+    base = docs[:60]
+    feeds = [[renumber(doc, 1000 + 10 * batch + i)
+              for (i, doc) in enumerate(docs[60 + 10 * batch:
+                                             70 + 10 * batch])]
+             for batch in range(3)]
+    # Replaces the doc 5
+    feeds.append([renumber(docs[98], 5)])
+    index = Index("inc", str(tmp_path))
+    index.indexation(writeCorpus(str(tmp_path / "base.txt"), base),
+                     ParserCACM.ParserCACM(), stemmer)
+    index.mergeFactor = 3
+    for batch, feed in enumerate(feeds):
+        index.addDocuments(ParserCACM.ParserCACM(),
+                           writeCorpus(str(tmp_path / ("feed%d.txt" % batch)),
+                                       feed))
+    assert index.deleteDocuments([7, "1005", 999999]) == 2
+    index.waitForMerges()
+    final = {}
+    for doc in base + sum(feeds, []):
+        final[doc.split()[1]] = doc
+    del final["7"], final["1005"]
+    ref = Index("ref", str(tmp_path))
+    ref.indexation(writeCorpus(str(tmp_path / "all.txt"), final.values()),
+                   ParserCACM.ParserCACM(), stemmer)
+    return index, ref
+
+
+def test_updates_match_fresh_index(updated, stemmer):
+    index, ref = updated
+    assert index.hasUpdates()
+    checkSameIndex(index, ref, stemmer)
+    with pytest.raises(KeyError):
+        index.getSuccNodes("7")
+    with pytest.raises(KeyError):
+        index.getDocs(["1005"])
+
+
+def test_reopen_and_compact(updated, stemmer, tmp_path):
+    index, ref = updated
+    index.save()
+    reopened = Index.open("inc", str(tmp_path))
+    checkSameIndex(reopened, ref, stemmer)
+    reopened.compact()
+    assert not reopened.hasUpdates()
+    checkSameIndex(reopened, ref, stemmer)
+    reopened.save()
+    checkSameIndex(Index.open("inc", str(tmp_path)), ref, stemmer)
+
+
+def test_missing_segment(updated, tmp_path):
+    index, ref = updated
+    index.save()
+    segment = index.getSegments()[-1]
+    segment.removeFiles()
+    with pytest.raises(StaleIndexError):
+        Index.open("inc", str(tmp_path))
+
+
+def test_compact_saved_index(updated, stemmer, tmp_path):
+    index, ref = updated
+    index.save()
+    index.compact()
+    # compact() rewrote the manifest of the new files
+    checkSameIndex(Index.open("inc", str(tmp_path)), ref, stemmer)
+
+
+def test_merge_keeps_old_view(tmp_path, stemmer):
+    docs = splitDocs(SAMPLE_CORPUS)
+    index = Index("view", str(tmp_path))
+    index.indexation(writeCorpus(str(tmp_path / "base.txt"), docs[:50]),
+                     ParserCACM.ParserCACM(), stemmer)
+    index.mergeFactor = 100
+    for batch in range(3):
+        index.addDocuments(ParserCACM.ParserCACM(), writeCorpus(
+            str(tmp_path / ("feed%d.txt" % batch)),
+            docs[50 + 10 * batch:60 + 10 * batch]))
+    index.openMmap()
+    view = index.getSegments()
+    old = view[1:]
+    paths = [segment.invertedPath for segment in old]
+    stems = {segment: segment.getStems() for segment in old}
+    index._mergeSegments(index.segments)
+    assert len(index.segments) == 1
+    # A reader of the old view can still read the merged segments
+    for segment in old:
+        for stem in stems[segment]:
+            assert len(segment.getPostings(stem)[0]) > 0
+    assert all(os.path.exists(path) for path in paths)
+    mmaps = [segment.mmaps for segment in old]
+    del view, old, segment, stems
+    gc.collect()
+    assert not any(os.path.exists(path) for path in paths)
+    assert all(mapped.file.closed for maps in mmaps
+               for mapped in maps.values())
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+""" Tests of the two-tier index: the early exit of TieredModel must give
+the scores of the exhaustive ranking, and the first tier has no doc
+store. """
+
+import pytest
+
+import ParserCACM
+import modeles
+from conftest import SAMPLE_CORPUS, renumber, splitDocs, writeCorpus
+from tiers import TieredIndex
+
+
+def makeModel(tiered, tierWeight, depth):
+    tier, full = tiered.getTiers()
+    return modeles.TieredModel(modeles.Okapi(full), modeles.Okapi(tier),
+                               tierWeight, depth)
+
+
+def checkTopScores(model, queries, k):
+    """ Assert that the top k of every strategy has the scores of the
+    ranking of getScores() and of score(), return the number of queries
+    answered by the first tier """
+    answered = 0
+    for query in queries:
+        ranked = modeles.IRmodel.rankScores(model.getScores(query), k)
+        for strategy in ("exhaustive", "wand", "bmw"):
+            model.setStrategy(strategy)
+            top = model.getTopScores(query, k)
+            answered += model.tierAnswered
+            assert [score for (_, score) in top] \
+                == pytest.approx([score for (_, score) in ranked])
+            for doc, score in top:
+                assert model.score(query, doc) == pytest.approx(score)
+    return answered
+
+
+@pytest.fixture(scope="module")
+def tiered(tmp_path_factory, corpus, stemmer):
+    tiered = TieredIndex("cacm", str(tmp_path_factory.mktemp("tiers")))
+    tiered.indexation(corpus, ParserCACM.ParserCACM(), stemmer)
+    return tiered
+
+
+@pytest.mark.parametrize("tierWeight, depth", [
+    (1., None), (4., 30), (20., 30),
+])
+@pytest.mark.parametrize("k", [1, 3, 10])
+def test_early_exit(tiered, queries, tierWeight, depth, k):
+    model = makeModel(tiered, tierWeight, depth)
+    answered = checkTopScores(model, queries, k)
+    if k < 10:
+        # The queries on the titles are answered by the first tier
+        assert answered > 0
+
+
+def test_tier_docs(tiered, stemmer):
+    tier, full = tiered.getTiers()
+    assert tier.store is None
+    assert full.store is not None
+    docs = full.getDocsID()[:10]
+    assert tier.getDocs(docs) == full.getDocs(docs)
+    assert tiered.getSnippets(docs, "computer program", stemmer) \
+        == full.getSnippets(docs, "computer program", stemmer)
+
+
+def test_updates(tmp_path, stemmer, queries):
+    docs = splitDocs(SAMPLE_CORPUS)
+    tiered = TieredIndex("inc", str(tmp_path))
+    tiered.indexation(writeCorpus(str(tmp_path / "base.txt"), docs[:60]),
+                      ParserCACM.ParserCACM(), stemmer)
+    tiered.addDocuments(ParserCACM.ParserCACM(),
+                        writeCorpus(str(tmp_path / "feed.txt"),
+                                    [renumber(doc, 1000 + i)
+                                     for (i, doc) in enumerate(docs[60:])]))
+    assert tiered.deleteDocuments(["3", "1004"]) == 2
+    tiered.waitForMerges()
+    tier, full = tiered.getTiers()
+    assert sorted(tier.getDocsID()) == sorted(full.getDocsID())
+    checkTopScores(makeModel(tiered, 4., 30), queries, 3)
+    tiered.save()
+    reopened = TieredIndex.open("inc", str(tmp_path))
+    checkTopScores(makeModel(reopened, 4., 30), queries, 3)
+    reopened.compact()
+    checkTopScores(makeModel(reopened, 4., 30), queries, 3)
+    assert not (tmp_path / "inc_tier_docs.bin").exists()
+    assert not any("_tier_seg" in path.name and path.name.endswith("docs.bin")
+                   for path in tmp_path.iterdir())
+    assert reopened.getDocs(["1005"]) == [renumber(docs[65], 1005)]
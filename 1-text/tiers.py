@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+""" Two-tier index: the first tier only indexes some fields of the docs
+(the title and the keywords of the CACM articles, see
+ParserCACM.getDocument()), the second tier is the full index.
+The first tier is small, so it can stay in memory: the top k of a query
+is searched in it first, and the full tier is only read when the first
+tier can't guarantee the top k (see modeles.TieredModel). Both tiers
+have the same docs, and are updated together. Only the full index has a
+doc store, the docs and snippets are read from it.
+"""
+
+import copy
+
+from Parser import Parser
+from indexation import Index
+
+# Fields of Document.others indexed in the first tier
+TIER_FIELDS = ("title", "keywords")
+
+
+class FieldParser(Parser):
+    """ Parses the docs with another parser, and only keeps some of their
+    fields in their text """
+    def __init__(self, parser, fields=TIER_FIELDS):
+        """
+        :param parser: The Parser object that reads the docs, it must put
+            the fields in Document.others
+        :param fields: list of the names of the fields to keep
+        """
+        Parser.__init__(self, parser.begin, parser.end)
+        # The file of the parser isn't used, and can't be sent to the
+        # workers of Index.indexation()
+        self.parser = copy.copy(parser)
+        self.parser.file = None
+        self.fields = tuple(fields)
+
+    def getDocument(self, text):
+        doc = self.parser.getDocument(text)
+        doc.text = " \n ".join(doc.others.get(field, "")
+                               for field in self.fields)
+        return doc
+
+
+class TieredIndex():
+    """ The full index of a collection, and the index of some fields of
+    its docs, stored under [directory]/[name]_tier_* """
+    def __init__(self, name, out_dir, fields=TIER_FIELDS,
+                 postingsFormat="binary"):
+        """
+        :param name: the name of the full index
+        :param out_dir: Where to save the indexes.
+        :param fields: list of the fields of the first tier
+        :param postingsFormat: see Index
+        """
+        self.fields = tuple(fields)
+        self.full = Index(name, out_dir, postingsFormat)
+        self.tier = Index(name + "_tier", out_dir, postingsFormat)
+
+    def getTiers(self):
+        """ Return (the first tier, the full index), Index objects """
+        return self.tier, self.full
+
+    def indexation(self, corpus, parser, txtRepr, verbose=False, workers=1,
+                   positions=False, storeCompression="zlib"):
+        """ Create both tiers, see Index.indexation(). The positions and
+        the doc store are only written in the full index.
+        :return: None"""
+        self.full.indexation(corpus, parser, txtRepr, verbose, workers,
+                             positions, storeCompression)
+        self.tier.indexation(corpus, FieldParser(parser, self.fields),
+                             txtRepr, verbose, workers, store=False)
+
+    def save(self):
+        """ Write the manifests of both tiers, see Index.save() """
+        self.full.save()
+        self.tier.save()
+
+    @classmethod
+    def open(cls, name, out_dir, fields=TIER_FIELDS):
+        """ Reopen the tiers written by save(), see Index.open()
+        :param fields: the fields of the first tier, for the docs added
+            later
+        :return: a TieredIndex object
+        :raise StaleIndexError: if one of the tiers can't be opened"""
+        tiered = cls(name, out_dir, fields)
+        tiered.full = Index.open(name, out_dir)
+        tiered.tier = Index.open(name + "_tier", out_dir)
+        return tiered
+
+    def openMmap(self, warmup=False):
+        """ Map the files of both tiers in memory, the files of the first
+        tier are always prefetched.
+        :param warmup: bool, also prefetch the files of the full index
+        :return: None"""
+        self.full.openMmap(warmup)
+        self.tier.openMmap(warmup=True)
+
+    def closeMmap(self):
+        """ Unmap the files of both tiers """
+        self.full.closeMmap()
+        self.tier.closeMmap()
+
+    def addDocuments(self, parser, source, txtRepr=None, verbose=False):
+        """ Index new documents in both tiers, see Index.addDocuments()
+        :return: the new segment of the full index"""
+        segment = self.full.addDocuments(parser, source, txtRepr, verbose)
+        self.tier.addDocuments(FieldParser(parser, self.fields), source,
+                               txtRepr, verbose)
+        return segment
+
+    def getDocs(self, docIds):
+        """ Return some documents from the full index, see 
+        Index.getDocs() """
+        return self.full.getDocs(docIds)
+
+    def getSnippets(self, docIds, query, txtRepr=None, parser=None,
+                    length=200, highlight=None):
+        """ Return the snippets of some documents from the full index, 
+        see Index.getSnippets() """
+        return self.full.getSnippets(docIds, query, txtRepr, parser, length,
+                                     highlight)
+
+    def deleteDocuments(self, ids):
+        """ Delete documents from both tiers
+        :param ids: list of docs ID (int or string)
+        :return: int, the number of deleted docs"""
+        self.tier.deleteDocuments(ids)
+        return self.full.deleteDocuments(ids)
+
+    def waitForMerges(self):
+        """ Wait until the background merges of both tiers are finished """
+        self.full.waitForMerges()
+        self.tier.waitForMerges()
+
+    def compact(self, verbose=False):
+        """ Rewrite both tiers without their deleted docs, see
+        Index.compact() """
+        self.full.compact(verbose)
+        self.tier.compact(verbose)